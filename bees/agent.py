@@ -1,17 +1,67 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """ Agent object for instantiating agents in the environment. """
-import copy
-from typing import Tuple, List, Dict, Any, Optional
+from typing import Tuple, List, Dict, Any, Optional, Callable
 
 import numpy as np
 
 from bees.config import Config
-from bees.utils import one_hot
+from bees.population import Population
 
 # pylint: disable=bad-continuation, too-many-arguments, too-many-instance-attributes
 
 
+def _column(name: str, cast: Callable[[Any], Any]) -> property:
+    """ Returns a property which reads and writes the agent's row of ``name``. """
+
+    def getter(self: "Agent") -> Any:
+        return cast(getattr(self._population, name)[self._row])
+
+    def setter(self: "Agent", value: Any) -> None:
+        getattr(self._population, name)[self._row] = value
+
+    return property(getter, setter, doc="Column ``%s`` of the agent's row." % name)
+
+
+def get_reward_shapes(config: Config, num_actions: int) -> List[Tuple[int, int]]:
+    """
+    Computes the shape of each layer of the reward network.
+
+    Parameters
+    ----------
+    config : ``Config``.
+        Settings including ``reward_inputs``, ``sight_len``, ``num_obj_types``,
+        ``n_layers`` and ``hidden_dim``.
+    num_actions : ``int``.
+        The number of actions with which the input dimension of the reward
+        network is computed.
+
+    Returns
+    -------
+    reward_shapes : ``List[Tuple[int, int]]``.
+        The ``(input_dim, output_dim)`` shape of each layer.
+    """
+    # The ``+ 2`` is for the dimensions for current health and previous health.
+    obs_width = 2 * config.sight_len + 1
+    input_dim = 0
+    if "obs" in config.reward_inputs:
+        input_dim += (obs_width ** 2) * config.num_obj_types
+    if "actions" in config.reward_inputs:
+        input_dim += num_actions
+    if "health" in config.reward_inputs:
+        input_dim += 2
+
+    reward_shapes: List[Tuple[int, int]] = []
+    output_dim = config.hidden_dim
+    for i in range(config.n_layers):
+        if i == config.n_layers - 1:
+            output_dim = 1
+        reward_shapes.append((input_dim, output_dim))
+        input_dim = output_dim
+
+    return reward_shapes
+
+
 class Agent(Config):
     """
     An agent with position and health attributes. Note that all of the parameters are
@@ -47,8 +97,24 @@ class Agent(Config):
         Standard deviation for weight initialization distribution.
     mating_cooldown_len : ``int``, optional.
         How long agent must wait in between mate actions.
+
+    Notes
+    -----
+    The attributes ``pos``, ``health``, ``prev_health``, ``age``,
+    ``mating_cooldown``, ``num_children``, ``total_reward``, ``last_reward``,
+    ``observation``, ``reward_weights`` and ``reward_biases`` are stored in a row
+    of a ``Population`` table. A new agent owns a private single-row table until it
+    is moved into the environment's table with ``attach()``.
     """
 
+    health = _column("health", float)
+    prev_health = _column("prev_health", float)
+    age = _column("age", int)
+    mating_cooldown = _column("mating_cooldown", float)
+    num_children = _column("num_children", int)
+    total_reward = _column("total_reward", float)
+    last_reward = _column("last_reward", float)
+
     def __init__(
         self,
         config: Config,
@@ -62,6 +128,17 @@ class Agent(Config):
 
         # Initialize ``__dict__``.
         super().__init__(config.settings, mutable=True)
+        self.obs_width = 2 * config.sight_len + 1
+        self.obs_shape = (self.num_obj_types, self.obs_width, self.obs_width)
+        self.reward_shapes = get_reward_shapes(config, num_actions)
+        self.input_dim = self.reward_shapes[0][0]
+
+        # Row of the table holding the population-backed attributes. These bypass
+        # ``Config.__setattr__()`` so that they aren't added to ``self.settings``.
+        # The initial agent observation is the zeroed row of ``observation``.
+        population = Population(self.obs_shape, 1, self.reward_shapes)
+        dict.__setattr__(self, "_population", population)
+        dict.__setattr__(self, "_row", population.add(0))
 
         # Agent state.
         self.num_actions = num_actions
@@ -71,30 +148,15 @@ class Agent(Config):
         self.health = self.initial_health
         self.prev_health = self.initial_health
 
-        # Set initial agent observation.
-        self.obs_width = 2 * config.sight_len + 1
-        self.obs_shape = (self.num_obj_types, self.obs_width, self.obs_width)
-        self.observation: np.ndarray = np.zeros(self.obs_shape)
-
-        # Calculate input dimension of reward network.
-        # The ``+ 2`` is for the dimensions for current health and previous health.
-        self.input_dim = 0
-        if "obs" in self.reward_inputs:
-            self.input_dim += (self.obs_width ** 2) * self.num_obj_types
-        if "actions" in self.reward_inputs:
-            self.input_dim += self.num_actions
-        if "health" in self.reward_inputs:
-            self.input_dim += 2
-
-        # Initialize/set reward weights and biases.
+        # Initialize/set reward weights and biases. These are copied into the row.
         if reward_weights is None:
             self.initialize_reward_weights()
         else:
-            self.reward_weights = copy.deepcopy(reward_weights)
+            self.reward_weights = reward_weights
         if reward_biases is None:
             self.initialize_reward_biases()
         else:
-            self.reward_biases = copy.deepcopy(reward_biases)
+            self.reward_biases = reward_biases
 
         # Miscellaneous agent state.
         self.total_reward = 0.0
@@ -105,33 +167,110 @@ class Agent(Config):
         self.num_children = 0
         self.is_mature = False
 
+    def __setattr__(self, item: str, value: Any) -> None:
+        """ Routes population-backed attributes to their property setters. """
+        if isinstance(getattr(type(self), item, None), property):
+            dict.__setattr__(self, item, value)
+        else:
+            super().__setattr__(item, value)
+
+    @property
+    def pos(self) -> Tuple[int, int]:
+        """ Current grid position of the agent. """
+        return (
+            int(self._population.pos_x[self._row]),
+            int(self._population.pos_y[self._row]),
+        )
+
+    @pos.setter
+    def pos(self, pos: Tuple[int, int]) -> None:
+        self._population.pos_x[self._row] = pos[0]
+        self._population.pos_y[self._row] = pos[1]
+
+    @property
+    def observation(self) -> np.ndarray:
+        """ Current agent observation, as a view into the agent's row. """
+        observation: np.ndarray = self._population.observation[self._row]
+        return observation
+
+    @observation.setter
+    def observation(self, observation: np.ndarray) -> None:
+        self._population.observation[self._row] = observation
+
+    @property
+    def reward_weights(self) -> List[np.ndarray]:
+        """ Reward network weights, as views into the agent's row. """
+        population = self._population
+        columns = [getattr(population, name) for name in population.weight_columns]
+        return [column[self._row] for column in columns]
+
+    @reward_weights.setter
+    def reward_weights(self, reward_weights: List[np.ndarray]) -> None:
+        population = self._population
+        for name, weights in zip(population.weight_columns, reward_weights):
+            getattr(population, name)[self._row] = weights
+        population.reward_version[self._row] += 1  # type: ignore
+
+    @property
+    def reward_biases(self) -> List[np.ndarray]:
+        """ Reward network biases, as views into the agent's row. """
+        population = self._population
+        columns = [getattr(population, name) for name in population.bias_columns]
+        return [column[self._row] for column in columns]
+
+    @reward_biases.setter
+    def reward_biases(self, reward_biases: List[np.ndarray]) -> None:
+        population = self._population
+        for name, biases in zip(population.bias_columns, reward_biases):
+            getattr(population, name)[self._row] = biases
+        population.reward_version[self._row] += 1  # type: ignore
+
+    def attach(self, population: Population, agent_id: int) -> None:
+        """
+        Moves the population-backed state of the agent into a new row of
+        ``population``.
+
+        Parameters
+        ----------
+        population : ``Population``.
+            The table to move into, usually ``Env.population``.
+        agent_id : ``int``.
+            The id of the agent in the environment.
+        """
+        row = population.add(agent_id)
+        population.copy_row(self._population, self._row, row)
+        dict.__setattr__(self, "_population", population)
+        dict.__setattr__(self, "_row", row)
+
+    def detach(self) -> None:
+        """
+        Moves the population-backed state of the agent back into a private table
+        and frees its row in the shared table, e.g. when the agent dies.
+        """
+        private = Population(self.obs_shape, 1, self.reward_shapes)
+        private_row = private.add(0)
+        private.copy_row(self._population, self._row, private_row)
+        agent_id = int(self._population.row_ids[self._row])
+        self._population.remove(agent_id)
+        dict.__setattr__(self, "_population", private)
+        dict.__setattr__(self, "_row", private_row)
+
     def initialize_reward_weights(self) -> None:
         """ Initializes the weights of the reward function. """
 
-        self.reward_weights = []
-        input_dim = self.input_dim
-        output_dim = self.hidden_dim
-        for i in range(self.n_layers):
-            if i == self.n_layers - 1:
-                output_dim = 1
-            self.reward_weights.append(
-                np.random.normal(
-                    self.reward_weight_mean,
-                    self.reward_weight_stddev,
-                    size=(input_dim, output_dim),
-                )
+        self.reward_weights = [
+            np.random.normal(
+                self.reward_weight_mean, self.reward_weight_stddev, size=shape
             )
-            input_dim = output_dim
+            for shape in self.reward_shapes
+        ]
 
     def initialize_reward_biases(self) -> None:
         """ Initializes the biases of the reward function. """
 
-        self.reward_biases = []
-        output_dim = self.hidden_dim
-        for i in range(self.n_layers):
-            if i == self.n_layers - 1:
-                output_dim = 1
-            self.reward_biases.append(np.zeros((output_dim,)))
+        self.reward_biases = [
+            np.zeros((output_dim,)) for _, output_dim in self.reward_shapes
+        ]
 
     def compute_reward(self, action: int) -> float:
         """
@@ -154,36 +293,13 @@ class Agent(Config):
             health, action, and observation of the agent.
         """
 
-        input_arrays: List[np.ndarray] = []
-
-        remaining_inputs = list(self.reward_inputs)
-        if "obs" in remaining_inputs:
-            flat_obs = np.array(self.observation).flatten()
-            input_arrays.append(flat_obs)
-            remaining_inputs.remove("obs")
-        if "actions" in remaining_inputs:
-            flat_action = one_hot(action, self.num_actions)
-            input_arrays.append(flat_action)
-            remaining_inputs.remove("actions")
-        if "health" in remaining_inputs:
-            flat_healths = np.array([self.prev_health, self.health])
-            input_arrays.append(flat_healths)
-            remaining_inputs.remove("health")
-        if len(remaining_inputs) > 0:
-            raise ValueError(
-                "Unrecognized inputs to reward network: %s" % str(remaining_inputs)
-            )
-
-        inputs = np.concatenate(input_arrays)
-        reward = np.copy(inputs)
-
-        for i in range(self.n_layers):
-            reward = np.matmul(reward, self.reward_weights[i]) + self.reward_biases[i]
-            # ReLU.
-            if i < self.n_layers - 1:
-                reward = np.maximum(reward, 0)
+        rows = np.array([self._row])
+        actions = np.array([action])
+        reward = self._population.compute_rewards(
+            rows, actions, self.reward_inputs, self.num_actions
+        )
 
-        scalar_reward: float = float(reward)
+        scalar_reward: float = float(reward[0])
         self.total_reward += scalar_reward
         self.last_reward = scalar_reward
         return scalar_reward
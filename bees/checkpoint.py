@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Incremental checkpoints with tensors stored as content-addressed blobs. """
+import os
+import io
+import glob
+import queue
+import pickle
+import hashlib
+import threading
+from typing import Dict, List, Tuple, Set, Any, Optional, BinaryIO
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.weak import WeakIdKeyDictionary
+
+# Directory, next to the checkpoints, which holds the blobs.
+BLOB_DIR = "blobs"
+
+# Suffix of checkpoint files written by ``CheckpointWriter``.
+CHECKPOINT_SUFFIX = ".ckpt"
+
+# Tensors and arrays smaller than this are pickled along with the metadata.
+MIN_BLOB_BYTES = 1024
+
+# Digest, kind (``"tensor"``, ``"parameter"`` or ``"ndarray"``), numpy dtype string,
+# shape, device and ``requires_grad`` of a tensor or array stored as a blob.
+BlobRef = Tuple[Optional[str], str, str, Tuple[int, ...], str, bool]
+
+# pylint: disable=too-few-public-methods
+
+
+class _Pickler(pickle.Pickler):
+    """
+    Pickles all sufficiently large tensors and arrays as references to slots in a
+    table of blobs. Tensors whose digest is in ``digests`` and which haven't been
+    modified since it was computed are referenced by that digest. All other data is
+    copied into ``pending``, to be hashed and written later.
+    """
+
+    def __init__(
+        self,
+        file: BinaryIO,
+        digests: WeakIdKeyDictionary,
+        lock: threading.Lock,
+    ) -> None:
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.digests = digests
+        self.lock = lock
+        self.refs: List[BlobRef] = []
+        self.pending: Dict[int, Tuple[np.ndarray, Optional[torch.Tensor], int]] = {}
+
+        # Objects already given a slot, kept alive so that their ids aren't reused.
+        self.slots: Dict[int, int] = {}
+        self.objs: List[Any] = []
+
+    def persistent_id(self, obj: Any) -> Optional[int]:
+        if isinstance(obj, torch.Tensor):
+            if obj.layout != torch.strided or obj.is_meta:
+                return None
+            if obj.numel() * obj.element_size() < MIN_BLOB_BYTES:
+                return None
+        elif isinstance(obj, np.ndarray):
+            if obj.dtype.hasobject or obj.nbytes < MIN_BLOB_BYTES:
+                return None
+        else:
+            return None
+
+        # The same object must be loaded as a single object, e.g. a parameter which
+        # is referenced by both its module and its optimizer.
+        if id(obj) in self.slots:
+            return self.slots[id(obj)]
+        slot = len(self.refs)
+        self.slots[id(obj)] = slot
+        self.objs.append(obj)
+
+        if isinstance(obj, np.ndarray):
+            data = np.ascontiguousarray(obj).copy()
+            ref = (None, "ndarray", data.dtype.str, data.shape, "cpu", False)
+            self.refs.append(ref)
+            self.pending[slot] = (data, None, 0)
+            return slot
+
+        kind = "parameter" if isinstance(obj, nn.Parameter) else "tensor"
+        device = str(obj.device)
+        with self.lock:
+            cached = self.digests.get(obj)
+        if cached is not None and cached[0] == obj._version:
+            _, digest, dtype = cached
+            shape = tuple(obj.shape)
+            self.refs.append((digest, kind, dtype, shape, device, obj.requires_grad))
+            return slot
+
+        # Copy the tensor now, since training modifies it in place.
+        data = obj.detach().to("cpu", copy=True).contiguous().numpy()
+        ref = (None, kind, data.dtype.str, data.shape, device, obj.requires_grad)
+        self.refs.append(ref)
+        self.pending[slot] = (data, obj, obj._version)
+        return slot
+
+
+# Path, pickler holding the captured data, and pickled metadata of a saved state.
+_Capture = Tuple[str, _Pickler, bytes]
+
+
+class _Unpickler(pickle.Unpickler):
+    """ Loads the slots referenced by a ``_Pickler`` by memory-mapping blobs. """
+
+    def __init__(self, file: BinaryIO, refs: List[BlobRef], blob_dir: str) -> None:
+        super().__init__(file)
+        self.refs = refs
+        self.blob_dir = blob_dir
+        self.loaded: Dict[int, Any] = {}
+
+    def persistent_load(self, pid: Any) -> Any:
+        slot = int(pid)
+        if slot in self.loaded:
+            return self.loaded[slot]
+        digest, kind, dtype, shape, device, requires_grad = self.refs[slot]
+        assert digest is not None
+        path = os.path.join(self.blob_dir, digest)
+
+        # Copy-on-write, so the blob is never modified and pages are read lazily.
+        array = np.memmap(path, dtype=np.dtype(dtype), mode="c", shape=shape)
+        obj: Any = array
+        if kind != "ndarray":
+            tensor = torch.from_numpy(array)
+            if device != "cpu":
+                tensor = tensor.to(device)
+            if kind == "parameter":
+                tensor = nn.Parameter(tensor, requires_grad=requires_grad)
+            obj = tensor
+        self.loaded[slot] = obj
+        return obj
+
+
+class CheckpointWriter:
+    """
+    Writes checkpoints from a background thread, so that saving doesn't stall the
+    step loop.
+
+    A checkpoint is a small pickle of metadata in which each large tensor or array
+    is a reference to a blob named by the hash of its contents, in the ``blobs``
+    directory next to it. The step loop only pickles the metadata and copies the
+    tensors modified since the last save, e.g. the parameters of agents which have
+    been updated. Hashing and writing happen in the background. Blobs which already
+    exist are not rewritten, and blobs which are no longer referenced are deleted.
+
+    Parameters
+    ----------
+    save_dir : ``str``.
+        Directory in which checkpoints are written.
+    """
+
+    def __init__(self, save_dir: str) -> None:
+        self.save_dir = save_dir
+        self.blob_dir = os.path.join(save_dir, BLOB_DIR)
+        os.makedirs(self.blob_dir, exist_ok=True)
+
+        # Maps tensors to their version and the digest and dtype of their blob.
+        self.digests: WeakIdKeyDictionary = WeakIdKeyDictionary()
+        self.lock = threading.Lock()
+
+        # Number of saves which have started capturing but haven't been written.
+        self.in_flight = 0
+
+        # Digests referenced by each checkpoint, including ones from earlier runs.
+        self.references: Dict[str, Set[str]] = {}
+        pattern = os.path.join(glob.escape(save_dir), "*" + CHECKPOINT_SUFFIX)
+        for path in glob.glob(pattern):
+            with open(path, "rb") as checkpoint_file:
+                refs = pickle.load(checkpoint_file)["refs"]
+            self.references[path] = {ref[0] for ref in refs if ref[0] is not None}
+
+        # Captured states waiting to be written, and ``None`` to stop the thread.
+        self.queue: "queue.Queue[Optional[_Capture]]" = queue.Queue(maxsize=2)
+        self.error: Optional[BaseException] = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def save(self, path: str, state: Any) -> None:
+        """
+        Captures ``state`` and queues it to be written to ``path``. Blocks only to
+        copy modified tensors, or if two earlier saves are still being written.
+        """
+        self._raise()
+        with self.lock:
+            self.in_flight += 1
+        buffer = io.BytesIO()
+        pickler = _Pickler(buffer, self.digests, self.lock)
+        pickler.dump(state)
+        self.queue.put((path, pickler, buffer.getvalue()))
+
+    def wait(self) -> None:
+        """ Blocks until all queued checkpoints have been written. """
+        self.queue.join()
+        self._raise()
+
+    def close(self) -> None:
+        """ Waits for queued checkpoints to be written and stops the thread. """
+        self.queue.put(None)
+        self.thread.join()
+        self._raise()
+
+    def _raise(self) -> None:
+        """ Raises any error from the background thread in the caller. """
+        if self.error is not None:
+            raise RuntimeError("Writing checkpoint failed.") from self.error
+
+    def _run(self) -> None:
+        """ Writes queued checkpoints until ``close()`` is called. """
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            try:
+                if self.error is None:
+                    self._write(*item)
+            except BaseException as err:  # pylint: disable=broad-except
+                self.error = err
+            finally:
+                with self.lock:
+                    self.in_flight -= 1
+                self.queue.task_done()
+
+    def _write(self, path: str, pickler: _Pickler, state: bytes) -> None:
+        """ Writes the blobs of a captured state, and then its metadata. """
+        refs = list(pickler.refs)
+        for slot, (data, tensor, version) in pickler.pending.items():
+            digest = hashlib.blake2b(memoryview(data).cast("B"), digest_size=20)
+            hexdigest = digest.hexdigest()
+            blob_path = os.path.join(self.blob_dir, hexdigest)
+            if not os.path.isfile(blob_path):
+                _atomic_write(blob_path, data.tobytes())
+            refs[slot] = (hexdigest,) + refs[slot][1:]
+            if tensor is not None:
+                with self.lock:
+                    self.digests[tensor] = (version, hexdigest, data.dtype.str)
+
+        # The metadata is replaced atomically, after all of its blobs exist.
+        metadata = {"refs": refs, "state": state}
+        _atomic_write(path, pickle.dumps(metadata, protocol=pickle.HIGHEST_PROTOCOL))
+        self.references[path] = {ref[0] for ref in refs if ref[0] is not None}
+
+        # Delete blobs which no checkpoint references, unless a later save may
+        # already refer to them through cached digests.
+        with self.lock:
+            if self.in_flight > 1:
+                return
+            referenced = set().union(*self.references.values())
+            for blob_name in os.listdir(self.blob_dir):
+                if blob_name not in referenced and not blob_name.endswith(".tmp"):
+                    os.remove(os.path.join(self.blob_dir, blob_name))
+            for tensor, cached in list(self.digests.items()):
+                if cached[1] not in referenced:
+                    del self.digests[tensor]
+
+
+def _atomic_write(path: str, data: bytes) -> None:
+    """ Writes ``data`` to ``path`` such that readers never see a partial file. """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as tmp_file:
+        tmp_file.write(data)
+    os.replace(tmp_path, path)
+
+
+def load_state(path: str) -> Any:
+    """
+    Loads a checkpoint written by ``CheckpointWriter``, memory-mapping its blobs so
+    that they are only read from disk when accessed. Files with any other suffix are
+    read as plain pickles, as written by older versions.
+
+    Parameters
+    ----------
+    path : ``str``.
+        Path to the checkpoint.
+
+    Returns
+    -------
+    state : ``Any``.
+        The object passed to ``CheckpointWriter.save()``.
+    """
+    with open(path, "rb") as checkpoint_file:
+        metadata = pickle.load(checkpoint_file)
+    if not path.endswith(CHECKPOINT_SUFFIX):
+        return metadata
+    blob_dir = os.path.join(os.path.dirname(path), BLOB_DIR)
+    unpickler = _Unpickler(io.BytesIO(metadata["state"]), metadata["refs"], blob_dir)
+    return unpickler.load()
@@ -1,23 +1,181 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """ Functions for agent instantiation. """
-import copy
-import random
+import threading
 import collections
-from typing import Set, List, Dict, Tuple, Optional
+from typing import Any, List, Dict, Deque, Tuple, Optional
 
 import gym
 import numpy as np
 import torch
-import torch.multiprocessing as mp
 
 from bees.rl.algo import Algo, PPO, A2C_ACKTR
 from bees.rl.model import Policy, CNNBase, MLPBase
-from bees.rl.storage import RolloutStorage
+from bees.rl.storage import RolloutStorage, RolloutStore
+from bees.rl.bank import InitBank
+from bees.rl.utils import reset_optimizer
 
-from bees.pipe import Pipe
+from bees.pool import WorkerPool
 from bees.config import Config
-from bees.worker import worker_loop
+
+
+class PolicyFactory:
+    """
+    Hands out initialized agents and zeroed rollouts for births. Agents of dead
+    policies are handed back with ``release()``, and are reset in place before they
+    are handed out again. Rollouts are slots of a single ``RolloutStore``, which are
+    recycled on release.
+
+    If ``config.policy_reserve_size`` is positive, a bounded reserve of ready agents
+    is kept full by a background thread, so that bursts of births don't build
+    policies in the step loop. The thread draws initializations from the global
+    random state concurrently with the step loop, so runs with a reserve aren't
+    reproducible from ``config.seed``. The reserve is off by default for this
+    reason.
+
+    When ``config.reuse_state_dicts`` is set, each newly built policy adds its
+    initial parameters to a bounded ``InitBank``, and reset policies restore a
+    random initialization from the bank. Otherwise reset policies are reinitialized.
+
+    Parameters
+    ----------
+    config : ``Config``.
+        Config object parsed from settings file.
+    obs_space : ``gym.Space``.
+        Observation space from the environment.
+    act_space : ``gym.Space``.
+        Action space from the environment.
+    device : ``torch.device``.
+        The GPU/TPU/CPU.
+    """
+
+    def __init__(
+        self,
+        config: Config,
+        obs_space: gym.Space,
+        act_space: gym.Space,
+        device: torch.device,
+    ) -> None:
+        self.config = config
+        self.obs_space = obs_space
+        self.act_space = act_space
+        self.device = device
+        self.reserve_size: int = config.policy_reserve_size
+
+        # Initial parameters of built policies, for ``config.reuse_state_dicts``.
+        self.bank = InitBank(
+            config.init_bank_capacity, config.init_bank_eviction, config.init_bank_path
+        )
+
+        # Hyperparameters of a fresh optimizer, restored when resetting agents.
+        self.param_groups: List[Dict[str, Any]] = []
+
+        # Rollouts of all agents, built with the first agent.
+        self.store: Optional[RolloutStore] = None
+
+        self.reserve: Deque[Algo] = collections.deque()
+        self.released: List[Algo] = []
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """
+        Starts the background thread which fills the reserve, if there is one. State
+        such as ``self.bank`` must be loaded before this is called, since the thread
+        reads it without the main thread.
+        """
+        if self.reserve_size > 0 and self.thread is None:
+            self.thread = threading.Thread(target=self._refill, daemon=True)
+            self.thread.start()
+
+    def get(self, start: int = 0) -> Tuple[Algo, RolloutStorage]:
+        """
+        Returns an agent from the reserve, or makes one if it is empty, and a slot
+        of the rollout store for an agent whose first step is at index ``start`` of
+        the rollout.
+        """
+        agent: Optional[Algo] = None
+        with self.condition:
+            if self.reserve:
+                agent = self.reserve.popleft()
+                self.condition.notify()
+            else:
+                released = self.released.pop() if self.released else None
+        if agent is None:
+            agent = self._make(released)
+        return agent, self.get_store(agent).acquire(start)
+
+    def adopt(self, agent: Algo, rollouts: RolloutStorage) -> RolloutStorage:
+        """ Returns a slot of the rollout store holding a copy of ``rollouts``. """
+        return self.get_store(agent).adopt(rollouts)
+
+    def get_store(self, agent: Algo) -> RolloutStore:
+        """ Returns the rollout store, which is built for the first agent. """
+        if self.store is None:
+            # Observations are binary occupancy grids, so they're stored as bytes.
+            self.store = RolloutStore(
+                self.config.num_steps,
+                self.obs_space.shape,
+                self.act_space,
+                agent.actor_critic.recurrent_hidden_state_size,
+                obs_dtype=torch.uint8,
+                device=self.device,
+            )
+        return self.store
+
+    def release(self, agent: Algo, rollouts: RolloutStorage) -> None:
+        """ Hands back the agent and rollouts of a dead policy for reuse. """
+        if self.store is not None and rollouts.store is self.store:
+            self.store.release(rollouts)
+        with self.condition:
+            self.released.append(agent)
+            self.condition.notify()
+
+    def close(self) -> None:
+        """ Stops the background thread. """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _refill(self) -> None:
+        """ Keeps the reserve full until ``close()`` is called. """
+        while True:
+            with self.condition:
+                while not self.stopped and len(self.reserve) >= self.reserve_size:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                released = self.released.pop() if self.released else None
+            item = self._make(released)
+            with self.condition:
+                self.reserve.append(item)
+
+    def _make(self, released: Optional[Algo]) -> Algo:
+        """ Resets ``released`` in place if given, and otherwise builds an agent. """
+        if released is None:
+            agent = get_policy(
+                self.config, self.obs_space, self.act_space, self.device
+            )
+            with self.condition:
+                if not self.param_groups:
+                    self.param_groups = [
+                        {key: value for key, value in group.items() if key != "params"}
+                        for group in agent.optimizer.param_groups
+                    ]
+            if self.config.reuse_state_dicts:
+                self.bank.add(agent.actor_critic)
+            return agent
+
+        agent = released
+        if self.config.reuse_state_dicts and len(self.bank) > 0:
+            self.bank.restore(agent.actor_critic)
+        else:
+            reinitialize_policy(agent.actor_critic)
+        reset_optimizer(agent.optimizer, self.param_groups)
+        return agent
 
 
 def get_agent(
@@ -26,117 +184,66 @@ def get_agent(
     age: int,
     ob: np.ndarray,
     config: Config,
-    obs_space: gym.Space,
-    act_space: gym.Space,
+    factory: PolicyFactory,
     agents: Dict[int, Algo],
     rollout_map: Dict[int, RolloutStorage],
-    dead_agents: Set[Algo],
-    dead_pipes: Dict[int, Pipe],
-    state_dicts: List[collections.OrderedDict],
-    optim_state_dicts: List[collections.OrderedDict],
-) -> Tuple[Algo, RolloutStorage, Optional[mp.Process], Optional[Pipe], torch.device]:
-    """ Create an ``Algo`` object, and return pipes and workers if multiprocessed. """
-
-    # REMOVE
-    device = torch.device("cuda:0" if config.cuda else "cpu")
-    pipe: Optional[Pipe]
-
-    if config.mp:
-        pipe = Pipe()
+    pool: Optional[WorkerPool] = None,
+    start: int = 0,
+) -> Tuple[Algo, RolloutStorage, torch.device]:
+    """
+    Take an ``Algo`` object from ``factory``, unless ``agent_id`` already has one,
+    and send it to a worker in ``pool`` if multiprocessed. The rollouts of a new
+    agent begin at index ``start`` of the rollout, which is where its first
+    observation goes.
+    """
+    device = factory.device
+    if agent_id in agents:
+        agent = agents[agent_id]
+        rollouts = rollout_map[agent_id]
     else:
-        worker = None
-        pipe = None
+        agent, rollouts = factory.get(start)
 
-    # Test whether we can reuse previously instantiated policy
-    # objects, or if we need to create new ones.
-    if len(dead_agents) > 0:
-
-        # TODO: Pass in dead workers.
-        agent = dead_agents.pop()
+    # Hand the agent to a worker process.
+    # TODO: Consider calling ``get_policy`` in ``worker_loop()``.
+    if config.mp and pool is not None:
+        pool.add_agent(agent_id, agent, rollouts, age, iteration, ob)
 
-        # TODO: Consider reusing dead pipes.
+    return agent, rollouts, device
 
-        # TODO: Is this expensive?
-        if config.reuse_state_dicts:
-            state_dict = copy.deepcopy(random.choice(state_dicts))
-            optim_state_dict = copy.deepcopy(random.choice(optim_state_dicts))
 
-            # TODO: We may need to send these in a pipe.
-            # TODO: This is bound to be expensive.
-            # Load initialized state dicts.
-            agent.actor_critic.load_state_dict(state_dict)
-            agent.optimizer.load_state_dict(optim_state_dict)
-        else:
-
-            # Reinitialize the policy of ``agent.actor_critic``.
-            if isinstance(agent.actor_critic.base, CNNBase):
-                (
-                    agent.actor_critic.base.main,
-                    agent.actor_critic.base.critic_linear,
-                ) = CNNBase.init_weights(
-                    agent.actor_critic.base.main, agent.actor_critic.base.critic_linear,
-                )
-            elif isinstance(agent.actor_critic.base, MLPBase):
-                (
-                    agent.actor_critic.base.actor,
-                    agent.actor_critic.base.critic,
-                    agent.actor_critic.base.critic_linear,
-                ) = MLPBase.init_weights(
-                    agent.actor_critic.base.actor,
-                    agent.actor_critic.base.critic,
-                    agent.actor_critic.base.critic_linear,
-                )
-            else:
-                raise NotImplementedError
-
-        # Create new RolloutStorage object.
-        # TODO: Is this any slower than clearing data from the old one?
-        rollouts = RolloutStorage(
-            config.num_steps,
-            config.num_processes,
-            obs_space.shape,
-            act_space,
-            agent.actor_critic.recurrent_hidden_state_size,
+def reinitialize_policy(actor_critic: Policy) -> None:
+    """ Reinitialize the weights of ``actor_critic`` in place. """
+    if isinstance(actor_critic.base, CNNBase):
+        (
+            actor_critic.base.main,
+            actor_critic.base.critic_linear,
+        ) = CNNBase.init_weights(
+            actor_critic.base.main,
+            actor_critic.base.critic_linear,
         )
-
-    else:
-        # TODO: Do device assignment here.
-        if agent_id not in agents:
-            agent, rollouts = get_policy(config, obs_space, act_space, device)
-        else:
-            agent = agents[agent_id]
-            rollouts = rollout_map[agent_id]
-
-    # Create worker processes (need to implement worker reuse).
-    # TODO: Consider calling ``get_policy`` in ``worker_loop()``.
-    if config.mp and pipe:
-        worker = mp.Process(
-            target=worker_loop,
-            kwargs={
-                "device": device,
-                "agent": agent,
-                "rollouts": rollouts,
-                "config": config,
-                "initial_age": age,
-                "initial_iteration": iteration,
-                "initial_ob": ob,
-                "env_spout": pipe.env_spout,
-                "action_funnel": pipe.action_funnel,
-                "action_dist_funnel": pipe.action_dist_funnel,
-                "loss_funnel": pipe.loss_funnel,
-                "save_funnel": pipe.save_funnel,
-            },
+    elif isinstance(actor_critic.base, MLPBase):
+        (
+            actor_critic.base.actor,
+            actor_critic.base.critic,
+            actor_critic.base.critic_linear,
+        ) = MLPBase.init_weights(
+            actor_critic.base.actor,
+            actor_critic.base.critic,
+            actor_critic.base.critic_linear,
         )
-        worker.start()
-
-    return agent, rollouts, worker, device, pipe
+    else:
+        raise NotImplementedError
 
 
 def get_policy(
-    config: Config, obs_space: gym.Space, act_space: gym.Space, device: torch.device,
-) -> Tuple[Algo, RolloutStorage]:
+    config: Config,
+    obs_space: gym.Space,
+    act_space: gym.Space,
+    device: torch.device,
+) -> Algo:
     """
-    Spins up a new agent/policy.
+    Spins up a new agent/policy. Its rollouts are handed out by the rollout store
+    of ``PolicyFactory``.
 
     Parameters
     ----------
@@ -153,8 +260,6 @@ def get_policy(
     -------
     agent : ``Algo``.
         Agent object from a2c-ppo-acktr.
-    rollouts : ``RolloutStorage``.
-        The rollout object.
     """
 
     actor_critic = Policy(
@@ -190,11 +295,4 @@ def get_policy(
             actor_critic, config.value_loss_coef, config.entropy_coef, acktr=True
         )
 
-    rollouts = RolloutStorage(
-        config.num_steps,
-        config.num_processes,
-        obs_space.shape,
-        act_space,
-        actor_critic.recurrent_hidden_state_size,
-    )
-    return agent, rollouts
+    return agent
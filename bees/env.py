@@ -19,15 +19,19 @@ import pickle
 import torch
 import torch.nn.functional as F
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
 # Package imports.
 import gym
 
 # Bees imports.
-from bees.agent import Agent
+from bees.agent import Agent, get_reward_shapes
+from bees.population import Population
 from bees.genetics import get_child_reward_network
 from bees.config import Config
 from bees.utils import flat_action_to_tuple
+from bees.visual import render_frame
+from bees.checkpoint import CheckpointWriter, load_state
 
 # Settings for ``__repr__()``.
 PRINT_AGENT_STATS = True
@@ -65,6 +69,10 @@ class Env(Config):
         The initial proportion of food in the grid.
     initial_food_regen_prob : ``float``.
         The initial probability of food regeneration per square per timestep.
+    food_regen_sampling : ``str``.
+        How squares are sampled for food regeneration. One of ``"dense"``, which
+        draws a uniform sample for every square, or ``"geometric"``, which draws
+        the gaps between regenerating squares, and is faster for low probabilities.
     food_size_mean : ``float``.
         The mean of the Gaussian from which food size is sampled.
     food_size_stddev : ``float``.
@@ -118,10 +126,8 @@ class Env(Config):
         self.food_regen_prob = self.initial_food_regen_prob
 
         # Construct ``self.grid`` and ``self.id_map``.
-        self.grid = np.zeros((self.width, self.height, self.num_obj_types))
-        self.id_map: List[List[Dict[int, Set[int]]]] = [
-            [{} for y in range(self.height)] for x in range(self.width)
-        ]
+        self.padded_grid, self.grid = self._new_grid()
+        self.id_map = np.full((self.width, self.height), -1, dtype=np.int32)
 
         # Construct observation and action spaces.
         # HARDCODE
@@ -134,11 +140,25 @@ class Env(Config):
         high_obs = np.ones((self.num_obj_types, obs_len, obs_len), dtype=np.float32)
         self.observation_space = gym.spaces.Box(low_obs, high_obs)
 
+        # Preallocated output buffer for ``self.get_obs_batch()``.
+        self.obs_buffer = np.zeros((0,) + self.observation_space.shape, np.float32)
+
+        # Shapes of the layers of the reward network, which all agents share.
+        self.reward_shapes = get_reward_shapes(self.config, self.num_actions)
+
         self.agents: Dict[int, Agent] = {}
+        self.population = Population(
+            self.observation_space.shape, reward_shapes=self.reward_shapes
+        )
         self.agent_ids_created = 0
 
         self.avg_agent_lifetime: float = -1.0
 
+        # Cached optimal action distributions, mapping agent ids to the
+        # ``reward_version`` the distribution was computed with and the distribution.
+        self.action_dist_cache: Dict[int, Tuple[int, torch.Tensor]] = {}
+        self.action_dist_cache_temperature = float("nan")
+
         # Misc settings.
         # TODO: Why do we even have this?
         self.dones: Dict[int, bool] = {}
@@ -146,29 +166,51 @@ class Env(Config):
         self.iteration = 0
         self.iterations = self.time_steps // self.num_processes
 
+    def _new_grid(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Constructs an empty grid surrounded by a zero border of width
+        ``self.sight_len``, so that every field of vision lies within its bounds.
+
+        Returns
+        -------
+        padded_grid : ``np.ndarray``.
+            Grid including the zero border.
+            Shape: ``(width + 2 * sight_len, height + 2 * sight_len, num_obj_types)``.
+        grid : ``np.ndarray``.
+            View into the interior of ``padded_grid``, so that writes to the grid
+            are visible in the padded grid without any copying.
+            Shape: ``(width, height, num_obj_types)``.
+        """
+        pad = self.sight_len
+        padded_grid = np.zeros(
+            (self.width + 2 * pad, self.height + 2 * pad, self.num_obj_types)
+        )
+        grid = padded_grid[pad : pad + self.width, pad : pad + self.height]
+        return padded_grid, grid
+
     def fill(self) -> None:
         """
         Populate the environment with food and agents.
 
         Updates
         -------
+        self.padded_grid : ``np.ndarray``.
+            Zero-padded grid, of which ``self.grid`` is the interior.
         self.grid : ``np.ndarray``.
             Grid containing agents and food.
             Shape: ``(width, height, num_obj_types)``.
-        self.id_map : ``List[List[Dict[int, Set[int]]]]``.
-            List of lists in the shape of the grid which maps object type ids to
-            a set of object ids of objects of that type at that position in the grid.
+        self.id_map : ``np.ndarray``.
+            Occupancy array holding the id of the agent at each grid position, or
+            ``-1`` where there is no agent.
+            Shape: ``(width, height)``.
         self.num_foods : ``int``.
             Number of foods in the environment.
         """
         # TODO: Add updates from calls to ``self._place()``.
 
         # Reset ``self.grid`` and ``self.id_map``.
-        self.grid = np.zeros((self.width, self.height, self.num_obj_types))
-        self.id_map = [[{} for y in range(self.height)] for x in range(self.width)]
-        for obj_type_id in self.obj_type_ids.values():
-            for x, y in itertools.product(range(self.width), range(self.height)):
-                self.id_map[x][y][obj_type_id] = set()
+        self.padded_grid, self.grid = self._new_grid()
+        self.id_map = np.full((self.width, self.height), -1, dtype=np.int32)
         self.num_foods = 0
 
         # Set unique agent positions.
@@ -196,12 +238,16 @@ class Env(Config):
         -------
         self.agents : ``Dict[int, Agent]``.
             Map from agent ids to ``Agent`` objects.
+        self.population : ``Population``.
+            Table of population-backed agent state.
         self.iteration : ``int``.
             The current environment iteration.
         self.resetted : ``bool``.
             Whether the envrionment has been reset.
         self.dones : ``Dict[int, bool]``.
             Map from agent ids to death status.
+        self.action_dist_cache : ``Dict[int, Tuple[int, torch.Tensor]]``.
+            Cached optimal action distributions, cleared since ids are reused.
         self.fill() : ``Callable``.
             All updates made during calls to this function.
 
@@ -213,23 +259,29 @@ class Env(Config):
 
         # Reconstruct agents.
         self.agents = {}
+        self.population = Population(
+            self.observation_space.shape, self.num_agents, self.reward_shapes
+        )
         self.agent_ids_created = 0
         for _ in range(self.num_agents):
-            self.agents[self._new_agent_id()] = Agent(
+            agent = Agent(
                 config=self.config,
                 num_actions=self.num_actions,
                 pos=(0, 0),
                 initial_health=1,
             )
+            self._add_agent(self._new_agent_id(), agent)
 
         self.iteration = 0
         self.resetted = True
         self.dones = {}
+        self.action_dist_cache = {}
         self.fill()
 
         # Set initial agent observations
-        for _, agent in self.agents.items():
-            agent.observation = self._get_obs(agent.pos)
+        population = self.population
+        rows = population.rows(self.agents)
+        population.observation[rows] = self.get_obs_batch(population.positions(rows))
         obs = {i: agent.reset() for i, agent in self.agents.items()}
 
         return obs
@@ -271,7 +323,7 @@ class Env(Config):
     ) -> None:
         """
         Remove an object of type ``obj_type_id`` from the grid at ``pos``.
-        Optionally remove the object from ``self.id_map`` if it has an identifier.
+        Agents are also removed from ``self.id_map``.
 
         Parameters
         ----------
@@ -287,9 +339,10 @@ class Env(Config):
         self.grid : ``np.ndarray``.
             Grid containing agents and food.
             Shape: ``(width, height, num_obj_types)``.
-        self.id_map : ``List[List[Dict[int, Set[int]]]]``.
-            List of lists in the shape of the grid which maps object type ids to
-            a set of object ids of objects of that type at that position in the grid.
+        self.id_map : ``np.ndarray``.
+            Occupancy array holding the id of the agent at each grid position, or
+            ``-1`` where there is no agent.
+            Shape: ``(width, height)``.
         """
         x = pos[0]
         y = pos[1]
@@ -304,23 +357,21 @@ class Env(Config):
         self.grid[grid_idx] = 0
 
         # Remove from ``self.id_map``.
-        if obj_id is not None:
-            object_map: Dict[int, Set[int]] = self.id_map[x][y]
-            objects = object_map[obj_type_id]
-            if obj_id not in objects:
+        if obj_type_id == self.obj_type_ids["agent"]:
+            if obj_id is not None and self.id_map[pos] != obj_id:
                 raise ValueError(
                     "Object of type '%s' with identifier '%d' cannot be removed from\
                      grid position '(%d, %d)' since it does not exist there."
                     % (self.obj_type_names[obj_type_id], obj_id, x, y)
                 )
-            self.id_map[x][y][obj_type_id].remove(obj_id)
+            self.id_map[pos] = -1
 
     def _place(
         self, obj_type_id: int, pos: Tuple[int, int], obj_id: Optional[int] = None
     ) -> None:
         """
         Place an object of type ``obj_type_id`` at the grid at ``pos``.
-        Optionally place the object in ``self.id_map`` if it has an identifier.
+        Agents are also placed in ``self.id_map``.
 
         Parameters
         ----------
@@ -336,9 +387,10 @@ class Env(Config):
         self.grid : ``np.ndarray``.
             Grid containing agents and food.
             Shape: ``(width, height, num_obj_types)``.
-        self.id_map : ``List[List[Dict[int, Set[int]]]]``.
-            List of lists in the shape of the grid which maps object type ids to
-            a set of object ids of objects of that type at that position in the grid.
+        self.id_map : ``np.ndarray``.
+            Occupancy array holding the id of the agent at each grid position, or
+            ``-1`` where there is no agent.
+            Shape: ``(width, height)``.
         """
         x = pos[0]
         y = pos[1]
@@ -350,28 +402,19 @@ class Env(Config):
                 + f"of heterogeneous type '{obj_type_name}'."
             )
 
+        # Add to ``self.id_map``. Agents can never overlap, so the agent channel of
+        # ``self.grid`` is one exactly where ``self.id_map`` is nonnegative.
+        if obj_type_id == self.obj_type_ids["agent"]:
+            if self.id_map[pos] != -1:
+                raise ValueError(
+                    f"An agent already exists at grid position '({x}, {y})'."
+                )
+            self.id_map[pos] = obj_id
+
         # Add to ``self.grid``.
         grid_idx = pos + (obj_type_id,)
-        if obj_type_id == self.obj_type_ids["agent"] and self.grid[grid_idx] == 1:
-            raise ValueError(f"An agent already exists at grid position '({x}, {y})'.")
-
         self.grid[grid_idx] = 1
 
-        # Add to ``self.id_map``.
-        if obj_id is not None:
-            object_map: Dict[int, Set[int]] = self.id_map[x][y]
-            if obj_type_id not in object_map:
-                object_map[obj_type_id] = set()
-            objects = object_map[obj_type_id]
-            if obj_id in objects:
-                obj_type_name = self.obj_type_names[obj_type_id]
-                raise ValueError(
-                    f"Object of type '{obj_type_name}' with id '{obj_id}' cannot be "
-                    + f"placed at grid position '({x}, {y})' since an object of the "
-                    + "same type with the same id already exists there."
-                )
-            self.id_map[x][y][obj_type_id].add(obj_id)
-
     def _obj_exists(self, obj_type_id: int, pos: Tuple[int, int]) -> bool:
         """
         Check if an object of object type ``obj_type_id`` exists at the given position.
@@ -391,8 +434,7 @@ class Env(Config):
         Raises
         ------
         ValueError
-            If ``pos[i]`` < 0 for any i, or if ``obj_type_id`` is invalid, or if
-            ``self.grid`` and ``self.ip_map`` don't agree.
+            If ``pos[i]`` < 0 for any i, or if ``obj_type_id`` is invalid.
         """
 
         # Make sure position indices are nonnegative.
@@ -407,39 +449,14 @@ class Env(Config):
         ):
             raise ValueError(f"Object type id ``{obj_type_id}`` invalid.")
 
-        # Check grid.
+        # HARDCODE: agents are looked up in ``self.id_map``, all else in the grid.
+        if obj_type_id == self.obj_type_ids["agent"]:
+            in_id_map: bool = self.id_map[pos] != -1
+            return in_id_map
+
         grid_idx: Tuple[int, int, int] = pos + (obj_type_id,)
         in_grid: bool = self.grid[grid_idx] == 1
 
-        # HARDCODE: foods do not have unique identifiers, not in ``id_map``.
-        if obj_type_id == self.obj_type_ids["food"]:
-            return in_grid
-
-        # Check id_map.
-        x = pos[0]
-        y = pos[1]
-        object_map: Dict[int, Set[int]] = self.id_map[x][y]
-        if obj_type_id not in object_map:
-            in_id_map = False
-        else:
-            objects = self.id_map[x][y][obj_type_id]
-            in_id_map = False
-            if objects:
-                in_id_map = True
-
-        # Check for conflicts.
-        if in_grid != in_id_map:
-            raise ValueError(
-                "Conflict between ``self.grid`` and ``self.id_map``: ``self.grid`` returns '"
-                + str(in_grid)
-                + "' when asked if an object of type '"
-                + self.obj_type_names[obj_type_id]
-                + "' is at grid position '(%d, %d)', while ``self.id_map`` returns '"
-                % (x, y)
-                + str(in_id_map)
-                + "'."
-            )
-
         return in_grid
 
     def _plant(self) -> None:
@@ -448,8 +465,11 @@ class Env(Config):
 
         Updates
         -------
-        self._place() : ``Callable``.
-            Updates all variables updated by this function.
+        self.grid : ``np.ndarray``.
+            Grid containing agents and food.
+            Shape: ``(width, height, num_obj_types)``.
+        self.food_regen_prob : ``float``.
+            Probability of food regeneration per square, if ``self.adaptive_food``.
         self.num_foods : ``int``.
             Number of foods in the environment.
         """
@@ -462,17 +482,56 @@ class Env(Config):
             self.food_regen_prob = max(self.food_regen_prob, 0.0)
             self.food_regen_prob = min(self.food_regen_prob, 1.0)
 
-        # Sample whether or not to regenerate food for each square.
-        regen_samples = np.random.rand(self.width, self.height)
-        regen_locations = np.argwhere(regen_samples <= self.food_regen_prob)
+        # Sample which squares regenerate food.
+        if self.food_regen_sampling == "dense":
+            regen_samples = np.random.rand(self.width, self.height)
+            regen_xs, regen_ys = np.nonzero(regen_samples <= self.food_regen_prob)
+        elif self.food_regen_sampling == "geometric":
+            regen_squares = self._sample_geometric_squares(self.food_regen_prob)
+            regen_xs, regen_ys = np.unravel_index(
+                regen_squares, (self.width, self.height)
+            )
+        else:
+            raise ValueError(
+                f"Food regeneration sampling '{self.food_regen_sampling}' invalid."
+            )
+
+        # Set new food positions, counting only squares which had no food.
+        food = self.grid[:, :, self.obj_type_ids["food"]]
+        self.num_foods += int(np.count_nonzero(food[regen_xs, regen_ys] == 0))
+        food[regen_xs, regen_ys] = 1
+
+    def _sample_geometric_squares(self, prob: float) -> np.ndarray:
+        """
+        Samples each grid square independently with probability ``prob``, by drawing
+        the gaps between consecutive sampled squares from a geometric distribution.
+        This takes time proportional to the number of sampled squares rather than
+        the number of squares in the grid.
+
+        Parameters
+        ----------
+        prob : ``float``.
+            Probability with which each square is sampled.
 
-        # Set new food positions.
-        for food_pos in regen_locations:
-            food_pos_tuple: Tuple[int, int] = tuple(food_pos)  # type: ignore
-            assert len(food_pos_tuple) == 2
-            if not self._obj_exists(self.obj_type_ids["food"], food_pos_tuple):
-                self._place(self.obj_type_ids["food"], food_pos_tuple)
-                self.num_foods += 1
+        Returns
+        -------
+        squares : ``np.ndarray``.
+            Sorted flat indices of the sampled squares in a ``(width, height)`` grid.
+        """
+        num_squares = self.width * self.height
+        if prob <= 0.0:
+            return np.zeros((0,), dtype=np.int64)
+
+        # Draw gaps in batches somewhat larger than the expected number of samples.
+        batch_size = int(num_squares * prob + 3 * math.sqrt(num_squares * prob)) + 1
+        batches: List[np.ndarray] = []
+        last = -1
+        while last < num_squares:
+            squares = last + np.cumsum(np.random.geometric(prob, size=batch_size))
+            batches.append(squares)
+            last = squares[-1]
+        squares = np.concatenate(batches)
+        return squares[squares < num_squares]
 
     def _move(
         self, action_dict: Dict[int, Tuple[int, int, int]]
@@ -501,32 +560,150 @@ class Env(Config):
         action_dict : ``Dict[int, Tuple[int, int, int]]``.
             Maps agent ids to tuples of integer subactions.
         """
-        # Shuffle the keys.
-        shuffled_items = list(action_dict.items())
-        random.shuffle(shuffled_items)
-        for agent_id, action in shuffled_items:
-            agent = self.agents[agent_id]
-            pos = agent.pos
-            move, consume, mate = action
-            assert pos is not None
+        # Resolve all moves at once.
+        agent_ids = list(action_dict)
+        population = self.population
+        rows = population.rows(agent_ids)
+        moves = np.fromiter(
+            (action[0] for action in action_dict.values()),
+            dtype=np.int64,
+            count=len(agent_ids),
+        )
+        positions = population.positions(rows)
+        executed_moves = self._resolve_moves(agent_ids, positions, moves)
+
+        # Execute the moves which succeeded. The old positions are all cleared before
+        # any new positions are filled, since an agent may move into a position which
+        # was vacated by another agent in this step.
+        moved = executed_moves != self.STAY
+        moved_rows = rows[moved]
+        old_positions = positions[moved]
+        new_positions = old_positions + self._move_deltas()[executed_moves[moved]]
+        old_xs, old_ys = old_positions[:, 0], old_positions[:, 1]
+        new_xs, new_ys = new_positions[:, 0], new_positions[:, 1]
+        agent_obj_type_id = self.obj_type_ids["agent"]
+        moved_ids = self.id_map[old_xs, old_ys]
+        self.id_map[old_xs, old_ys] = -1
+        self.grid[old_xs, old_ys, agent_obj_type_id] = 0
+        self.id_map[new_xs, new_ys] = moved_ids
+        self.grid[new_xs, new_ys, agent_obj_type_id] = 1
+        population.pos_x[moved_rows] = new_xs
+        population.pos_y[moved_rows] = new_ys
+
+        # Replace the move subaction of agents which couldn't move with ``STAY``.
+        failed = np.flatnonzero(executed_moves != moves).tolist()
+        for i in failed:
+            _, consume, mate = action_dict[agent_ids[i]]
+            action_dict[agent_ids[i]] = (self.STAY, consume, mate)
 
-            new_pos = self._update_pos(pos, move)
+        return action_dict
 
-            # Validate new position.
-            out_of_bounds = False
-            if new_pos[0] < 0 or new_pos[0] >= self.width:
-                out_of_bounds = True
-            if new_pos[1] < 0 or new_pos[1] >= self.height:
-                out_of_bounds = True
+    def _move_deltas(self) -> np.ndarray:
+        """
+        Returns the change in position caused by each move.
 
-            if out_of_bounds or self._obj_exists(self.obj_type_ids["agent"], new_pos):
-                action_dict[agent_id] = (self.STAY, consume, mate)
-            else:
-                self._remove(self.obj_type_ids["agent"], pos, agent_id)
-                self._place(self.obj_type_ids["agent"], new_pos, agent_id)
-                agent.pos = new_pos
+        Returns
+        -------
+        deltas : ``np.ndarray``.
+            Position deltas indexed by move.
+            Shape: ``(num_moves, 2)``.
+        """
+        deltas = np.zeros((self.subaction_sizes[0], 2), dtype=np.int64)
+        deltas[self.UP] = (0, 1)
+        deltas[self.DOWN] = (0, -1)
+        deltas[self.LEFT] = (-1, 0)
+        deltas[self.RIGHT] = (1, 0)
+        return deltas
+
+    def _resolve_moves(
+        self, agent_ids: List[int], positions: np.ndarray, moves: np.ndarray
+    ) -> np.ndarray:
+        """
+        Computes which moves succeed without executing any of them. The result is
+        the same as executing the moves one at a time in a uniformly random order,
+        where a move succeeds if the target position is in bounds and holds no agent
+        at the time the move is executed.
+
+        Each agent is given a random priority (its place in that order). A move into
+        an empty position succeeds if it is the first move into that position. A move
+        into a position held by another agent can only succeed if that agent moves
+        away first, so it succeeds if it is the first move into that position after
+        the occupant's turn and the occupant's move succeeds. Since the occupant
+        always has a lower priority, these dependencies are resolved by iterating
+        along chains of moves in priority order. In particular, two agents trying to
+        swap positions both fail.
 
-        return action_dict
+        Parameters
+        ----------
+        agent_ids : ``List[int]``.
+            Ids of the moving agents.
+        positions : ``np.ndarray``.
+            Current positions of the agents.
+            Shape: ``(num_agents, 2)``.
+        moves : ``np.ndarray``.
+            Attempted move subactions of the agents.
+            Shape: ``(num_agents,)``.
+
+        Returns
+        -------
+        executed_moves : ``np.ndarray``.
+            Moves after replacing those which failed with ``self.STAY``.
+            Shape: ``(num_agents,)``.
+        """
+        num_agents = len(agent_ids)
+        if num_agents == 0:
+            return moves.copy()
+        priorities = np.random.permutation(num_agents)
+
+        # Compute target positions and mask out ``STAY`` and out-of-bounds moves.
+        targets = positions + self._move_deltas()[moves]
+        target_xs = np.clip(targets[:, 0], 0, self.width - 1)
+        target_ys = np.clip(targets[:, 1], 0, self.height - 1)
+        in_bounds = (target_xs == targets[:, 0]) & (target_ys == targets[:, 1])
+        movers = in_bounds & (moves != self.STAY)
+
+        # Find the index of the agent occupying each target. Occupants which are
+        # not in ``agent_ids`` never move, and are marked with ``num_agents``.
+        occupant_ids = self.id_map[target_xs, target_ys]
+        id_order = np.argsort(agent_ids)
+        sorted_ids = np.asarray(agent_ids)[id_order]
+        id_idxs = np.minimum(np.searchsorted(sorted_ids, occupant_ids), num_agents - 1)
+        occupants = np.where(
+            sorted_ids[id_idxs] == occupant_ids, id_order[id_idxs], num_agents
+        )
+        occupied = occupant_ids != -1
+
+        # Moves into a position before the occupant's turn always fail, as do moves
+        # into positions held by agents outside of ``agent_ids``.
+        padded_priorities = np.append(priorities, -1)
+        after_occupant = priorities > padded_priorities[occupants]
+        eligible = movers & (~occupied | (after_occupant & (occupants < num_agents)))
+
+        # Only the first eligible move into each target can succeed.
+        candidates = np.flatnonzero(eligible)
+        target_keys = target_xs[candidates] * self.height + target_ys[candidates]
+        order = np.lexsort((priorities[candidates], target_keys))
+        candidates = candidates[order]
+        sorted_keys = target_keys[order]
+        first = np.ones(len(candidates), dtype=bool)
+        first[1:] = sorted_keys[1:] != sorted_keys[:-1]
+        candidates = candidates[first]
+
+        # Moves into empty positions succeed, others succeed iff the occupant's does.
+        succeeded = np.zeros(num_agents, dtype=bool)
+        succeeded[candidates[~occupied[candidates]]] = True
+        pending = candidates[occupied[candidates]]
+        resolved = np.ones(num_agents, dtype=bool)
+        resolved[pending] = False
+        while len(pending) > 0:
+            ready = resolved[occupants[pending]]
+            ready_pending = pending[ready]
+            succeeded[ready_pending] = succeeded[occupants[ready_pending]]
+            resolved[ready_pending] = True
+            pending = pending[~ready]
+
+        executed_moves: np.ndarray = np.where(succeeded, moves, self.STAY)
+        return executed_moves
 
     def _consume(self, action_dict: Dict[int, Tuple[int, int, int]]) -> None:
         """
@@ -609,12 +786,7 @@ class Env(Config):
             for adj_pos in adj_positions:
                 if self._obj_exists(self.obj_type_ids["agent"], adj_pos):
                     mate_pos = adj_pos
-                    x = mate_pos[0]
-                    y = mate_pos[1]
-
-                    # Get copy of set of agent ids to retrieve ``dad_id``.
-                    agent_id_set = self.id_map[x][y][self.obj_type_ids["agent"]].copy()
-                    dad_id = agent_id_set.pop()
+                    dad_id = int(self.id_map[mate_pos])
                     dad = self.agents[dad_id]
 
                     # Otherwise, continue looking for mate
@@ -672,7 +844,7 @@ class Env(Config):
                         reward_biases=reward_biases,
                     )
                     child_id = self._new_agent_id()
-                    self.agents[child_id] = child
+                    self._add_agent(child_id, child)
                     child_ids.add(child_id)
 
                     self._place(self.obj_type_ids["agent"], child_pos, child_id)
@@ -686,8 +858,9 @@ class Env(Config):
         self, greedy_temperature: float
     ) -> Dict[int, torch.Tensor]:
         """
-        Iterates over the action space and compute the optimal action distribution for
-        each agent.
+        Computes the optimal action distribution for each agent, i.e. the softmax of
+        the rewards of all actions, with a single batched evaluation of the reward
+        networks. Does not modify the agents.
 
         Parameters
         ----------
@@ -696,6 +869,14 @@ class Env(Config):
             value of this variable goes to zero, the optimal distribution gets more
             greedy. This value should be between 0 and 1.
 
+        Updates
+        -------
+        self.action_dist_cache : ``Dict[int, Tuple[int, torch.Tensor]]``.
+            Cached distributions, only kept when ``self.reward_inputs`` is
+            ``["actions"]``.
+        self.action_dist_cache_temperature : ``float``.
+            Temperature with which the cached distributions were computed.
+
         Returns
         -------
         optimal_action_dists : ``Dict[int, torch.Tensor]``.
@@ -703,24 +884,41 @@ class Env(Config):
             agent.
         """
 
-        optimal_action_dists: Dict[int, torch.Tensor] = {}
-
-        for agent_id, agent in self.agents.items():
-            action_rewards = torch.zeros((self.num_actions,))
-            for action in range(self.num_actions):
-                action_rewards[action] = agent.compute_reward(action)
+        agent_ids = list(self.agents)
+        rows = self.population.rows(agent_ids)
+
+        # When the reward depends only on the action, each agent's distribution is
+        # constant until its reward network or the temperature changes.
+        cacheable = list(self.reward_inputs) == ["actions"]
+        if not cacheable or greedy_temperature != self.action_dist_cache_temperature:
+            self.action_dist_cache = {}
+            self.action_dist_cache_temperature = greedy_temperature
+        versions = self.population.reward_version[rows].tolist()
+        stale = [
+            i
+            for i, (agent_id, version) in enumerate(zip(agent_ids, versions))
+            if self.action_dist_cache.get(agent_id, (-1,))[0] != version
+        ]
 
-            # Flatten action_rewards, perform softmax, and return to original shape.
-            # This is because torch.nn.functional.softmax only computes softmax along
-            # a single dimension.
-            action_rewards = torch.reshape(action_rewards, (-1,))
-            optimal_action_dists[agent_id] = F.softmax(
-                action_rewards / greedy_temperature, dim=0
-            )
-            action_rewards = torch.reshape(action_rewards, (self.num_actions,))
-            optimal_action_dists[agent_id] = torch.reshape(
-                optimal_action_dists[agent_id], (self.num_actions,)
-            )
+        # Compute the distributions of agents without a valid cached distribution.
+        action_rewards = self.population.compute_action_rewards(
+            rows[stale], self.reward_inputs, self.num_actions
+        )
+        dists = F.softmax(
+            torch.from_numpy(action_rewards).float() / greedy_temperature, dim=1
+        )
+        for i, dist in zip(stale, dists):
+            self.action_dist_cache[agent_ids[i]] = (versions[i], dist.clone())
+
+        optimal_action_dists: Dict[int, torch.Tensor] = {
+            agent_id: self.action_dist_cache[agent_id][1] for agent_id in agent_ids
+        }
+        if not cacheable:
+            self.action_dist_cache = {}
+        else:
+            self.action_dist_cache = {
+                agent_id: self.action_dist_cache[agent_id] for agent_id in agent_ids
+            }
 
         return optimal_action_dists
 
@@ -740,41 +938,57 @@ class Env(Config):
             Shape: ``(num_obj_types, obs_len, obs_len)``.
         """
 
-        # Calculate bounds of field of vision.
-        x = pos[0]
-        y = pos[1]
-        sight_left = x - self.sight_len
-        sight_right = x + self.sight_len
-        sight_bottom = y - self.sight_len
-        sight_top = y + self.sight_len
-
-        # Calculate length of zero-padding in case sight goes out of bounds.
-        pad_left = max(-sight_left, 0)
-        pad_right = max(sight_right - self.width + 1, 0)
-        pad_bottom = max(-sight_bottom, 0)
-        pad_top = max(sight_top - self.height + 1, 0)
-
-        # Constrain field of vision within grid bounds.
-        sight_left = max(sight_left, 0)
-        sight_right = min(sight_right, self.width - 1)
-        sight_bottom = max(sight_bottom, 0)
-        sight_top = min(sight_top, self.height - 1)
-
-        # Construct observation.
+        # The window in ``self.padded_grid`` starting at ``pos`` is centered on
+        # ``pos`` in ``self.grid``, since the padding is ``self.sight_len`` wide.
+        x, y = pos
         obs_len = 2 * self.sight_len + 1
-        agent_obs = np.zeros((obs_len, obs_len, self.num_obj_types))
-        pad_x_len = obs_len - pad_left - pad_right
-        pad_y_len = obs_len - pad_top - pad_bottom
-        agent_obs[
-            pad_left : pad_left + pad_x_len, pad_bottom : pad_bottom + pad_y_len
-        ] = self.grid[sight_left : sight_right + 1, sight_bottom : sight_top + 1]
+        window = self.padded_grid[x : x + obs_len, y : y + obs_len]
 
         # Policy network expects number of channels in first dimension.
-        agent_obs = np.swapaxes(agent_obs, 0, 2)
-        agent_obs = np.swapaxes(agent_obs, 1, 2)
+        agent_obs = np.transpose(window, (2, 0, 1)).astype(np.float32)
 
         return agent_obs
 
+    def get_obs_batch(self, positions: np.ndarray) -> np.ndarray:
+        """
+        Returns the observations from many positions at once. Each observation is
+        a window of ``self.padded_grid``, so all of them are gathered with a single
+        fancy index into a strided view of the windows, without a Python loop.
+
+        Parameters
+        ----------
+        positions : ``np.ndarray``.
+            Integer grid positions as ``(x, y)`` pairs.
+            Shape: ``(num_positions, 2)``.
+
+        Updates
+        -------
+        self.obs_buffer : ``np.ndarray``.
+            Grown (by at least doubling) if it has fewer than ``num_positions`` rows.
+
+        Returns
+        -------
+        obs_batch : ``np.ndarray``.
+            The observations from the given positions. This is a view into
+            ``self.obs_buffer``, which is overwritten by the next call.
+            Shape: ``(num_positions, num_obj_types, obs_len, obs_len)``.
+        """
+        num_positions = len(positions)
+        if len(self.obs_buffer) < num_positions:
+            capacity = max(num_positions, 2 * len(self.obs_buffer))
+            self.obs_buffer = np.zeros(
+                (capacity,) + self.observation_space.shape, dtype=np.float32
+            )
+
+        # Shape: ``(width, height, num_obj_types, obs_len, obs_len)``.
+        obs_len = 2 * self.sight_len + 1
+        windows = sliding_window_view(self.padded_grid, (obs_len, obs_len), (0, 1))
+
+        obs_batch: np.ndarray = self.obs_buffer[:num_positions]
+        obs_batch[:] = windows[positions[:, 0], positions[:, 1]]
+
+        return obs_batch
+
     def step(
         self, action_dict: Dict[int, int]
     ) -> Tuple[
@@ -817,8 +1031,9 @@ class Env(Config):
         infos: Dict[int, Any] = {}
 
         # Set previous health values.
-        for agent_id, agent in self.agents.items():
-            agent.prev_health = agent.health
+        population = self.population
+        rows = population.rows(self.agents)
+        population.prev_health[rows] = population.health[rows]
 
         # Execute actions (move, consume, and mate).
         tuple_action_dict = self._move(tuple_action_dict)
@@ -834,15 +1049,25 @@ class Env(Config):
         # Plant new food.
         self._plant()
 
-        # Compute reward.
-        for agent_id, agent in self.agents.items():
-            if agent_id not in child_ids:
-                # Note that ``compute_reward`` takes the action in integer form, so we
-                # use ``action_dict`` here instead of ``tuple_action_dict``.
-                rewards[agent_id] = agent.compute_reward(action_dict[agent_id])
-            # First reward for children is zero.
-            elif agent_id in child_ids:
-                rewards[agent_id] = 0
+        # Compute reward with a single batched evaluation of all reward networks.
+        # Note that ``compute_rewards`` takes actions in integer form, so we use
+        # ``action_dict`` here instead of ``tuple_action_dict``. First reward for
+        # children is zero.
+        parent_ids = [agent_id for agent_id in self.agents if agent_id not in child_ids]
+        parent_rows = population.rows(parent_ids)
+        parent_actions = np.fromiter(
+            (action_dict[agent_id] for agent_id in parent_ids),
+            dtype=np.int64,
+            count=len(parent_ids),
+        )
+        parent_rewards = population.compute_rewards(
+            parent_rows, parent_actions, self.reward_inputs, self.num_actions
+        )
+        population.total_reward[parent_rows] += parent_rewards
+        population.last_reward[parent_rows] = parent_rewards
+        rewards = dict(zip(parent_ids, parent_rewards.tolist()))
+        for child_id in child_ids:
+            rewards[child_id] = 0.0
 
         # Compute optimal action distribution for each agent for this timestep.
         # This "+1" is here because we don't increment ``self.iteration`` until
@@ -855,46 +1080,63 @@ class Env(Config):
             for agent_id in self.agents:
                 infos[agent_id]["optimal_action_dist"] = optimal_action_dists[agent_id]
 
-        # Decrease agent health, compute observations and dones.
-        killed_agent_ids = []
-        for agent_id, agent in self.agents.items():
-            if self.aging_type == "linear":
-                agent.health -= self.aging_rate
-            elif self.aging_type == "quadratic":
-                agent.health -= self.aging_rate * agent.age
-            else:
-                raise NotImplementedError
-
-            # Update mating cooldown.
-            agent.mating_cooldown = max(0, agent.mating_cooldown - 1)
-
-            obs[agent_id] = self._get_obs(agent.pos)
-            agent.observation = obs[agent_id]
-
-            dones[agent_id] = agent.health <= 0.0
+        # Decrease agent health and update mating cooldowns. Note that ``rows`` is
+        # recomputed since children may have been added by ``self._mate()``.
+        agent_ids = list(self.agents)
+        rows = population.rows(agent_ids)
+        if self.aging_type == "linear":
+            population.health[rows] -= self.aging_rate
+        elif self.aging_type == "quadratic":
+            population.health[rows] -= self.aging_rate * population.age[rows]
+        else:
+            raise NotImplementedError
+        cooldowns = population.mating_cooldown[rows] - 1
+        population.mating_cooldown[rows] = np.maximum(cooldowns, 0)
 
-            # Kill agent if ``dones[agent_id]`` and remove from ``self.grid``.
-            if dones[agent_id]:
+        # Compute dones.
+        done_mask = population.health[rows] <= 0.0
+        dones = dict(zip(agent_ids, done_mask.tolist()))
 
-                self._remove(self.obj_type_ids["agent"], agent.pos, agent_id)
-                agent.pos = self.HEAVEN
-                killed_agent_ids.append(agent_id)
+        # Kill agents which are done and remove them from ``self.grid``.
+        killed_rows = rows[done_mask]
+        killed_agent_ids = population.row_ids[killed_rows].tolist()
+        for killed_agent_id in killed_agent_ids:
+            self._remove(
+                self.obj_type_ids["agent"],
+                self.agents[killed_agent_id].pos,
+                killed_agent_id,
+            )
 
-                # Update average agent lifetime
-                if self.avg_agent_lifetime < -1.0:
-                    self.avg_agent_lifetime = agent.age
-                else:
-                    self.avg_agent_lifetime = (
-                        ALPHA * self.avg_agent_lifetime + (1 - ALPHA) * agent.age
-                    )
+        # Compute observations. These are computed after killed agents are removed
+        # from ``self.grid``, so that no agent observes an agent which just died, and
+        # before killed agents are moved to heaven, so that they get a final
+        # observation from where they died. The values of ``obs`` are views into the
+        # ``observation`` column of ``self.population``.
+        population.observation[rows] = self.get_obs_batch(population.positions(rows))
+        for agent_id, row in zip(agent_ids, rows.tolist()):
+            obs[agent_id] = population.observation[row]
+
+        population.pos_x[killed_rows] = self.HEAVEN[0]
+        population.pos_y[killed_rows] = self.HEAVEN[1]
+
+        # Update average agent lifetime. This is the exponential moving average
+        # over the killed agents (in order) written in closed form.
+        if len(killed_rows) > 0:
+            killed_ages = population.age[killed_rows]
+            decays = ALPHA ** np.arange(len(killed_ages) - 1, -1, -1)
+            self.avg_agent_lifetime = float(
+                ALPHA ** len(killed_ages) * self.avg_agent_lifetime
+                + (1 - ALPHA) * np.dot(decays, killed_ages)
+            )
 
-            # Update agent ages and update infos dictionary
-            agent.age += 1
-            infos[agent_id]["age"] = agent.age
+        # Update agent ages and update infos dictionary.
+        population.age[rows] += 1
+        for agent_id, age in zip(agent_ids, population.age[rows].tolist()):
+            infos[agent_id]["age"] = age
 
-        # Remove killed agents from self.agents
+        # Remove killed agents from ``self.agents`` and ``self.population``.
         for killed_agent_id in killed_agent_ids:
-            self.agents.pop(killed_agent_id)
+            self.agents.pop(killed_agent_id).detach()
 
         if self.iteration == self.iterations - 1:
             for agent_id in dones:
@@ -951,60 +1193,40 @@ class Env(Config):
 
     def visual(self) -> str:
         """
-        Returns a representation of the environment state.
+        Returns a representation of the environment state. The grid is rendered from
+        ``self.id_map`` and the food channel of ``self.grid`` as whole arrays.
 
         Returns
         -------
         output : ``str``.
             ASCII image of grid along with various statistics and metrics.
         """
-        output = "\n"
+        agent_mask = self.id_map != -1
+        food_mask = self.grid[:, :, self.obj_type_ids["food"]] == 1
 
-        # Print grid.
-        for y in range(self.height):
-            for x in range(self.width):
-
-                pos = (x, y)
-                object_id = "_"
-
-                # Check if there is an agent in ``pos``.
-                if self._obj_exists(self.obj_type_ids["agent"], pos):
-                    object_id = "B"
-                # NOTE: ``B`` currently overwrites ``*``.
-                # Check if there is a food in ``pos``.
-                elif self._obj_exists(self.obj_type_ids["food"], pos):
-                    object_id = "*"
-
-                output += object_id + " "
-
-            output += "\n"
-
-        output += "\n"
-        output += "===LOGPLAY_ANCHOR===\n\n"
-
-        # Print agent stats.
+        # Stats of the first ``num_displayed_agents`` living agents.
+        agent_lines: List[str] = []
+        num_living_agents = 0
         if PRINT_AGENT_STATS:
-            num_agents_printed = 0
-            num_living_agents = 0
+            rows = self.population.rows(self.agents)
+            num_living_agents = int(np.count_nonzero(self.population.health[rows] > 0))
             for agent_id, agent in self.agents.items():
+                if len(agent_lines) >= self.config.num_displayed_agents:
+                    break
                 if agent.health > 0.0:
-                    num_living_agents += 1
-                if (
-                    agent.health > 0.0
-                    and num_agents_printed < self.config.num_displayed_agents
-                ):
-                    output += "Agent %d: " % agent_id
-                    output += agent.__repr__()
-                    num_agents_printed += 1
-            output += "Num living agents: %d.\n" % num_living_agents
-            output += "Num foods: %d.\n" % self.num_foods
-            output += "\n"
-
-        output += "Step: %d\n" % self.iteration
-
-        return output
-
-    def log_state(self, env_log: TextIO, visual_log: TextIO) -> None:
+                    agent_lines.append("Agent %d: " % agent_id + agent.__repr__())
+
+        return render_frame(
+            agent_mask,
+            food_mask,
+            self.iteration,
+            num_living_agents,
+            self.num_foods,
+            agent_lines,
+            PRINT_AGENT_STATS,
+        )
+
+    def log_state(self, env_log: TextIO) -> None:
         """
         Logs the state of the environment as a string to a
         prespecified log file path.
@@ -1014,7 +1236,14 @@ class Env(Config):
         env_state = self._env_json_state()
         env_log.write(str(env_state) + "\n")
 
-        # Write to visual log, and print visualization if settings["env"]["print"].
+    def render(self, visual_log: Optional[TextIO] = None) -> None:
+        """
+        Builds the visualization of the environment, prints it if
+        ``self.print_repr`` is set, and writes it to ``visual_log`` if given.
+        Nothing is built if neither is requested.
+        """
+        if not self.print_repr and visual_log is None:
+            return
         visual = self.visual()
         if self.print_repr:
             if PRINT_FAST:
@@ -1022,7 +1251,29 @@ class Env(Config):
             else:
                 os.system("clear")
             print(visual)
-        visual_log.write(visual + 40 * "\n")
+        if visual_log is not None:
+            visual_log.write(visual + 40 * "\n")
+
+    def _add_agent(self, agent_id: int, agent: Agent) -> None:
+        """
+        Adds ``agent`` to the environment under ``agent_id``.
+
+        Parameters
+        ----------
+        agent_id : ``int``.
+            A new unique agent id.
+        agent : ``Agent``.
+            The agent to add.
+
+        Updates
+        -------
+        self.agents : ``Dict[int, Agent]``.
+            Map from agent ids to ``Agent`` objects.
+        self.population : ``Population``.
+            Table of population-backed agent state.
+        """
+        self.agents[agent_id] = agent
+        agent.attach(self.population, agent_id)
 
     def _new_agent_id(self) -> int:
         """
@@ -1076,23 +1327,30 @@ class Env(Config):
 
         return state
 
-    def save(self, save_path: str) -> None:
+    def save(self, save_path: str, writer: Optional[CheckpointWriter] = None) -> None:
         """
-        Saves a .pkl representation of the environment state.
+        Saves a .pkl representation of the environment state, or a checkpoint if
+        ``writer`` is given.
 
         Parameters
         ----------
         save_path : str.
             Path to save environment pickle object.
+        writer : ``Optional[CheckpointWriter]``, optional.
+            Writes the state in the background as an incremental checkpoint.
         """
 
         state = self._env_state()
+        if writer is not None:
+            writer.save(save_path, state)
+            return
         with open(save_path, "wb") as f:
             pickle.dump(state, f)
 
     def load(self, load_path: str) -> None:
         """
-        Loads a .pkl representation (from self.save()) of the environment state.
+        Loads a .pkl representation or checkpoint (from self.save()) of the
+        environment state.
 
         Parameters
         ----------
@@ -1100,25 +1358,28 @@ class Env(Config):
             Path to load environment pickle object from.
         """
 
-        with open(load_path, "rb") as f:
-            state = pickle.load(f)
+        state = load_state(load_path)
 
         # Get environment attributes
         env_attrs = [
             "iteration",
             "num_foods",
             "avg_agent_lifetime",
-            "grid",
-            "id_map",
             "agent_ids_created",
         ]
         for env_attr in env_attrs:
             setattr(self, env_attr, state[env_attr])
+        self.padded_grid, self.grid = self._new_grid()
+        self.grid[:] = state["grid"]
 
         # Construct agents
         self.agents = {}
+        self.action_dist_cache = {}
+        self.population = Population(
+            self.observation_space.shape, len(state["agents"]), self.reward_shapes
+        )
         for agent_id, agent_state in state["agents"].items():
-            self.agents[agent_id] = Agent(
+            agent = Agent(
                 config=self.config,
                 num_actions=self.num_actions,
                 pos=agent_state["pos"],
@@ -1127,10 +1388,18 @@ class Env(Config):
                 reward_biases=agent_state["reward_biases"],
             )
             for attr, value in agent_state.items():
-                setattr(self.agents[agent_id], attr, value)
+                setattr(agent, attr, value)
+            self._add_agent(agent_id, agent)
+
+        # Rebuild ``self.id_map`` from agent positions, which also supports states
+        # saved with older ``self.id_map`` formats.
+        population = self.population
+        rows = population.rows(self.agents)
+        self.id_map = np.full((self.width, self.height), -1, dtype=np.int32)
+        agent_xs, agent_ys = population.pos_x[rows], population.pos_y[rows]
+        self.id_map[agent_xs, agent_ys] = population.row_ids[rows]
 
         # Construct agent observations
-        for agent_id, agent in self.agents.items():
-            agent.observation = self._get_obs(agent.pos)
+        population.observation[rows] = self.get_obs_batch(population.positions(rows))
 
         print("Loaded!")
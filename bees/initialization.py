@@ -3,13 +3,13 @@
 """ Trainer initialization class. """
 import os
 import json
-import pickle
 import shutil
 import argparse
 import datetime
 from typing import TextIO, Any, Dict
 from bees.utils import get_token, validate_args
 from bees.config import Config
+from bees.checkpoint import CHECKPOINT_SUFFIX, load_state
 
 # pylint: disable=too-few-public-methods
 
@@ -57,17 +57,20 @@ class Setup:
             codename = os.path.basename(os.path.abspath(args.load_from))
             token = codename.split("_")[0]
 
-            # Construct paths.
-            env_filename = codename + "_env.pkl"
-            trainer_filename = codename + "_trainer.pkl"
+            # Construct paths, falling back to pickles saved by older versions.
+            suffix = CHECKPOINT_SUFFIX
+            env_checkpoint = codename + "_env" + suffix
+            if not os.path.isfile(os.path.join(args.load_from, env_checkpoint)):
+                suffix = ".pkl"
+            env_filename = codename + "_env" + suffix
+            trainer_filename = codename + "_trainer" + suffix
             settings_filename = codename + "_settings.json"
             env_state_path = os.path.join(args.load_from, env_filename)
             trainer_state_path = os.path.join(args.load_from, trainer_filename)
             settings_path = os.path.join(args.load_from, settings_filename)
 
-            # Load trainer state.
-            with open(trainer_state_path, "rb") as trainer_file:
-                trainer_state = pickle.load(trainer_file)
+            # Load trainer state. Checkpoint tensors are read lazily.
+            trainer_state = load_state(trainer_state_path)
 
         # New training run.
         elif args.settings:
@@ -97,6 +100,7 @@ class Setup:
         env_log_path = os.path.join(save_dir, env_log_filename)
         visual_log_path = os.path.join(save_dir, visual_log_filename)
         metrics_log_path = os.path.join(save_dir, metrics_log_filename)
+        state_log_dir = os.path.join(save_dir, codename + "_state_log")
 
         # If ``save_dir`` is not the same as ``load_from`` we must copy the existing logs
         # into the new save directory, then contine to append to them.
@@ -116,6 +120,14 @@ class Setup:
             visual_log_path = new_visual_log_path
             metrics_log_path = new_metrics_log_path
 
+        # Copy the chunks of the binary state log, if one was written elsewhere.
+        if args.load_from:
+            old_state_log_dir = os.path.join(args.load_from, codename + "_state_log")
+            if os.path.isdir(old_state_log_dir) and os.path.abspath(
+                old_state_log_dir
+            ) != os.path.abspath(state_log_dir):
+                shutil.copytree(old_state_log_dir, state_log_dir, dirs_exist_ok=True)
+
         # Open logs.
         env_log = open(env_log_path, "a+")
         visual_log = open(visual_log_path, "a+")
@@ -128,5 +140,6 @@ class Setup:
         self.env_log: TextIO = env_log
         self.visual_log: TextIO = visual_log
         self.metrics_log: TextIO = metrics_log
+        self.state_log_dir: str = state_log_dir
         self.env_state_path: str = env_state_path
         self.trainer_state: Dict[str, Any] = trainer_state
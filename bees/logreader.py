@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Streaming, indexed readers for the text environment logs. """
+import os
+import re
+import ast
+from typing import Dict, List, Tuple, Iterator, Sequence, Any, Optional
+
+import numpy as np
+
+# Suffix of the index cached next to a log.
+INDEX_SUFFIX = ".index.npz"
+
+# The iteration at the start of a record, and the id and body of each agent in it.
+ITERATION_PATTERN = re.compile(rb"^\{'iteration': (\d+)")
+AGENT_PATTERN = re.compile(r"(?:\{|, )(\d+): \{([^{}]*)\}")
+AGENT_ID_PATTERN = re.compile(rb"(?:\{|, )(\d+): \{")
+FIELD_PATTERN = re.compile(r"'(\w+)': (\([^)]*\)|[^,]+)")
+
+# The last line of each frame of the visual log.
+STEP_PATTERN = re.compile(rb"^Step: (\d+)$")
+
+
+def parse_agents(line: str) -> Dict[int, Dict[str, Any]]:
+    """
+    Parses the agents of one record of the env log without evaluating the line.
+    Numeric fields are parsed with ``float()`` or ``int()``, and any others, e.g.
+    positions, with ``ast.literal_eval()``.
+
+    Parameters
+    ----------
+    line : ``str``.
+        A line written by ``Env.log_state()``.
+
+    Returns
+    -------
+    agents : ``Dict[int, Dict[str, Any]]``.
+        Maps agent ids to the logged fields of the agent.
+    """
+    agents: Dict[int, Dict[str, Any]] = {}
+    for agent_id, body in AGENT_PATTERN.findall(line):
+        fields: Dict[str, Any] = {}
+        for field, value in FIELD_PATTERN.findall(body):
+            try:
+                fields[field] = int(value)
+            except ValueError:
+                try:
+                    fields[field] = float(value)
+                except ValueError:
+                    fields[field] = ast.literal_eval(value)
+        agents[int(agent_id)] = fields
+    return agents
+
+
+def last_positions(iterations: np.ndarray) -> np.ndarray:
+    """
+    Returns a table mapping each iteration up to the last one in ``iterations`` to
+    the position of its last occurrence, or of the last earlier iteration if it
+    doesn't occur, and to ``-1`` before the first occurrence of any iteration.
+
+    Parameters
+    ----------
+    iterations : ``np.ndarray``.
+        The iteration of each record, in log order.
+
+    Returns
+    -------
+    positions : ``np.ndarray``.
+        Record positions.
+        Shape: ``(max(iterations) + 1,)``.
+    """
+    if len(iterations) == 0:
+        raise ValueError("Can't seek in an empty log.")
+    positions = np.full(int(iterations.max()) + 1, -1, dtype=np.int64)
+    positions[iterations] = np.arange(len(iterations))
+    positions = np.maximum.accumulate(positions)
+    return positions
+
+
+class IndexedLog:
+    """
+    A text log read through an index of the byte offset and iteration of each of
+    its records, which is cached next to the log. When the log has grown since the
+    index was cached, only the new bytes are scanned. Subclasses define how records
+    are found in ``_extend_index()``, and name any arrays they add to the index in
+    ``INDEX_ARRAYS``.
+
+    Parameters
+    ----------
+    log_path : ``str``.
+        Path to the log.
+    """
+
+    INDEX_ARRAYS: Tuple[str, ...] = ("offsets", "iterations")
+
+    def __init__(self, log_path: str) -> None:
+        self.log_path = log_path
+        self.index_path = log_path + INDEX_SUFFIX
+
+        # Byte offset of every record, followed by the end of the last record.
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.iterations = np.zeros(0, dtype=np.int64)
+
+        # Number of bytes of the log which have been scanned.
+        self.scanned = 0
+
+        # Maps each iteration to the last record at or before it, built on demand.
+        self.positions: Optional[np.ndarray] = None
+
+    def _update_index(self) -> None:
+        """ Loads the cached index, and scans the log if it has grown since. """
+        self._load_index()
+        if self.scanned != os.path.getsize(self.log_path):
+            self.scanned = self._extend_index()
+            self._save_index()
+
+    def __len__(self) -> int:
+        """ Returns the number of indexed records. """
+        return len(self.iterations)
+
+    def _load_index(self) -> None:
+        """ Loads the cached index, unless it is missing or stale. """
+        if not os.path.isfile(self.index_path):
+            return
+        with np.load(self.index_path) as index:
+            if index["scanned"] > os.path.getsize(self.log_path):
+                return
+            for name in self.INDEX_ARRAYS:
+                setattr(self, name, index[name])
+            self.scanned = int(index["scanned"])
+
+    def _save_index(self) -> None:
+        """ Caches the index next to the log. """
+        arrays = {name: getattr(self, name) for name in self.INDEX_ARRAYS}
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "wb") as index_file:
+            np.savez(index_file, scanned=self.scanned, **arrays)
+        os.replace(tmp_path, self.index_path)
+
+    def _extend_index(self) -> int:
+        """
+        Scans the log after the last indexed record, and returns the offset up to
+        which it was scanned.
+        """
+        raise NotImplementedError
+
+    def _append_records(self, offsets: List[int], iterations: List[int]) -> None:
+        """
+        Appends records to the index, where ``offsets`` holds the start of each new
+        record followed by the end of the last one.
+        """
+        self.offsets = np.concatenate(
+            (self.offsets[:-1], np.asarray(offsets, dtype=np.int64))
+        )
+        self.iterations = np.concatenate(
+            (self.iterations, np.asarray(iterations, dtype=np.int64))
+        )
+        self.positions = None
+
+    def read_record(self, index: int) -> str:
+        """ Reads the text of the ``index``-th record. """
+        with open(self.log_path, "rb") as log_file:
+            log_file.seek(self.offsets[index])
+            length = self.offsets[index + 1] - self.offsets[index]
+            return log_file.read(length).decode("utf-8")
+
+    def seek(self, iteration: int) -> int:
+        """
+        Returns the index of the last record logged at or before ``iteration`` in
+        constant time, or ``0`` if ``iteration`` precedes all records.
+        """
+        if self.positions is None:
+            self.positions = last_positions(self.iterations)
+        iteration = min(max(iteration, 0), len(self.positions) - 1)
+        return max(int(self.positions[iteration]), 0)
+
+
+class EnvLogReader(IndexedLog):
+    """
+    Reads records of the env log as they are needed. Besides the offset and
+    iteration of every line, the index holds the first and last line of every
+    agent. It is built with a single pass over the log which only matches the
+    iteration and agent ids of each line.
+
+    Parameters
+    ----------
+    log_path : ``str``.
+        Path to a log written by ``Env.log_state()``.
+    """
+
+    INDEX_ARRAYS = IndexedLog.INDEX_ARRAYS + ("agent_ids", "first_lines", "last_lines")
+
+    def __init__(self, log_path: str) -> None:
+        super().__init__(log_path)
+
+        # Sorted agent ids, and the first and last line in which each appears.
+        self.agent_ids = np.zeros(0, dtype=np.int64)
+        self.first_lines = np.zeros(0, dtype=np.int64)
+        self.last_lines = np.zeros(0, dtype=np.int64)
+
+        self._update_index()
+
+    def _extend_index(self) -> int:
+        """ Scans the lines of the log after the indexed ones. """
+        offsets: List[int] = []
+        iterations: List[int] = []
+        spans: Dict[int, Tuple[int, int]] = {
+            int(agent_id): (int(first), int(last))
+            for agent_id, first, last in zip(
+                self.agent_ids, self.first_lines, self.last_lines
+            )
+        }
+
+        offset = int(self.offsets[-1])
+        line_num = len(self.iterations)
+        with open(self.log_path, "rb") as log_file:
+            log_file.seek(offset)
+            for line in log_file:
+                match = ITERATION_PATTERN.match(line)
+                if match is None or not line.endswith(b"\n"):
+                    break
+                offsets.append(offset)
+                iterations.append(int(match.group(1)))
+                for agent_id_bytes in AGENT_ID_PATTERN.findall(line):
+                    agent_id = int(agent_id_bytes)
+                    first = spans[agent_id][0] if agent_id in spans else line_num
+                    spans[agent_id] = (first, line_num)
+                offset += len(line)
+                line_num += 1
+
+        self._append_records(offsets + [offset], iterations)
+        agent_ids = np.asarray(sorted(spans), dtype=np.int64)
+        self.agent_ids = agent_ids
+        self.first_lines = np.asarray(
+            [spans[agent_id][0] for agent_id in agent_ids], dtype=np.int64
+        )
+        self.last_lines = np.asarray(
+            [spans[agent_id][1] for agent_id in agent_ids], dtype=np.int64
+        )
+        return offset
+
+    def lines(
+        self,
+        start: Optional[int] = None,
+        stop: Optional[int] = None,
+        agent_ids: Optional[Sequence[int]] = None,
+    ) -> np.ndarray:
+        """
+        Returns the line numbers of records with an iteration in ``[start, stop)``,
+        restricted to the lines in which any of ``agent_ids`` appear if given.
+        """
+        keep = np.ones(len(self.iterations), dtype=bool)
+        if start is not None:
+            keep &= self.iterations >= start
+        if stop is not None:
+            keep &= self.iterations < stop
+        if agent_ids is not None:
+            # Marks the lines spanned by each agent with a difference array.
+            positions = np.flatnonzero(np.isin(self.agent_ids, agent_ids))
+            spans = np.zeros(len(self.iterations) + 1, dtype=np.int64)
+            np.add.at(spans, self.first_lines[positions], 1)
+            np.add.at(spans, self.last_lines[positions] + 1, -1)
+            keep &= np.cumsum(spans[:-1]) > 0
+        return np.flatnonzero(keep)
+
+    def records(
+        self,
+        start: Optional[int] = None,
+        stop: Optional[int] = None,
+        agent_ids: Optional[Sequence[int]] = None,
+    ) -> Iterator[Tuple[int, Dict[int, Dict[str, Any]]]]:
+        """
+        Yields the iteration and parsed agents of each record in ``[start, stop)``.
+        Only the bytes of the requested records are read. If ``agent_ids`` is given,
+        only records in which they appear are read, and only they are parsed.
+        """
+        wanted = None if agent_ids is None else set(agent_ids)
+        lines = self.lines(start, stop, agent_ids)
+        with open(self.log_path, "rb") as log_file:
+            for line_num in lines:
+                log_file.seek(self.offsets[line_num])
+                length = self.offsets[line_num + 1] - self.offsets[line_num]
+                agents = parse_agents(log_file.read(length).decode("utf-8"))
+                if wanted is not None:
+                    agents = {
+                        agent_id: fields
+                        for agent_id, fields in agents.items()
+                        if agent_id in wanted
+                    }
+                yield int(self.iterations[line_num]), agents
+
+    def agent_series(
+        self,
+        field: str,
+        start: Optional[int] = None,
+        stop: Optional[int] = None,
+        agent_ids: Optional[Sequence[int]] = None,
+    ) -> Dict[str, np.ndarray]:
+        """
+        Returns ``field`` of every agent in every record in ``[start, stop)`` as
+        flat columns ``iteration``, ``agent_id`` and ``field``, in log order.
+        """
+        iterations: List[int] = []
+        ids: List[int] = []
+        values: List[Any] = []
+        for iteration, agents in self.records(start, stop, agent_ids):
+            for agent_id, fields in agents.items():
+                iterations.append(iteration)
+                ids.append(agent_id)
+                values.append(fields[field])
+        return {
+            "iteration": np.asarray(iterations, dtype=np.int64),
+            "agent_id": np.asarray(ids, dtype=np.int64),
+            field: np.asarray(values),
+        }
+
+
+class VisualLogReader(IndexedLog):
+    """
+    Reads frames of the visual log as they are needed, through an index of the
+    byte offset of each frame and the iteration on its ``Step:`` line.
+
+    Parameters
+    ----------
+    log_path : ``str``.
+        Path to a log written by ``Env.render()``.
+    """
+
+    def __init__(self, log_path: str) -> None:
+        super().__init__(log_path)
+        self._update_index()
+
+    def _extend_index(self) -> int:
+        """ Scans the frames of the log after the indexed ones. """
+        offsets: List[int] = []
+        iterations: List[int] = []
+        start = offset = int(self.offsets[-1])
+        with open(self.log_path, "rb") as log_file:
+            log_file.seek(offset)
+            for line in log_file:
+                offset += len(line)
+                match = STEP_PATTERN.match(line)
+                if match is not None and line.endswith(b"\n"):
+                    offsets.append(start)
+                    iterations.append(int(match.group(1)))
+                    start = offset
+        self._append_records(offsets + [start], iterations)
+        return offset
+
+    def frame(self, index: int) -> str:
+        """ Returns the ``index``-th frame, without the newlines separating frames. """
+        return "\n" + self.read_record(index).lstrip("\n")
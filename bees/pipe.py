@@ -1,15 +1,249 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """ Object to send data between processes. """
+from typing import Dict, Tuple, Any, Callable, Optional
+from multiprocessing.connection import Connection
+
+import numpy as np
+import torch
 import torch.multiprocessing as mp
 
+# Layout of ``Pipe.slots["header"]``, which holds data shared by all agents.
+ITERATION = 0
+BACKWARD_PASS = 1
+NUM_MESSAGES = 2
+STOP = 3
+HEADER_SIZE = 4
+
+# Layout of ``Pipe.slots["env_scalars"]``, which holds one row per agent.
+REWARD = 0
+DONE = 1
+AGE = 2
+HAS_OPTIMAL_ACTION_DIST = 3
+NUM_ENV_SCALARS = 4
+
+# Seconds between checks that the other side is alive while waiting on it.
+POLL_INTERVAL = 1.0
+
+
+def wait(semaphore: Any, is_alive: Optional[Callable[[], bool]] = None) -> None:
+    """
+    Acquires ``semaphore``, raising a ``RuntimeError`` if ``is_alive()`` turns
+    false while waiting, so that the death of the other side doesn't hang the run.
+    """
+    while not semaphore.acquire(timeout=POLL_INTERVAL):
+        if is_alive is not None and not is_alive():
+            # It may have released the semaphore just before exiting.
+            if semaphore.acquire(block=False):
+                return
+            raise RuntimeError("The process on the other side of the pipe died.")
+
+
+def recv(connection: Connection, is_alive: Optional[Callable[[], bool]] = None) -> Any:
+    """ Receives from ``connection``, checking ``is_alive()`` as ``wait()`` does. """
+    while not connection.poll(POLL_INTERVAL):
+        if is_alive is not None and not is_alive():
+            raise RuntimeError("The process on the other side of the pipe died.")
+    return connection.recv()
+
 
 class Pipe:
-    """ Multiprocessing pipes. """
+    """
+    Channels between the leader and a single worker process, which hosts the
+    policies of many agents.
+
+    Per-step data (observations, rewards, dones, actions and policy scores) is
+    exchanged through fixed-layout tables in shared memory, in which each hosted
+    agent owns a row. The writer of a table fills it in place and then releases the
+    corresponding semaphore once for the whole worker, and the reader acquires the
+    semaphore before reading, so nothing is pickled each step. Control messages
+    (agent births and table resizes), losses and saved state are only sent
+    occasionally, and go through ``mp.Pipe``s.
 
-    def __init__(self) -> None:
-        self.env_spout, self.env_funnel = mp.Pipe()
-        self.action_spout, self.action_funnel = mp.Pipe()
-        self.action_dist_spout, self.action_dist_funnel = mp.Pipe()
+    Methods which wait on the other side take an optional ``is_alive`` callable,
+    e.g. ``mp.Process.is_alive``, and raise a ``RuntimeError`` once it returns
+    ``False`` instead of waiting forever.
+
+    Parameters
+    ----------
+    obs_shape : ``Tuple[int, ...]``.
+        Shape of a single agent observation.
+    num_actions : ``int``.
+        Size of the action space.
+    capacity : ``int``, optional.
+        Initial number of rows in each table.
+    """
+
+    def __init__(
+        self, obs_shape: Tuple[int, ...], num_actions: int, capacity: int = 16
+    ) -> None:
+        self.obs_shape = tuple(obs_shape)
+        self.num_actions = num_actions
+        self.capacity = 0
+        self.slots: Dict[str, torch.Tensor] = {}
+        self.slots["header"] = torch.zeros(HEADER_SIZE, dtype=torch.float64)
+        self.slots["header"].share_memory_()
+        self._allocate(capacity)
+
+        self.control_spout, self.control_funnel = mp.Pipe()
         self.loss_spout, self.loss_funnel = mp.Pipe()
         self.save_spout, self.save_funnel = mp.Pipe()
+
+        # Released by the leader.
+        self.control_ready = mp.Semaphore(0)
+        self.env_ready = mp.Semaphore(0)
+
+        # Released by the worker.
+        self.action_ready = mp.Semaphore(0)
+        self.policy_score_ready = mp.Semaphore(0)
+
+        # Number of control messages sent since the last ``send_control()``.
+        self.num_messages = 0
+
+    def _allocate(self, capacity: int) -> None:
+        """ Replaces the per-agent tables with empty tables of ``capacity`` rows. """
+        self.capacity = capacity
+        tables = {
+            "obs": torch.zeros((capacity,) + self.obs_shape),
+            "env_scalars": torch.zeros(capacity, NUM_ENV_SCALARS, dtype=torch.float64),
+            "optimal_action_dists": torch.zeros(capacity, self.num_actions),
+            "actions": torch.zeros(capacity, dtype=torch.int64),
+            "policy_scores": torch.zeros(capacity, dtype=torch.float64),
+        }
+        for name, table in tables.items():
+            self.slots[name] = table.share_memory_()
+
+    # Leader side.
+
+    def send_message(self, message: Tuple[Any, ...]) -> None:
+        """ Queues a control message to be handled on the next ``send_control()``. """
+        self.control_funnel.send(message)
+        self.num_messages += 1
+
+    def grow(self, capacity: int) -> None:
+        """
+        Replaces the tables with larger ones, and sends them to the worker. May only
+        be called between ``send_env()`` and ``send_control()``, when neither side
+        holds data in the tables.
+        """
+        self._allocate(capacity)
+        tables = {name: table for name, table in self.slots.items() if name != "header"}
+        self.send_message(("resize", capacity, tables))
+
+    def send_control(self, stop: bool = False) -> None:
+        """ Tells the worker how many control messages to handle before acting. """
+        header = self.slots["header"]
+        header[NUM_MESSAGES] = self.num_messages
+        header[STOP] = stop
+        self.num_messages = 0
+        self.control_ready.release()
+
+    def recv_actions(self, is_alive: Optional[Callable[[], bool]] = None) -> np.ndarray:
+        """ Waits for the integer actions of all hosted agents, indexed by row. """
+        wait(self.action_ready, is_alive)
+        actions: np.ndarray = self.slots["actions"].numpy()
+        return actions
+
+    def write_env(
+        self, row: int, ob: np.ndarray, reward: float, done: bool, info: Dict[str, Any]
+    ) -> None:
+        """ Writes the output of an environment step into the row of an agent. """
+        self.slots["obs"][row] = torch.from_numpy(np.asarray(ob))
+        scalars = self.slots["env_scalars"][row]
+        scalars[REWARD] = reward
+        scalars[DONE] = done
+        scalars[AGE] = info["age"]
+        scalars[HAS_OPTIMAL_ACTION_DIST] = "optimal_action_dist" in info
+        if "optimal_action_dist" in info:
+            self.slots["optimal_action_dists"][row] = info["optimal_action_dist"]
+
+    def send_env(self, iteration: int, backward_pass: bool) -> None:
+        """ Hands the rows written with ``write_env()`` to the worker. """
+        header = self.slots["header"]
+        header[ITERATION] = iteration
+        header[BACKWARD_PASS] = backward_pass
+        self.env_ready.release()
+
+    def recv_policy_scores(
+        self, is_alive: Optional[Callable[[], bool]] = None
+    ) -> np.ndarray:
+        """ Waits for the policy scores of all hosted agents, indexed by row. """
+        wait(self.policy_score_ready, is_alive)
+        scores: np.ndarray = self.slots["policy_scores"].numpy()
+        return scores
+
+    def recv_losses(self, is_alive: Optional[Callable[[], bool]] = None) -> Any:
+        """ Waits for the losses sent by the worker on a backward pass. """
+        return recv(self.loss_spout, is_alive)
+
+    def recv_saves(self, is_alive: Optional[Callable[[], bool]] = None) -> Any:
+        """ Waits for the state sent by the worker to be saved. """
+        return recv(self.save_spout, is_alive)
+
+    # Worker side.
+
+    def recv_control(
+        self, is_alive: Optional[Callable[[], bool]] = None
+    ) -> Tuple[bool, Tuple[Tuple[Any, ...], ...]]:
+        """
+        Waits for the leader to allow the next forward pass.
+
+        Returns
+        -------
+        stop : ``bool``.
+            Whether the worker should exit.
+        messages : ``Tuple[Tuple[Any, ...], ...]``.
+            Control messages other than table resizes, which are applied here.
+        """
+        wait(self.control_ready, is_alive)
+        header = self.slots["header"]
+        messages = []
+        for _ in range(int(header[NUM_MESSAGES])):
+            message = self.control_spout.recv()
+            if message[0] == "resize":
+                _, self.capacity, tables = message
+                self.slots.update(tables)
+            else:
+                messages.append(message)
+        return bool(header[STOP]), tuple(messages)
+
+    def send_actions(self) -> None:
+        """ Hands the actions written to ``slots["actions"]`` to the leader. """
+        self.action_ready.release()
+
+    def recv_env(
+        self, is_alive: Optional[Callable[[], bool]] = None
+    ) -> Tuple[int, bool]:
+        """ Waits for an environment step, and returns its iteration and whether it
+        is a backward pass. """
+        wait(self.env_ready, is_alive)
+        header = self.slots["header"]
+        return int(header[ITERATION]), bool(header[BACKWARD_PASS])
+
+    def read_env(self, row: int) -> Tuple[torch.Tensor, float, bool, Dict[str, Any]]:
+        """
+        Reads the output of an environment step from the row of an agent.
+
+        Returns
+        -------
+        ob : ``torch.Tensor``.
+            The agent observation. This is a view of the shared table, so it is only
+            valid until the worker sends its next actions.
+            Shape: ``obs_shape``.
+        reward : ``float``.
+            The agent reward.
+        done : ``bool``.
+            Whether the agent is done.
+        info : ``Dict[str, Any]``.
+            The ``age`` of the agent and, when sent, its ``optimal_action_dist``.
+        """
+        scalars = self.slots["env_scalars"][row].tolist()
+        info: Dict[str, Any] = {"age": int(scalars[AGE])}
+        if scalars[HAS_OPTIMAL_ACTION_DIST]:
+            optimal_action_dist = self.slots["optimal_action_dists"][row].clone()
+            info["optimal_action_dist"] = optimal_action_dist
+        return self.slots["obs"][row], scalars[REWARD], bool(scalars[DONE]), info
+
+    def send_policy_scores(self) -> None:
+        """ Hands the scores written to ``slots["policy_scores"]`` to the leader. """
+        self.policy_score_ready.release()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Fixed-size pool of worker processes which host the policies of many agents. """
+from typing import Dict, List, Tuple, Any, Optional
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+from bees.rl.storage import RolloutStorage
+from bees.rl.algo.algo import Algo
+
+from bees.pipe import Pipe
+from bees.config import Config
+from bees.utils import available_cpus
+from bees.worker import worker_loop
+
+
+class WorkerPool:
+    """
+    Leader-side handle on a fixed set of worker processes. Agents are assigned to
+    the worker hosting the fewest agents when they are born, and own a row of that
+    worker's shared-memory tables until they die. Births and deaths are messages to
+    long-lived workers rather than process spawns.
+
+    Each step, the leader calls ``flush()``, which lets the workers make a forward
+    pass, then ``recv_actions()``, ``send_env()``, optionally
+    ``recv_policy_scores()``, and ``add_agent()`` and ``remove_agent()`` for births
+    and deaths. On backward passes and saves it calls ``recv_losses()`` and
+    ``recv_saves()``.
+
+    Parameters
+    ----------
+    config : ``Config``.
+        Config object parsed from settings file.
+    obs_shape : ``Tuple[int, ...]``.
+        Shape of a single agent observation.
+    num_actions : ``int``.
+        Size of the action space.
+    num_workers : ``Optional[int]``, optional.
+        Number of worker processes. Defaults to the number of CPUs available to
+        this process.
+
+    Raises
+    ------
+    RuntimeError
+        From the methods which wait on workers, if a worker process has died.
+    """
+
+    def __init__(
+        self,
+        config: Config,
+        obs_shape: Tuple[int, ...],
+        num_actions: int,
+        num_workers: Optional[int] = None,
+    ) -> None:
+        if num_workers is None:
+            num_workers = len(available_cpus())
+        device = torch.device("cuda:0" if config.cuda else "cpu")
+
+        # Workers split ``config.num_threads`` rather than each using every core.
+        num_threads = max(1, config.num_threads // num_workers)
+
+        self.pipes = [Pipe(obs_shape, num_actions) for _ in range(num_workers)]
+        self.workers = [
+            mp.Process(
+                target=worker_loop,
+                kwargs={
+                    "device": device,
+                    "config": config,
+                    "pipe": pipe,
+                    "num_threads": num_threads,
+                },
+                daemon=True,
+            )
+            for pipe in self.pipes
+        ]
+        for worker in self.workers:
+            worker.start()
+
+        # Maps agent ids to the index of their worker and their row in its tables.
+        self.assignments: Dict[int, Tuple[int, int]] = {}
+
+        # Agents hosted by each worker, keyed by agent id, with their rows.
+        self.hosted: List[Dict[int, int]] = [{} for _ in self.pipes]
+        self.free_rows: List[List[int]] = [
+            list(reversed(range(pipe.capacity))) for pipe in self.pipes
+        ]
+
+    def __contains__(self, agent_id: object) -> bool:
+        """ Whether ``agent_id`` is hosted by a worker. """
+        return agent_id in self.assignments
+
+    def add_agent(
+        self,
+        agent_id: int,
+        agent: Algo,
+        rollouts: RolloutStorage,
+        age: int,
+        iteration: int,
+        ob: np.ndarray,
+    ) -> None:
+        """
+        Sends a newborn agent to the worker hosting the fewest agents. The worker
+        starts acting for it after the next ``flush()``.
+
+        Parameters
+        ----------
+        agent_id : ``int``.
+            The id of the agent in the environment.
+        agent : ``Algo``.
+            The policy and optimizer of the agent.
+        rollouts : ``RolloutStorage``.
+            The rollouts of the agent.
+        age : ``int``.
+            The age of the agent.
+        iteration : ``int``.
+            The current environment iteration.
+        ob : ``np.ndarray``.
+            The first observation of the agent.
+        """
+        index = min(range(len(self.pipes)), key=lambda i: len(self.hosted[i]))
+        pipe = self.pipes[index]
+        free_rows = self.free_rows[index]
+        if not free_rows:
+            old_capacity = pipe.capacity
+            pipe.grow(2 * old_capacity)
+            free_rows.extend(reversed(range(old_capacity, pipe.capacity)))
+        row = free_rows.pop()
+
+        pipe.send_message(("birth", agent_id, row, agent, rollouts, age, iteration, ob))
+        self.assignments[agent_id] = (index, row)
+        self.hosted[index][agent_id] = row
+
+    def remove_agent(self, agent_id: int) -> None:
+        """ Frees the row of an agent which the worker has been told is done. """
+        index, row = self.assignments.pop(agent_id)
+        del self.hosted[index][agent_id]
+        self.free_rows[index].append(row)
+
+    def flush(self) -> None:
+        """ Lets every worker handle its births and make its next forward pass. """
+        for pipe in self.pipes:
+            pipe.send_control()
+
+    def recv_actions(self) -> Dict[int, int]:
+        """ Waits for the integer actions of all agents. """
+        action_dict: Dict[int, int] = {}
+        for pipe, hosted, worker in zip(self.pipes, self.hosted, self.workers):
+            actions = pipe.recv_actions(worker.is_alive)
+            for agent_id, row in hosted.items():
+                action_dict[agent_id] = int(actions[row])
+        return action_dict
+
+    def send_env(
+        self,
+        iteration: int,
+        obs: Dict[int, np.ndarray],
+        rewards: Dict[int, float],
+        dones: Dict[int, bool],
+        infos: Dict[int, Dict[str, Any]],
+        backward_pass: bool,
+    ) -> None:
+        """ Sends the output of an environment step to the agents' workers. """
+        for pipe, hosted in zip(self.pipes, self.hosted):
+            for agent_id, row in hosted.items():
+                pipe.write_env(
+                    row,
+                    obs[agent_id],
+                    rewards[agent_id],
+                    dones[agent_id],
+                    infos[agent_id],
+                )
+            pipe.send_env(iteration, backward_pass)
+
+    def recv_policy_scores(self) -> Dict[int, float]:
+        """ Waits for the policy scores of all agents. """
+        timestep_scores: Dict[int, float] = {}
+        for pipe, hosted, worker in zip(self.pipes, self.hosted, self.workers):
+            scores = pipe.recv_policy_scores(worker.is_alive)
+            for agent_id, row in hosted.items():
+                timestep_scores[agent_id] = float(scores[row])
+        return timestep_scores
+
+    def recv_losses(self) -> Dict[int, Tuple[float, float, float]]:
+        """ Waits for the losses of all agents updated on a backward pass. """
+        loss_map: Dict[int, Tuple[float, float, float]] = {}
+        for pipe, worker in zip(self.pipes, self.workers):
+            loss_map.update(pipe.recv_losses(worker.is_alive))
+        return loss_map
+
+    def recv_saves(self) -> Dict[int, Tuple[Algo, RolloutStorage]]:
+        """ Waits for copies of the policies and rollouts of all hosted agents. """
+        saves: Dict[int, Tuple[Algo, RolloutStorage]] = {}
+        for pipe, worker in zip(self.pipes, self.workers):
+            saves.update(pipe.recv_saves(worker.is_alive))
+        return saves
+
+    def close(self) -> None:
+        """
+        Stops and joins the worker processes. Losses and saves which were never
+        received are discarded, so that workers blocked on sending them can exit.
+        """
+        for pipe in self.pipes:
+            pipe.send_control(stop=True)
+        for pipe, worker in zip(self.pipes, self.workers):
+            while worker.is_alive():
+                for spout in (pipe.loss_spout, pipe.save_spout):
+                    while spout.poll():
+                        spout.recv()
+                worker.join(timeout=0.1)
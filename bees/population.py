@@ -0,0 +1,445 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Struct-of-arrays storage for the state of every agent in the environment. """
+from typing import Dict, List, Tuple, Iterable, Sequence, Any
+
+import numpy as np
+
+# pylint: disable=too-many-instance-attributes
+
+# Maps column names to column dtypes. Each column is a contiguous array with one
+# entry per row, and each living agent owns exactly one row. The ``observation``
+# column additionally has the observation shape as trailing dimensions. The
+# reward network columns (one weight and one bias column per layer) are added in
+# ``Population.__init__()`` since their shapes depend on the settings. The
+# ``reward_version`` column counts changes to the reward network of each row, so
+# that values derived from the network can be cached.
+COLUMNS: Dict[str, Any] = {
+    "pos_x": np.int64,
+    "pos_y": np.int64,
+    "health": np.float64,
+    "prev_health": np.float64,
+    "age": np.int64,
+    "mating_cooldown": np.float64,
+    "num_children": np.int64,
+    "alive": np.bool_,
+    "total_reward": np.float64,
+    "last_reward": np.float64,
+    "reward_version": np.int64,
+    "observation": np.float32,
+}
+
+
+class Population:
+    """
+    A table of agent state stored as one NumPy array per attribute, so that updates
+    which apply to every agent (aging, cooldowns, death detection) can be computed
+    as whole-array operations instead of a Python loop over ``Agent`` objects.
+
+    Rows are handed out on ``add()`` and recycled on ``remove()``, so the table only
+    grows when the number of simultaneously living agents exceeds its capacity.
+
+    Parameters
+    ----------
+    obs_shape : ``Tuple[int, ...]``.
+        Shape of a single agent observation.
+    capacity : ``int``, optional.
+        Initial number of rows in the table.
+    reward_shapes : ``Sequence[Tuple[int, int]]``, optional.
+        The ``(input_dim, output_dim)`` shape of each layer of the reward network.
+    """
+
+    def __init__(
+        self,
+        obs_shape: Tuple[int, ...],
+        capacity: int = 16,
+        reward_shapes: Sequence[Tuple[int, int]] = (),
+    ) -> None:
+
+        self.obs_shape = tuple(obs_shape)
+        self.reward_shapes = [tuple(shape) for shape in reward_shapes]
+        self.capacity = max(capacity, 1)
+        for column, dtype in COLUMNS.items():
+            shape: Tuple[int, ...] = (self.capacity,)
+            if column == "observation":
+                shape += self.obs_shape
+            setattr(self, column, np.zeros(shape, dtype=dtype))
+
+        # Stacked reward network parameters, with one row per agent.
+        self.weight_columns = ["reward_weights_%d" % i for i in range(self.n_layers)]
+        self.bias_columns = ["reward_biases_%d" % i for i in range(self.n_layers)]
+        for i, (input_dim, output_dim) in enumerate(self.reward_shapes):
+            weights = np.zeros((self.capacity, input_dim, output_dim))
+            setattr(self, self.weight_columns[i], weights)
+            setattr(self, self.bias_columns[i], np.zeros((self.capacity, output_dim)))
+
+        # Maps agent ids to rows and rows to agent ids (``-1`` for free rows).
+        self.id_to_row: Dict[int, int] = {}
+        self.row_ids = np.full((self.capacity,), -1, dtype=np.int64)
+
+        # Free rows, popped from the end so that low rows are reused first.
+        self.free_rows: List[int] = list(reversed(range(self.capacity)))
+
+    def __len__(self) -> int:
+        """ Returns the number of agents in the table. """
+        return len(self.id_to_row)
+
+    def __contains__(self, agent_id: object) -> bool:
+        """ Whether ``agent_id`` has a row in the table. """
+        return agent_id in self.id_to_row
+
+    def _grow(self) -> None:
+        """ Doubles the capacity of the table, preserving existing rows. """
+        old_capacity = self.capacity
+        self.capacity = 2 * old_capacity
+        for column in self.columns():
+            old = getattr(self, column)
+            new = np.zeros((self.capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:old_capacity] = old
+            setattr(self, column, new)
+        row_ids = np.full((self.capacity,), -1, dtype=np.int64)
+        row_ids[:old_capacity] = self.row_ids
+        self.row_ids = row_ids
+        self.free_rows = list(reversed(range(old_capacity, self.capacity))) + list(
+            self.free_rows
+        )
+
+    @property
+    def n_layers(self) -> int:
+        """ Number of layers in the reward network. """
+        return len(self.reward_shapes)
+
+    def columns(self) -> List[str]:
+        """ Returns the names of all columns in the table. """
+        return list(COLUMNS) + self.weight_columns + self.bias_columns
+
+    def add(self, agent_id: int) -> int:
+        """
+        Allocates a zeroed row for ``agent_id`` and marks it alive.
+
+        Parameters
+        ----------
+        agent_id : ``int``.
+            Unique identifier of the agent being added.
+
+        Returns
+        -------
+        row : ``int``.
+            The row index of the new agent.
+        """
+        if agent_id in self.id_to_row:
+            raise ValueError(f"Agent with id '{agent_id}' already has a row.")
+        if not self.free_rows:
+            self._grow()
+        row = self.free_rows.pop()
+        for column in self.columns():
+            getattr(self, column)[row] = 0
+        self.alive[row] = True  # type: ignore
+        self.row_ids[row] = agent_id
+        self.id_to_row[agent_id] = row
+        return row
+
+    def remove(self, agent_id: int) -> int:
+        """
+        Frees the row of ``agent_id`` so that it may be recycled.
+
+        Parameters
+        ----------
+        agent_id : ``int``.
+            Identifier of the agent being removed.
+
+        Returns
+        -------
+        row : ``int``.
+            The row index which was freed.
+        """
+        row = self.id_to_row.pop(agent_id)
+        self.alive[row] = False  # type: ignore
+        self.row_ids[row] = -1
+        self.free_rows.append(row)
+        return row
+
+    def rows(self, agent_ids: Iterable[int]) -> np.ndarray:
+        """
+        Returns the rows of ``agent_ids`` in iteration order.
+
+        Parameters
+        ----------
+        agent_ids : ``Iterable[int]``.
+            Identifiers of agents with rows in the table.
+
+        Returns
+        -------
+        rows : ``np.ndarray``.
+            Integer row indices.
+            Shape: ``(len(agent_ids),)``.
+        """
+        id_to_row = self.id_to_row
+        return np.fromiter(
+            (id_to_row[agent_id] for agent_id in agent_ids), dtype=np.int64
+        )
+
+    def positions(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Returns the grid positions of ``rows``.
+
+        Parameters
+        ----------
+        rows : ``np.ndarray``.
+            Integer row indices.
+
+        Returns
+        -------
+        positions : ``np.ndarray``.
+            Positions as ``(x, y)`` pairs.
+            Shape: ``(len(rows), 2)``.
+        """
+        return np.stack((self.pos_x[rows], self.pos_y[rows]), axis=1)
+
+    def compute_rewards(
+        self,
+        rows: np.ndarray,
+        actions: np.ndarray,
+        reward_inputs: Sequence[str],
+        num_actions: int,
+    ) -> np.ndarray:
+        """
+        Evaluates the reward networks of ``rows`` with one batched matrix product
+        per layer. Does not modify any columns.
+
+        Parameters
+        ----------
+        rows : ``np.ndarray``.
+            Integer row indices.
+            Shape: ``(num_rows,)``.
+        actions : ``np.ndarray``.
+            Integer actions, represented in integer form (not tuples).
+            Shape: ``(num_rows,)``.
+        reward_inputs : ``Sequence[str]``.
+            Inputs to the reward networks, any of ``"obs"``, ``"actions"`` and
+            ``"health"``.
+        num_actions : ``int``.
+            Size of the action space.
+
+        Returns
+        -------
+        rewards : ``np.ndarray``.
+            The reward computed by each reward network from the previous health,
+            action, and observation of its agent.
+            Shape: ``(num_rows,)``.
+        """
+        inputs, action_offset = self._reward_inputs(rows, reward_inputs, num_actions)
+        if "actions" in reward_inputs:
+            inputs[np.arange(len(rows)), action_offset + actions] = 1.0
+
+        # Shape: ``(num_rows, 1, input_dim)``.
+        hidden = self._reward_forward(inputs[:, np.newaxis, :], rows, 0)
+        rewards: np.ndarray = hidden[:, 0, 0]
+        return rewards
+
+    def compute_action_rewards(
+        self, rows: np.ndarray, reward_inputs: Sequence[str], num_actions: int
+    ) -> np.ndarray:
+        """
+        Evaluates the reward networks of ``rows`` for every possible action at once.
+        Only the action one-hot differs between actions, so the first layer is
+        computed once from the other inputs, and the contribution of each action
+        is the corresponding row of the first weight matrix. Does not modify any
+        columns.
+
+        Parameters
+        ----------
+        rows : ``np.ndarray``.
+            Integer row indices.
+            Shape: ``(num_rows,)``.
+        reward_inputs : ``Sequence[str]``.
+            Inputs to the reward networks, any of ``"obs"``, ``"actions"`` and
+            ``"health"``.
+        num_actions : ``int``.
+            Size of the action space.
+
+        Returns
+        -------
+        action_rewards : ``np.ndarray``.
+            The reward each reward network computes for each action.
+            Shape: ``(num_rows, num_actions)``.
+        """
+        inputs, action_offset = self._reward_inputs(rows, reward_inputs, num_actions)
+        weights = getattr(self, self.weight_columns[0])[rows]
+        biases = getattr(self, self.bias_columns[0])[rows]
+
+        # Shape: ``(num_rows, 1, output_dim)``.
+        hidden = np.matmul(inputs[:, np.newaxis, :], weights) + biases[:, np.newaxis, :]
+
+        # Shape: ``(num_rows, num_actions, output_dim)``.
+        if "actions" in reward_inputs:
+            hidden = hidden + weights[:, action_offset : action_offset + num_actions]
+        else:
+            hidden = np.repeat(hidden, num_actions, axis=1)
+
+        if self.n_layers > 1:
+            hidden = self._reward_forward(np.maximum(hidden, 0), rows, 1)
+        action_rewards: np.ndarray = hidden[:, :, 0]
+        return action_rewards
+
+    def compute_probe_rewards(
+        self,
+        rows: np.ndarray,
+        observations: np.ndarray,
+        healths: np.ndarray,
+        prev_healths: np.ndarray,
+        reward_inputs: Sequence[str],
+        num_actions: int,
+    ) -> np.ndarray:
+        """
+        Evaluates the reward network of every row in ``rows`` on every probe input
+        and every action, with one batched matrix product per layer. The probes are
+        given explicitly instead of being read from the rows, and are shared by all
+        rows. Does not modify any columns.
+
+        Parameters
+        ----------
+        rows : ``np.ndarray``.
+            Integer row indices.
+            Shape: ``(num_rows,)``.
+        observations : ``np.ndarray``.
+            Probe observations.
+            Shape: ``(num_probes,) + obs_shape``.
+        healths : ``np.ndarray``.
+            Probe healths.
+            Shape: ``(num_probes,)``.
+        prev_healths : ``np.ndarray``.
+            Probe previous healths.
+            Shape: ``(num_probes,)``.
+        reward_inputs : ``Sequence[str]``.
+            Inputs to the reward networks, any of ``"obs"``, ``"actions"`` and
+            ``"health"``.
+        num_actions : ``int``.
+            Size of the action space.
+
+        Returns
+        -------
+        probe_rewards : ``np.ndarray``.
+            The reward each reward network computes for each probe and action.
+            Shape: ``(num_rows, num_probes, num_actions)``.
+        """
+        inputs, action_offset = self._build_inputs(
+            observations, prev_healths, healths, reward_inputs, num_actions
+        )
+        num_probes = len(inputs)
+        weights = getattr(self, self.weight_columns[0])[rows]
+        biases = getattr(self, self.bias_columns[0])[rows]
+
+        # Shape: ``(num_rows, num_probes, output_dim)``.
+        hidden = np.matmul(inputs, weights) + biases[:, np.newaxis, :]
+
+        # Shape: ``(num_rows, num_probes, num_actions, output_dim)``.
+        if "actions" in reward_inputs:
+            action_weights = weights[:, action_offset : action_offset + num_actions]
+            hidden = hidden[:, :, np.newaxis, :] + action_weights[:, np.newaxis]
+        else:
+            hidden = np.repeat(hidden[:, :, np.newaxis, :], num_actions, axis=2)
+        hidden = hidden.reshape(len(rows), num_probes * num_actions, -1)
+
+        if self.n_layers > 1:
+            hidden = self._reward_forward(np.maximum(hidden, 0), rows, 1)
+        probe_rewards: np.ndarray = hidden[:, :, 0].reshape(
+            len(rows), num_probes, num_actions
+        )
+        return probe_rewards
+
+    def _reward_inputs(
+        self, rows: np.ndarray, reward_inputs: Sequence[str], num_actions: int
+    ) -> Tuple[np.ndarray, int]:
+        """
+        Builds the reward network inputs of ``rows``, leaving the action one-hot
+        (if any) zeroed.
+        """
+        return self._build_inputs(
+            self.observation[rows],
+            self.prev_health[rows],
+            self.health[rows],
+            reward_inputs,
+            num_actions,
+        )
+
+    def _build_inputs(
+        self,
+        observations: np.ndarray,
+        prev_healths: np.ndarray,
+        healths: np.ndarray,
+        reward_inputs: Sequence[str],
+        num_actions: int,
+    ) -> Tuple[np.ndarray, int]:
+        """
+        Builds reward network inputs from observations and healths, leaving the
+        action one-hot (if any) zeroed. Inputs are concatenated in the order
+        observation, action, health.
+
+        Returns
+        -------
+        inputs : ``np.ndarray``.
+            Reward network inputs.
+            Shape: ``(len(observations), input_dim)``.
+        action_offset : ``int``.
+            Index of the first element of the action one-hot in ``inputs``.
+        """
+        remaining_inputs = set(reward_inputs) - {"obs", "actions", "health"}
+        if remaining_inputs:
+            raise ValueError(
+                "Unrecognized inputs to reward network: %s" % str(remaining_inputs)
+            )
+
+        num_inputs = len(observations)
+        input_dim = self.reward_shapes[0][0]
+        inputs = np.zeros((num_inputs, input_dim))
+        offset = 0
+        if "obs" in reward_inputs:
+            obs_dim = int(np.prod(self.obs_shape))
+            flat_obs = observations.reshape(num_inputs, obs_dim)
+            inputs[:, offset : offset + obs_dim] = flat_obs
+            offset += obs_dim
+        action_offset = offset
+        if "actions" in reward_inputs:
+            offset += num_actions
+        if "health" in reward_inputs:
+            inputs[:, offset] = prev_healths
+            inputs[:, offset + 1] = healths
+
+        return inputs, action_offset
+
+    def _reward_forward(
+        self, hidden: np.ndarray, rows: np.ndarray, first_layer: int
+    ) -> np.ndarray:
+        """
+        Applies the reward network layers of ``rows`` from ``first_layer`` onwards.
+
+        Parameters
+        ----------
+        hidden : ``np.ndarray``.
+            Inputs to ``first_layer``.
+            Shape: ``(num_rows, batch_size, layer_input_dim)``.
+        rows : ``np.ndarray``.
+            Integer row indices.
+        first_layer : ``int``.
+            Index of the first layer to apply.
+
+        Returns
+        -------
+        hidden : ``np.ndarray``.
+            Outputs of the last layer.
+            Shape: ``(num_rows, batch_size, 1)``.
+        """
+        for i in range(first_layer, self.n_layers):
+            weights = getattr(self, self.weight_columns[i])[rows]
+            biases = getattr(self, self.bias_columns[i])[rows]
+            hidden = np.matmul(hidden, weights) + biases[:, np.newaxis, :]
+            # ReLU.
+            if i < self.n_layers - 1:
+                hidden = np.maximum(hidden, 0)
+        return hidden
+
+    def copy_row(self, source: "Population", source_row: int, row: int) -> None:
+        """ Copies every column of ``source_row`` in ``source`` into ``row``. """
+        for column in self.columns():
+            getattr(self, column)[row] = getattr(source, column)[source_row]
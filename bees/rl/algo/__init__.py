@@ -4,3 +4,4 @@
 from bees.rl.algo.a2c_acktr import A2C_ACKTR
 from bees.rl.algo.algo import Algo
 from bees.rl.algo.ppo import PPO
+from bees.rl.algo.population_ppo import PopulationPPO
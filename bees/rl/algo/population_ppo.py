@@ -0,0 +1,431 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Proximal Policy Optimization for many agents at once. """
+import copy
+from typing import Dict, List, Tuple, Any
+
+import torch
+from torch import optim
+from torch.func import functional_call, grad, vmap
+
+from bees.rl.algo.algo import Algo
+from bees.rl.algo.ppo import PPO
+from bees.rl.batch import policy_signature, submodule_state
+from bees.rl.distributions import Categorical
+from bees.rl.storage import RolloutStorage, stack_rollouts, step_mask
+
+# pylint: disable=too-many-instance-attributes, too-many-locals
+
+Losses = Tuple[float, float, float]
+
+
+def is_batchable(agent: Algo) -> bool:
+    """
+    Whether ``agent`` can be updated by a ``PopulationPPO``, i.e. whether it is a
+    non-recurrent ``PPO`` agent with a ``Categorical`` action distribution and a
+    plain ``Adam`` optimizer over exactly the parameters of its policy.
+    """
+    if not isinstance(agent, PPO):
+        return False
+    policy = agent.actor_critic
+    if policy.is_recurrent or not isinstance(policy.dist, Categorical):
+        return False
+    optimizer = agent.optimizer
+    if not isinstance(optimizer, optim.Adam) or len(optimizer.param_groups) != 1:
+        return False
+    group = optimizer.param_groups[0]
+    if group["amsgrad"] or group["weight_decay"] != 0 or group.get("maximize"):
+        return False
+    params = list(policy.parameters())
+    return len(group["params"]) == len(params) and all(
+        param is group_param for param, group_param in zip(params, group["params"])
+    )
+
+
+def group_agents(agents: Dict[int, Algo]) -> Tuple[List[List[int]], List[int]]:
+    """
+    Partitions ``agents`` into groups which can be updated together by a
+    ``PopulationPPO`` and agents which must be updated one at a time.
+
+    Parameters
+    ----------
+    agents : ``Dict[int, Algo]``.
+        Agents to update, keyed by agent id.
+
+    Returns
+    -------
+    groups : ``List[List[int]]``.
+        Ids of agents with identical policy architectures and PPO hyperparameters.
+    unbatched : ``List[int]``.
+        Ids of agents for which ``is_batchable()`` is false.
+    """
+    ids_by_signature: Dict[Any, List[int]] = {}
+    unbatched: List[int] = []
+    for agent_id, agent in agents.items():
+        if not is_batchable(agent):
+            unbatched.append(agent_id)
+            continue
+        assert isinstance(agent, PPO)
+        signature = (
+            agent.clip_param,
+            agent.ppo_epoch,
+            agent.num_mini_batch,
+            agent.value_loss_coef,
+            agent.entropy_coef,
+            agent.max_grad_norm,
+            agent.use_clipped_value_loss,
+            policy_signature(agent.actor_critic),
+        )
+        ids_by_signature.setdefault(signature, []).append(agent_id)
+
+    return list(ids_by_signature.values()), unbatched
+
+
+class PopulationPPO:
+    """
+    Runs the ``PPO.update()`` of many agents as one batched computation. The policy
+    parameters and ``Adam`` state of the agents are stacked along a new leading
+    dimension, the clipped PPO loss of every agent is differentiated with a single
+    ``vmap(grad(...))`` call per mini batch, and gradient clipping and the ``Adam``
+    step are applied to the stacked tensors. Each agent keeps its own learning
+    rate, ``eps`` and betas (read from its optimizer), its own mini batch sampling,
+    and its own losses. The results are written back into the agents' policies and
+    optimizers by ``update()``.
+
+    Steps before the start of an agent's rollouts are weighted out of its loss and
+    advantage statistics, so the update of an agent born mid-rollout equals
+    ``PPO.update()`` on ``rollouts.since_start()``. Agents with no steps in a mini
+    batch skip its ``Adam`` step.
+
+    Parameters
+    ----------
+    agents : ``List[PPO]``.
+        Agents for which ``is_batchable()`` holds, with identical policy
+        architectures and PPO hyperparameters (see ``group_agents()``).
+    """
+
+    def __init__(self, agents: List[PPO]) -> None:
+        first = agents[0]
+        self.agents = agents
+        self.clip_param = first.clip_param
+        self.ppo_epoch = first.ppo_epoch
+        self.num_mini_batch = first.num_mini_batch
+        self.value_loss_coef = first.value_loss_coef
+        self.entropy_coef = first.entropy_coef
+        self.max_grad_norm = first.max_grad_norm
+        self.use_clipped_value_loss = first.use_clipped_value_loss
+
+        # The template holds no data, it only supplies the forward functions.
+        self.template = copy.deepcopy(first.actor_critic).to("meta")
+
+        policies = [agent.actor_critic for agent in agents]
+        named_params = [dict(policy.named_parameters()) for policy in policies]
+        named_buffers = [dict(policy.named_buffers()) for policy in policies]
+        self.params: Dict[str, torch.Tensor] = {
+            name: torch.stack([params[name].detach() for params in named_params])
+            for name in named_params[0]
+        }
+        self.buffers: Dict[str, torch.Tensor] = {
+            name: torch.stack([buffers[name] for buffers in named_buffers])
+            for name in named_buffers[0]
+        }
+
+        # Stacked ``Adam`` state and hyperparameters, with one entry per agent.
+        device = next(iter(self.params.values())).device
+        groups = [agent.optimizer.param_groups[0] for agent in agents]
+        states = [
+            [agent.optimizer.state.get(param, {}) for param in params.values()]
+            for agent, params in zip(agents, named_params)
+        ]
+        self.lrs = torch.tensor([group["lr"] for group in groups], device=device)
+        self.eps = torch.tensor([group["eps"] for group in groups], device=device)
+        self.beta1s = torch.tensor([group["betas"][0] for group in groups])
+        self.beta2s = torch.tensor([group["betas"][1] for group in groups])
+        self.steps = torch.tensor(
+            [float(state[0].get("step", 0)) if state else 0.0 for state in states],
+            dtype=torch.float64,
+        )
+        self.exp_avgs: Dict[str, torch.Tensor] = {}
+        self.exp_avg_sqs: Dict[str, torch.Tensor] = {}
+        for j, (name, param) in enumerate(self.params.items()):
+            zeros = torch.zeros_like(param[0])
+            self.exp_avgs[name] = torch.stack(
+                [state[j].get("exp_avg", zeros).clone() for state in states]
+            )
+            self.exp_avg_sqs[name] = torch.stack(
+                [state[j].get("exp_avg_sq", zeros).clone() for state in states]
+            )
+
+    def get_values(
+        self, inputs: torch.Tensor, rnn_hxs: torch.Tensor, masks: torch.Tensor
+    ) -> torch.Tensor:
+        """
+        Computes ``Policy.get_value()`` for every agent.
+
+        Parameters
+        ----------
+        inputs : ``torch.Tensor``.
+            Shape: ``(num_agents, num_processes) + obs.shape``.
+        rnn_hxs : ``torch.Tensor``.
+            Shape: ``(num_agents, num_processes, hidden_dim)``.
+        masks : ``torch.Tensor``.
+            Shape: ``(num_agents, num_processes, 1)``.
+
+        Returns
+        -------
+        values : ``torch.Tensor``.
+            Shape: ``(num_agents, num_processes, 1)``.
+        """
+
+        def get_value(
+            params: Dict[str, torch.Tensor],
+            buffers: Dict[str, torch.Tensor],
+            ob: torch.Tensor,
+            hxs: torch.Tensor,
+            mask: torch.Tensor,
+        ) -> torch.Tensor:
+            base_state = (
+                submodule_state(params, "base"),
+                submodule_state(buffers, "base"),
+            )
+            value, _, _ = functional_call(
+                self.template.base, base_state, (ob, hxs, mask)
+            )
+            return value
+
+        values: torch.Tensor = vmap(get_value)(
+            self.params, self.buffers, inputs, rnn_hxs, masks
+        )
+        return values
+
+    def _loss(
+        self,
+        params: Dict[str, torch.Tensor],
+        buffers: Dict[str, torch.Tensor],
+        sample: Tuple[torch.Tensor, ...],
+    ) -> Tuple[torch.Tensor, Tuple[torch.Tensor, torch.Tensor, torch.Tensor]]:
+        """
+        Computes the PPO loss of a single agent on a mini batch, as in
+        ``PPO.update()``, averaged over the samples with nonzero weight. The
+        categorical log probabilities and entropy are computed from the logits
+        directly so that the function can be vectorized.
+
+        Returns
+        -------
+        loss : ``torch.Tensor``.
+            The loss to differentiate.
+        losses : ``Tuple[torch.Tensor, torch.Tensor, torch.Tensor]``.
+            The value loss, action loss and distribution entropy.
+        """
+        (
+            obs_batch,
+            recurrent_hidden_states_batch,
+            actions_batch,
+            value_preds_batch,
+            return_batch,
+            masks_batch,
+            old_action_log_probs_batch,
+            adv_targ,
+            weights,
+        ) = sample
+        num_samples = weights.sum().clamp(min=1.0)
+
+        base_state = (submodule_state(params, "base"), submodule_state(buffers, "base"))
+        linear_state = (
+            submodule_state(params, "dist.linear"),
+            submodule_state(buffers, "dist.linear"),
+        )
+        values, actor_features, _ = functional_call(
+            self.template.base,
+            base_state,
+            (obs_batch, recurrent_hidden_states_batch, masks_batch),
+        )
+        logits = functional_call(
+            self.template.dist.linear, linear_state, actor_features
+        )
+        log_probs = torch.log_softmax(logits, dim=-1)
+        action_log_probs = log_probs.gather(-1, actions_batch)
+        entropies = -(log_probs.exp() * log_probs).sum(-1, keepdim=True)
+        dist_entropy = (entropies * weights).sum() / num_samples
+
+        ratio = torch.exp(action_log_probs - old_action_log_probs_batch)
+        surr1 = ratio * adv_targ
+        surr2 = (
+            torch.clamp(ratio, 1.0 - self.clip_param, 1.0 + self.clip_param) * adv_targ
+        )
+        action_loss = -(torch.min(surr1, surr2) * weights).sum() / num_samples
+
+        if self.use_clipped_value_loss:
+            value_pred_clipped = value_preds_batch + (values - value_preds_batch).clamp(
+                -self.clip_param, self.clip_param
+            )
+            value_losses = (values - return_batch).pow(2)
+            value_losses_clipped = (value_pred_clipped - return_batch).pow(2)
+            value_losses = torch.max(value_losses, value_losses_clipped)
+        else:
+            value_losses = (return_batch - values).pow(2)
+        value_loss = 0.5 * (value_losses * weights).sum() / num_samples
+
+        loss = (
+            value_loss * self.value_loss_coef
+            + action_loss
+            - dist_entropy * self.entropy_coef
+        )
+        return loss, (value_loss.detach(), action_loss.detach(), dist_entropy.detach())
+
+    def _step(self, grads: Dict[str, torch.Tensor], active: torch.Tensor) -> None:
+        """
+        Clips the gradient norm of each agent and applies an ``Adam`` step to the
+        stacked parameters, following ``torch.optim.Adam``.
+
+        Parameters
+        ----------
+        grads : ``Dict[str, torch.Tensor]``.
+            Stacked gradients with the same keys and shapes as ``self.params``.
+        active : ``torch.Tensor``.
+            Whether each agent takes the step. The parameters and ``Adam`` state of
+            the other agents are left as they are.
+            Shape: ``(num_agents,)``.
+        """
+        device = self.lrs.device
+        num_agents = len(self.agents)
+        if self.max_grad_norm is None:
+            clip_coefs = torch.ones(num_agents, device=device)
+        else:
+            total_norms = torch.stack(
+                [g.pow(2).reshape(num_agents, -1).sum(1) for g in grads.values()]
+            ).sum(0).sqrt()
+            clip_coefs = (self.max_grad_norm / (total_norms + 1e-6)).clamp(max=1.0)
+
+        self.steps += active.cpu().double()
+        steps = self.steps.clamp(min=1.0)
+        bias_corrections1 = (1 - self.beta1s.double() ** steps).to(device)
+        bias_corrections2 = (1 - self.beta2s.double() ** steps).to(device)
+        step_sizes = (self.lrs / bias_corrections1).float() * active
+        bias_correction2_sqrts = bias_corrections2.sqrt().float()
+        beta1s = torch.where(active, self.beta1s.to(device), 1.0)
+        beta2s = torch.where(active, self.beta2s.to(device), 1.0)
+
+        for name, param in self.params.items():
+            g = grads[name].mul_(_expand(clip_coefs, param))
+            exp_avg = self.exp_avgs[name]
+            exp_avg_sq = self.exp_avg_sqs[name]
+            exp_avg.lerp_(g, _expand(1 - beta1s, param))
+            exp_avg_sq.mul_(_expand(beta2s, param))
+            exp_avg_sq.addcmul_(g, g * _expand(1 - beta2s, param))
+            denom = exp_avg_sq.sqrt().div_(_expand(bias_correction2_sqrts, param))
+            denom.add_(_expand(self.eps, param))
+            step = denom.reciprocal_().mul_(exp_avg).mul_(_expand(step_sizes, param))
+            param.sub_(step)
+
+    def update(self, rollouts_list: List[RolloutStorage]) -> List[Losses]:
+        """
+        Executes ``PPO.update()`` for every agent, and writes the updated parameters
+        and optimizer state back into the agents.
+
+        Parameters
+        ----------
+        rollouts_list : ``List[RolloutStorage]``.
+            The rollouts of each agent, with returns already computed. Steps before
+            the start of each are left out.
+
+        Returns
+        -------
+        losses : ``List[Losses]``.
+            The value loss, action loss and distribution entropy of each agent,
+            averaged over mini batches as in ``PPO.update()``.
+        """
+        num_agents = len(self.agents)
+
+        # Stacked rollouts, flattened over steps and processes.
+        # Shape (each): ``(num_agents, batch_size, ...)``.
+        data = [
+            stack_rollouts(rollouts_list, name, steps).flatten(1, 2)
+            for name, steps in (
+                ("obs", slice(-1)),
+                ("recurrent_hidden_states", slice(-1)),
+                ("actions", slice(None)),
+                ("value_preds", slice(-1)),
+                ("returns", slice(-1)),
+                ("masks", slice(-1)),
+                ("action_log_probs", slice(None)),
+            )
+        ]
+
+        # Observations may be stored compactly, and are cast once they're stacked.
+        data[0] = data[0].float()
+
+        # Weights of the samples, which are zero for steps before an agent's start.
+        # Shape: ``(num_agents, batch_size, 1)``.
+        num_steps, num_processes = rollouts_list[0].rewards.shape[:2]
+        starts = torch.tensor([rollouts.start for rollouts in rollouts_list])
+        weights = step_mask(starts.to(data[0].device), num_steps).t()
+        weights = weights[:, :, None, None].expand(-1, -1, num_processes, 1)
+        weights = weights.flatten(1, 2)
+
+        # Advantages are normalized by their unbiased mean and standard deviation
+        # over each agent's own steps.
+        advantages = data[4] - data[3]
+        num_samples = weights.sum(dim=(1, 2), keepdim=True)
+        mean = (advantages * weights).sum(dim=(1, 2), keepdim=True) / num_samples
+        deviations = (advantages - mean) * weights
+        std = (
+            deviations.pow(2).sum(dim=(1, 2), keepdim=True)
+            / (num_samples - 1).clamp(min=1.0)
+        ).sqrt()
+        data.append(deviations / (std + 1e-5))
+        data.append(weights)
+
+        batch_size = weights.shape[1]
+        assert batch_size >= self.num_mini_batch, (
+            "PPO requires the number of processes * number of steps ({}) to be "
+            "greater than or equal to the number of PPO mini batches ({})."
+            "".format(batch_size, self.num_mini_batch)
+        )
+        mini_batch_size = batch_size // self.num_mini_batch
+
+        device = weights.device
+        agent_indices = torch.arange(num_agents, device=device).unsqueeze(1)
+        losses = torch.zeros(3, num_agents, device=device)
+        compute_grads = vmap(grad(self._loss, has_aux=True))
+        for _ in range(self.ppo_epoch):
+
+            # An independent random permutation of the batch for each agent.
+            permutations = torch.argsort(
+                torch.rand(num_agents, batch_size, device=device), dim=1
+            )
+            num_samples = self.num_mini_batch * mini_batch_size
+            for start in range(0, num_samples, mini_batch_size):
+                indices = permutations[:, start : start + mini_batch_size]
+                sample = tuple(tensor[agent_indices, indices] for tensor in data)
+                grads, mini_batch_losses = compute_grads(
+                    self.params, self.buffers, sample
+                )
+                self._step(grads, sample[-1].sum(dim=(1, 2)) > 0)
+                losses += torch.stack(mini_batch_losses)
+
+        losses /= self.ppo_epoch * self.num_mini_batch
+        self._write_back()
+
+        return [
+            (value_loss, action_loss, dist_entropy)
+            for value_loss, action_loss, dist_entropy in losses.t().tolist()
+        ]
+
+    def _write_back(self) -> None:
+        """ Copies the stacked parameters and optimizer state into each agent. """
+        for i, agent in enumerate(self.agents):
+            optimizer_state = agent.optimizer.state
+            with torch.no_grad():
+                for name, param in agent.actor_critic.named_parameters():
+                    param.copy_(self.params[name][i])
+                    optimizer_state[param] = {
+                        "step": torch.tensor(float(self.steps[i])),
+                        "exp_avg": self.exp_avgs[name][i].clone(),
+                        "exp_avg_sq": self.exp_avg_sqs[name][i].clone(),
+                    }
+
+
+def _expand(values: torch.Tensor, like: torch.Tensor) -> torch.Tensor:
+    """ Reshapes per-agent ``values`` to broadcast against stacked ``like``. """
+    return values.view((-1,) + (1,) * (like.dim() - 1))
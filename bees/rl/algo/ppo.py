@@ -56,20 +56,28 @@ class PPO(Algo):
 
     def update(self, rollouts: RolloutStorage) -> Tuple[float, float, float]:
         advantages = rollouts.returns[:-1] - rollouts.value_preds[:-1]
-        advantages = (advantages - advantages.mean()) / (advantages.std() + 1e-5)
+        # Rollouts of agents born on their last step have a single advantage.
+        std = advantages.std() if advantages.numel() > 1 else advantages.new_zeros(())
+        advantages = (advantages - advantages.mean()) / (std + 1e-5)
 
         value_loss_epoch = 0.0
         action_loss_epoch = 0.0
         dist_entropy_epoch = 0.0
 
+        # Rollouts of agents born late in a rollout may have fewer samples than
+        # mini batches, in which case each sample is a mini batch of its own.
+        num_mini_batch = self.num_mini_batch
+        if not self.actor_critic.is_recurrent:
+            num_mini_batch = min(num_mini_batch, advantages.numel())
+
         for _ in range(self.ppo_epoch):
             if self.actor_critic.is_recurrent:
                 data_generator = rollouts.recurrent_generator(
-                    advantages, self.num_mini_batch
+                    advantages, num_mini_batch
                 )
             else:
                 data_generator = rollouts.feed_forward_generator(
-                    advantages, self.num_mini_batch
+                    advantages, num_mini_batch
                 )
 
             for sample in data_generator:
@@ -129,7 +137,7 @@ class PPO(Algo):
                 action_loss_epoch += action_loss.item()
                 dist_entropy_epoch += dist_entropy.item()
 
-        num_updates = self.ppo_epoch * self.num_mini_batch
+        num_updates = self.ppo_epoch * num_mini_batch
 
         value_loss_epoch /= num_updates
         action_loss_epoch /= num_updates
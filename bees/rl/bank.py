@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Bounded storage for the initial parameters of policies. """
+import random
+import threading
+from typing import Dict, Tuple, Any, Optional
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from bees.rl.utils import parameter_views
+
+EVICTION_POLICIES = ("fifo", "reservoir")
+
+
+class InitBank:
+    """
+    Bounded bank of policy initializations. Each initialization is stored as one
+    row of a contiguous tensor with at most ``capacity`` rows, which is optionally
+    memory-mapped from a file, so the memory held by the bank doesn't grow with the
+    number of births. Parameters are copied in and out of a row through views of
+    the row shaped like the parameters, without intermediate tensors.
+
+    Parameters
+    ----------
+    capacity : ``int``.
+        Maximum number of stored initializations.
+    eviction : ``str``, optional.
+        Which initialization a new one replaces once the bank is full. With
+        ``"fifo"`` the oldest is replaced, and with ``"reservoir"`` the bank holds a
+        uniform random sample of all initializations ever added.
+    path : ``Optional[str]``, optional.
+        File in which to memory-map the bank. The bank is kept in RAM if not given.
+    """
+
+    def __init__(
+        self, capacity: int, eviction: str = "reservoir", path: Optional[str] = None
+    ) -> None:
+        if capacity < 1:
+            raise ValueError("Init bank capacity must be positive.")
+        if eviction not in EVICTION_POLICIES:
+            raise ValueError(f"Init bank eviction policy '{eviction}' invalid.")
+        self.capacity = capacity
+        self.eviction = eviction
+        self.path = path
+
+        # Allocated on the first ``add()``, once the number of parameters is known.
+        self.storage: Optional[torch.Tensor] = None
+        self.array: Optional[np.memmap] = None
+
+        self.size = 0
+        self.num_added = 0
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """ Memory-mapped banks are pickled as a reference to their file. """
+        state = dict(self.__dict__)
+        del state["lock"]
+        if self.array is not None:
+            self.array.flush()
+            state["array"] = None
+            state["storage"] = None
+            state["shape"] = self.array.shape
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        shape: Optional[Tuple[int, int]] = state.pop("shape", None)
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+        if shape is not None:
+            self.array = np.memmap(self.path, dtype=np.float32, mode="r+", shape=shape)
+            self.storage = torch.from_numpy(self.array)
+
+    def _reserve(self, num_rows: int, num_params: int) -> torch.Tensor:
+        """
+        Returns a backing tensor with at least ``num_rows`` rows. Banks in RAM double
+        in size as needed, up to ``capacity`` rows, and memory-mapped banks are
+        created with ``capacity`` rows.
+        """
+        storage = self.storage
+        if storage is not None and len(storage) >= num_rows:
+            return storage
+        if self.path is not None:
+            shape = (self.capacity, num_params)
+            self.array = np.memmap(self.path, dtype=np.float32, mode="w+", shape=shape)
+            self.storage = torch.from_numpy(self.array)
+            return self.storage
+
+        old_rows = 0 if storage is None else len(storage)
+        new_rows = min(self.capacity, max(num_rows, 2 * old_rows))
+        new_storage = torch.zeros(new_rows, num_params)
+        if storage is not None:
+            new_storage[:old_rows] = storage
+        self.storage = new_storage
+        return new_storage
+
+    def add(self, module: nn.Module) -> None:
+        """ Stores the current parameters of ``module``, evicting one if full. """
+        with self.lock:
+            num_params = sum(param.numel() for param in module.parameters())
+            storage = self._reserve(min(self.size + 1, self.capacity), num_params)
+
+            if self.size < self.capacity:
+                index = self.size
+                self.size += 1
+            elif self.eviction == "fifo":
+                index = self.num_added % self.capacity
+            else:
+                index = random.randrange(self.num_added + 1)
+            self.num_added += 1
+            if index >= self.capacity:
+                return
+
+            views = parameter_views(module, storage[index])
+            with torch.no_grad():
+                for view, param in zip(views, module.parameters()):
+                    view.copy_(param)
+
+    def restore(self, module: nn.Module, index: Optional[int] = None) -> None:
+        """
+        Copies a stored initialization into the parameters of ``module`` in place.
+
+        Parameters
+        ----------
+        module : ``nn.Module``.
+            A module with the same parameter shapes as those added to the bank.
+        index : ``Optional[int]``, optional.
+            The row to restore. A random row is restored if not given.
+        """
+        with self.lock:
+            if self.storage is None or self.size == 0:
+                raise ValueError("Can't restore from an empty init bank.")
+            if index is None:
+                index = random.randrange(self.size)
+            views = parameter_views(module, self.storage[index])
+            with torch.no_grad():
+                for param, view in zip(module.parameters(), views):
+                    param.copy_(view)
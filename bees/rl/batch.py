@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Batched forward passes over many policies with distinct weights. """
+import copy
+from typing import Dict, List, Tuple, Hashable, Any
+
+import torch
+from torch.func import stack_module_state, functional_call, vmap
+
+from bees.rl.model import Policy
+from bees.rl.distributions import Categorical, FixedCategorical
+
+# pylint: disable=too-few-public-methods
+
+ActReturns = Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]
+
+
+class _PolicyGroup:
+    """
+    Parameters of policies with identical architectures stacked along a new
+    leading dimension, along with a parameterless template policy with which to
+    call them.
+
+    Parameters
+    ----------
+    policies : ``List[Policy]``.
+        Policies with identical parameter names and shapes.
+    """
+
+    def __init__(self, policies: List[Policy]) -> None:
+        params, buffers = stack_module_state(policies)
+        self.base_state = (
+            submodule_state(params, "base"),
+            submodule_state(buffers, "base"),
+        )
+        self.linear_state = (
+            submodule_state(params, "dist.linear"),
+            submodule_state(buffers, "dist.linear"),
+        )
+
+        # The template holds no data, it only supplies the forward functions.
+        self.template = copy.deepcopy(policies[0]).to("meta")
+
+    def act(
+        self, inputs: torch.Tensor, rnn_hxs: torch.Tensor, masks: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """
+        Computes values and action logits for every policy in the group.
+
+        Parameters
+        ----------
+        inputs : ``torch.Tensor``.
+            Shape: ``(num_policies, 1) + obs.shape``.
+        rnn_hxs : ``torch.Tensor``.
+            Shape: ``(num_policies, 1, hidden_dim)``.
+        masks : ``torch.Tensor``.
+            Shape: ``(num_policies, 1, 1)``.
+
+        Returns
+        -------
+        values : ``torch.Tensor``.
+            Shape: ``(num_policies, 1, 1)``.
+        logits : ``torch.Tensor``.
+            Shape: ``(num_policies, 1, num_actions)``.
+        rnn_hxs : ``torch.Tensor``.
+            Shape: ``(num_policies, 1, hidden_dim)``.
+        """
+
+        def forward(
+            base_state: Tuple[Dict[str, torch.Tensor], Dict[str, torch.Tensor]],
+            linear_state: Tuple[Dict[str, torch.Tensor], Dict[str, torch.Tensor]],
+            ob: torch.Tensor,
+            hxs: torch.Tensor,
+            mask: torch.Tensor,
+        ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+            value, features, hxs = functional_call(
+                self.template.base, base_state, (ob, hxs, mask)
+            )
+            logits = functional_call(self.template.dist.linear, linear_state, features)
+            return value, logits, hxs
+
+        values, logits, rnn_hxs = vmap(forward)(
+            self.base_state, self.linear_state, inputs, rnn_hxs, masks
+        )
+        return values, logits, rnn_hxs
+
+
+class PolicyStack:
+    """
+    Computes the forward pass of many policies at once. Policies which share an
+    architecture have their parameters stacked, and are evaluated with a single
+    vectorized ``functional_call``, so the cost of acting grows sub-linearly with
+    the number of policies. Policies which can't be vectorized (recurrent policies
+    and those without a ``Categorical`` action distribution) fall back to
+    ``Policy.act()``.
+
+    The stacked parameters are copies, so they are cached and only rebuilt when
+    the set of policies changes or after ``invalidate()`` is called, which must
+    happen whenever any policy's parameters are updated.
+    """
+
+    def __init__(self) -> None:
+        self.keys: List[Tuple[Hashable, int]] = []
+        self.groups: List[Tuple[List[int], _PolicyGroup]] = []
+        self.unbatched: List[int] = []
+
+    def invalidate(self) -> None:
+        """ Discards the stacked parameters, e.g. after a weight update. """
+        self.keys = []
+        self.groups = []
+        self.unbatched = []
+
+    def _restack(self, policies: List[Policy]) -> None:
+        """ Groups ``policies`` by architecture and stacks each group. """
+        indices_by_signature: Dict[Any, List[int]] = {}
+        self.unbatched = []
+        for i, policy in enumerate(policies):
+            if policy.is_recurrent or not isinstance(policy.dist, Categorical):
+                self.unbatched.append(i)
+                continue
+            indices_by_signature.setdefault(policy_signature(policy), []).append(i)
+
+        self.groups = [
+            (indices, _PolicyGroup([policies[i] for i in indices]))
+            for indices in indices_by_signature.values()
+        ]
+
+    def act(
+        self,
+        keys: List[Hashable],
+        policies: List[Policy],
+        inputs: torch.Tensor,
+        rnn_hxs: torch.Tensor,
+        masks: torch.Tensor,
+    ) -> List[ActReturns]:
+        """
+        Computes ``Policy.act()`` for every policy, sampling actions rather than
+        taking the mode.
+
+        Parameters
+        ----------
+        keys : ``List[Hashable]``.
+            Unique keys (e.g. agent ids) for the policies, used to decide whether the
+            cached stacked parameters are still valid.
+        policies : ``List[Policy]``.
+            The policies to evaluate.
+        inputs : ``torch.Tensor``.
+            Observations for each policy.
+            Shape: ``(len(policies), 1) + obs.shape``.
+        rnn_hxs : ``torch.Tensor``.
+            Recurrent hidden states for each policy.
+            Shape: ``(len(policies), 1, hidden_dim)``.
+        masks : ``torch.Tensor``.
+            Masks for each policy.
+            Shape: ``(len(policies), 1, 1)``.
+
+        Returns
+        -------
+        act_returns : ``List[ActReturns]``.
+            For each policy, the value, action, action log probability, recurrent
+            hidden state and action probabilities, with the same shapes as those
+            returned by ``Policy.act()`` for a single process.
+        """
+        stack_keys = [(key, id(policy)) for key, policy in zip(keys, policies)]
+        if stack_keys != self.keys:
+            self._restack(policies)
+            self.keys = stack_keys
+
+        act_returns: List[ActReturns] = [None] * len(policies)  # type: ignore
+        for indices, group in self.groups:
+
+            # A group of all of the policies takes the inputs as they are.
+            group_inputs: Tuple[torch.Tensor, ...] = (inputs, rnn_hxs, masks)
+            if len(indices) < len(policies):
+                index = torch.tensor(indices, device=inputs.device)
+                group_inputs = tuple(
+                    tensor.index_select(0, index) for tensor in group_inputs
+                )
+            values, logits, group_hxs = group.act(*group_inputs)
+
+            # Distributions are built outside of ``vmap()`` so that sampling uses the
+            # global random state.
+            dist = FixedCategorical(logits=logits.squeeze(1))
+            actions = dist.sample()
+            action_log_probs = dist.log_probs(actions)
+            probs = dist.probs
+            for j, i in enumerate(indices):
+                act_returns[i] = (
+                    values[j],
+                    actions[j : j + 1],
+                    action_log_probs[j : j + 1],
+                    group_hxs[j],
+                    probs[j : j + 1],
+                )
+
+        for i in self.unbatched:
+            act_returns[i] = policies[i].act(inputs[i], rnn_hxs[i], masks[i])
+
+        return act_returns
+
+
+def policy_signature(policy: Policy) -> Tuple[Any, ...]:
+    """ Returns a key which is equal for policies whose parameters can be stacked. """
+    return tuple(
+        (name, tuple(tensor.shape), tensor.dtype, str(tensor.device))
+        for name, tensor in policy.state_dict().items()
+    )
+
+
+def submodule_state(
+    state: Dict[str, torch.Tensor], prefix: str
+) -> Dict[str, torch.Tensor]:
+    """ Returns the entries of ``state`` under ``prefix``, with the prefix removed. """
+    start = len(prefix) + 1
+    return {
+        name[start:]: tensor
+        for name, tensor in state.items()
+        if name.startswith(prefix + ".")
+    }
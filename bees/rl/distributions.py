@@ -1,8 +1,8 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """ Modifies standard torch distributions so they are compatible with this library. """
-from typing import List
-from itertools import product
+
+from typing import List, Any
 
 import torch
 import torch.nn as nn
@@ -180,13 +180,15 @@ class FixedBernoulli(torch.distributions.Bernoulli):
 
 class FixedCategoricalProduct(Distribution):
     """
-    A cartesian product of ``FixedProduct`` distributions.
+    A cartesian product of ``FixedCategorical`` distributions, represented as a
+    single categorical distribution over the flattened tuples of subactions.
     ``m`` : number of distributions.
 
     Parameters
     ----------
     logits_list : ``List[torch.Tensor]``.
         List of logits, one tensor of logits per distribution.
+        Shape of each: ``(num_processes, n_i)``.
     """
 
     def __init__(self, logits_list: List[torch.Tensor]):
@@ -195,109 +197,104 @@ class FixedCategoricalProduct(Distribution):
             FixedCategorical(logits=logits) for logits in logits_list
         ]
 
+        # Strides of each subaction in the flattened index of a tuple of subactions.
+        sizes = [logits.shape[-1] for logits in logits_list]
+        strides = [1] * len(sizes)
+        for i in reversed(range(len(sizes) - 1)):
+            strides[i] = strides[i + 1] * sizes[i + 1]
+        device = logits_list[0].device
+        self.sizes = torch.tensor(sizes, device=device)
+        self.strides = torch.tensor(strides, device=device)
+
         # If the logits are changed, this object will break!
         self.probs = self.compute_probs()
+        self.joint = FixedCategorical(probs=self.probs.flatten(start_dim=1))
 
     def mode(self) -> torch.Tensor:
         """
-        Returns a tensor of the means of each distribution.
+        Returns the most likely tuple of subactions for each process.
 
         Returns
         -------
-        <means> : ``torch.Tensor``.
-            Shape: ``(m,)``.
+        <mode> : ``torch.Tensor``.
+            Shape: ``(num_processes, m)``.
         """
-        return torch.stack(
-            [categorical.mode().view((1,)) for categorical in self.fixed_categoricals],
-            dim=1,
-        )
+        return self.unflatten(self.joint.mode())
 
     def sample(self) -> torch.Tensor:
         """
-        Returns a tensor of samples from each distribution.
+        Returns a tuple of subactions sampled for each process.
 
         Returns
         -------
-        <means> : ``torch.Tensor``.
-            Shape: ``(m,)``.
+        <sample> : ``torch.Tensor``.
+            Shape: ``(num_processes, m)``.
         """
-        return torch.stack(
-            [
-                categorical.sample().view((1,))
-                for categorical in self.fixed_categoricals
-            ],
-            dim=1,
-        )
+        return self.unflatten(self.joint.sample())
 
     def log_probs(self, actions: torch.Tensor) -> torch.Tensor:
         """
-        Computes the log likelihood of each subaction.
+        Computes the log likelihood of each tuple of subactions.
 
         Parameters
         ----------
         actions : ``torch.Tensor``.
             The actions from ``action_tensor_dict``.
-            Shape: ``(num_processes, num_subactions)``.
+            Shape: ``(num_processes, m)``.
 
         Returns
         -------
         log_probabilities : ``torch.Tensor``.
             The log probabilities of each action.
-            Shape: ``(num_subactions,)``.
+            Shape: ``(num_processes, 1)``.
+        """
+        flat_actions = (actions.long() * self.strides).sum(-1, keepdim=True)
+        return self.joint.log_probs(flat_actions)
+
+    def unflatten(self, flat_actions: torch.Tensor) -> torch.Tensor:
+        """
+        Converts indices into the flattened joint distribution into subactions.
+
+        Parameters
+        ----------
+        flat_actions : ``torch.Tensor``.
+            Shape: ``(num_processes, 1)``.
+
+        Returns
+        -------
+        actions : ``torch.Tensor``.
+            Shape: ``(num_processes, m)``.
         """
-        num_subactions = actions.shape[1]
-        subaction_log_probs_list = []
-        for categorical, subaction_index in zip(
-            self.fixed_categoricals, range(num_subactions)
-        ):
-            action = actions[:, subaction_index]
-            subaction_log_probs_list.append(categorical.log_probs(action))
-        subaction_log_probs = torch.cat(subaction_log_probs_list, dim=-1)
-
-        # Shape: ``(num_subactions,)``.
-        log_probabilities = torch.sum(subaction_log_probs, dim=-1)
-        return log_probabilities
+        return (flat_actions // self.strides) % self.sizes
 
     def compute_probs(self) -> torch.Tensor:
         """
-        Computes the probability of each action, that is, each tuple of subactions.
+        Computes the probability of each action, that is, each tuple of subactions,
+        as the outer product of the probabilities of the subactions.
 
         Returns
         -------
         probs : ``torch.Tensor``.
-            The probability of each each.
-            Shape: Same as the shape of the action space.
+            The probability of each action.
+            Shape: ``(num_processes,) + <shape of the action space>``.
             Example: If we have:
             ```
             action_space = gym.spaces.Tuple(
                 (gym.spaces.Discrete(5), gym.spaces.Discrete(2), gym.spaces.Discrete(2))
             )
             ```
-            Then the shape of ``probs`` will be (5, 2, 2), and ``probs[3][1][0]`` will
-            be the probability of taking action (3, 1, 0).
+            Then the shape of ``probs`` will be (num_processes, 5, 2, 2), and
+            ``probs[p][3][1][0]`` will be the probability of taking action (3, 1, 0)
+            in process ``p``.
         """
 
-        # Compute the shape of ``probs`` and initialize ``probs``.
-        num_processes = self.fixed_categoricals[0].probs.shape[0]
-        subaction_sizes = [dist.probs.shape[-1] for dist in self.fixed_categoricals]
-        probs_shape = [num_processes] + subaction_sizes
-
-        # HARDCODE
-        device = torch.device("cuda:0")
-        probs = torch.zeros(probs_shape).to(device)
-
-        # Iterate over all actions by taking the product of subaction spaces.
-        for action in product(
-            *[list(range(subaction_size)) for subaction_size in subaction_sizes]
-        ):
-            for process in range(num_processes):
-
-                # The probability of an action is the product of probabilities of its
-                # subactions.
-                probs_index = (process,) + action
-                probs[probs_index] = 1.0
-                for i, categorical in enumerate(self.fixed_categoricals):
-                    probs[probs_index] *= categorical.probs[process][action[i]]
+        # Operands and subscripts for ``einsum()``: ``0`` is the process dimension
+        # and ``i + 1`` is the dimension of the ``i``-th subaction.
+        operands: List[Any] = []
+        for i, categorical in enumerate(self.fixed_categoricals):
+            operands += [categorical.probs, [0, i + 1]]
+        operands.append(list(range(len(self.fixed_categoricals) + 1)))
+        probs = torch.einsum(*operands)
 
         return probs
 
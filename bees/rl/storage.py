@@ -1,14 +1,29 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """ Trajectory storage class and helper functions. """
-from typing import Tuple, Optional, Generator
+from typing import Any, Dict, List, Tuple, Union, Optional, Sequence, Generator
 
 import gym
 import torch
+import numpy as np
 from torch.utils.data.sampler import BatchSampler, SubsetRandomSampler
 
 # pylint: disable=invalid-name
 
+# Names of the per-step scalars of ``RolloutStorage``, all of which are stored in
+# one buffer. The masks come last so that they can be filled together.
+SCALARS = (
+    "rewards",
+    "value_preds",
+    "returns",
+    "action_log_probs",
+    "masks",
+    "bad_masks",
+)
+
+# Names of the tensors of ``RolloutStorage`` which hold all of its contents.
+STORE_TENSORS = ("obs", "recurrent_hidden_states", "actions", "scalars")
+
 
 def _flatten_first_two_dims(T: int, N: int, _tensor: torch.Tensor) -> torch.Tensor:
     """ Collapse the first two dimensions of ``_tensor``. """
@@ -27,9 +42,335 @@ def get_action_shape(action_space: gym.spaces.space.Space) -> int:
     return action_shape
 
 
+def step_mask(starts: torch.Tensor, num_steps: int) -> torch.Tensor:
+    """
+    Returns which steps of a rollout were taken by agents which start at
+    ``starts``, i.e. ``1.0`` for step ``t`` of a rollout with ``start <= t``, and
+    ``0.0`` for the steps before.
+
+    Parameters
+    ----------
+    starts : ``torch.Tensor``.
+        The first step of each rollout.
+        Shape: ``(...)``.
+    num_steps : ``int``.
+        The length of the rollouts.
+
+    Returns
+    -------
+    mask : ``torch.Tensor``.
+        Shape: ``(num_steps, ...)``.
+    """
+    steps = torch.arange(num_steps, device=starts.device)
+    steps = steps.view(num_steps, *([1] * starts.dim()))
+    return (steps >= starts).float()
+
+
+def reverse_linear_scan(
+    coeffs: torch.Tensor, discounts: torch.Tensor, last: torch.Tensor
+) -> torch.Tensor:
+    """
+    Computes ``x[t] = coeffs[t] + discounts[t] * x[t + 1]`` for every ``t``, with
+    ``x[T] = last``, in ``log2(T)`` vectorized steps. The recurrence is a parallel
+    prefix scan over the affine maps ``x -> coeffs[t] + discounts[t] * x``.
+
+    Parameters
+    ----------
+    coeffs : ``torch.Tensor``.
+        Constant terms.
+        Shape: ``(T, ...)``.
+    discounts : ``torch.Tensor``.
+        Multiplicative terms.
+        Shape: ``(T, ...)``.
+    last : ``torch.Tensor``.
+        The value after the last step.
+        Shape: ``(...)``.
+
+    Returns
+    -------
+    values : ``torch.Tensor``.
+        Shape: ``(T, ...)``.
+    """
+    # After the step with offset ``d``, ``coeffs[t]`` and ``discounts[t]`` compose
+    # the maps of steps ``t`` through ``t + 2d - 1``.
+    num_steps = coeffs.size(0)
+    offset = 1
+    while offset < num_steps:
+        coeffs = torch.cat(
+            (
+                coeffs[:-offset] + discounts[:-offset] * coeffs[offset:],
+                coeffs[-offset:],
+            )
+        )
+        discounts = torch.cat(
+            (discounts[:-offset] * discounts[offset:], discounts[-offset:])
+        )
+        offset *= 2
+    return coeffs + discounts * last
+
+
+def discounted_returns(
+    rewards: torch.Tensor,
+    value_preds: torch.Tensor,
+    masks: torch.Tensor,
+    bad_masks: torch.Tensor,
+    next_value: torch.Tensor,
+    use_gae: bool,
+    gamma: float,
+    gae_lambda: float,
+    use_proper_time_limits: bool = True,
+) -> torch.Tensor:
+    """
+    Computes the returns of a rollout, or of many rollouts stacked along any
+    dimensions after the first.
+
+    Parameters
+    ----------
+    rewards : ``torch.Tensor``.
+        Shape: ``(T, ...)``.
+    value_preds : ``torch.Tensor``.
+        Value predictions, whose last step is ``next_value`` when ``use_gae``.
+        Shape: ``(T + 1, ...)``.
+    masks : ``torch.Tensor``.
+        Shape: ``(T + 1, ...)``.
+    bad_masks : ``torch.Tensor``.
+        Shape: ``(T + 1, ...)``.
+    next_value : ``torch.Tensor``.
+        Value prediction for the observation after the last step.
+        Shape: ``(...)``.
+    use_gae : ``bool``.
+        Whether to compute returns from generalized advantage estimates.
+    gamma : ``float``.
+        Discount factor.
+    gae_lambda : ``float``.
+        GAE parameter.
+    use_proper_time_limits : ``bool``, optional.
+        Whether to bootstrap from value predictions at time limit end states.
+
+    Returns
+    -------
+    returns : ``torch.Tensor``.
+        The return of every step.
+        Shape: ``(T, ...)``.
+    """
+    next_masks = masks[1:]
+    if use_gae:
+        deltas = rewards + gamma * value_preds[1:] * next_masks - value_preds[:-1]
+        discounts = gamma * gae_lambda * next_masks
+        if use_proper_time_limits:
+            deltas = deltas * bad_masks[1:]
+            discounts = discounts * bad_masks[1:]
+        gaes = reverse_linear_scan(deltas, discounts, torch.zeros_like(next_value))
+        return gaes + value_preds[:-1]
+
+    coeffs = rewards
+    discounts = gamma * next_masks
+    if use_proper_time_limits:
+        next_bad_masks = bad_masks[1:]
+        coeffs = rewards * next_bad_masks + (1 - next_bad_masks) * value_preds[:-1]
+        discounts = discounts * next_bad_masks
+    return reverse_linear_scan(coeffs, discounts, next_value)
+
+
+def compute_returns_batch(
+    rollouts_list: List["RolloutStorage"],
+    next_values: torch.Tensor,
+    use_gae: bool,
+    gamma: float,
+    gae_lambda: float,
+    use_proper_time_limits: bool = True,
+) -> None:
+    """
+    Computes the returns of many rollouts of the same length at once, equivalent
+    to calling ``compute_returns()`` on each of them. Returns of the steps before
+    the start of each rollout are set to zero.
+
+    Parameters
+    ----------
+    rollouts_list : ``List[RolloutStorage]``.
+        Rollouts, updated in place.
+    next_values : ``torch.Tensor``.
+        Value prediction for the observation after the last step of each rollout.
+        Shape: ``(len(rollouts_list), num_processes, 1)``.
+    use_gae : ``bool``.
+        Whether to compute returns from generalized advantage estimates.
+    gamma : ``float``.
+        Discount factor.
+    gae_lambda : ``float``.
+        GAE parameter.
+    use_proper_time_limits : ``bool``, optional.
+        Whether to bootstrap from value predictions at time limit end states.
+    """
+    # Shape: ``(len(SCALARS), num_steps + 1, len(rollouts_list), num_processes, 1)``.
+    store_slots = get_store_slots(rollouts_list)
+    if store_slots is not None:
+        store, slots = store_slots
+        scalars = store.scalars.index_select(2, slots).unsqueeze(3)
+    else:
+        scalars = torch.stack([rollouts.scalars for rollouts in rollouts_list], dim=2)
+    rewards, value_preds, _, _, masks, bad_masks = scalars
+    rewards = rewards[:-1]
+    if use_gae:
+        value_preds[-1] = next_values
+    returns = discounted_returns(
+        rewards,
+        value_preds,
+        masks,
+        bad_masks,
+        next_values,
+        use_gae,
+        gamma,
+        gae_lambda,
+        use_proper_time_limits,
+    )
+    starts = torch.tensor(
+        [rollouts.start for rollouts in rollouts_list], device=returns.device
+    )
+    returns = returns * step_mask(starts, returns.size(0))[:, :, None, None]
+    if store_slots is not None:
+        last = "value_preds" if use_gae else "returns"
+        store.scalars[SCALARS.index(last), -1].index_copy_(
+            0, slots, next_values.squeeze(1)
+        )
+        store.scalars[SCALARS.index("returns"), :-1].index_copy_(
+            1, slots, returns.squeeze(2)
+        )
+        return
+    for i, rollouts in enumerate(rollouts_list):
+        if use_gae:
+            rollouts.value_preds[-1] = next_values[i]
+        else:
+            rollouts.returns[-1] = next_values[i]
+        rollouts.returns[:-1] = returns[:, i]
+
+
+def get_store_slots(
+    rollouts_list: Sequence["RolloutStorage"],
+) -> Optional[Tuple["RolloutStore", torch.Tensor]]:
+    """
+    Returns the ``RolloutStore`` of which all of ``rollouts_list`` are views, and
+    their slots in it, or ``None`` if they aren't all views of one store.
+    """
+    if not rollouts_list:
+        return None
+    store = rollouts_list[0].store
+    if store is None or any(rollouts.store is not store for rollouts in rollouts_list):
+        return None
+    slots = torch.tensor(
+        [rollouts.slot for rollouts in rollouts_list], device=store.obs.device
+    )
+    return store, slots
+
+
+def stack_rollouts(
+    rollouts_list: Sequence["RolloutStorage"],
+    name: str,
+    steps: Union[int, slice, Sequence[int]] = slice(None),
+) -> torch.Tensor:
+    """
+    Returns the steps ``steps`` of the tensor ``name`` of each of ``rollouts_list``,
+    stacked along a new leading dimension. Views of one ``RolloutStore`` are read
+    with a single gather over the slot dimension of its tensors, and all other
+    rollouts are stacked one by one.
+
+    Parameters
+    ----------
+    rollouts_list : ``Sequence[RolloutStorage]``.
+        The rollouts to read.
+    name : ``str``.
+        The name of a tensor of ``RolloutStorage``, e.g. ``"obs"`` or ``"masks"``,
+        other than ``"scalars"``.
+    steps : ``Union[int, slice, Sequence[int]]``, optional.
+        The index along the step axis, the same for all rollouts, or one integer
+        index for each of them.
+
+    Returns
+    -------
+    tensor : ``torch.Tensor``.
+        Shape: ``(len(rollouts_list),) + getattr(rollouts, name)[step].shape``.
+    """
+    store_slots = get_store_slots(rollouts_list)
+    if store_slots is None:
+        if isinstance(steps, (int, slice)):
+            return torch.stack(
+                [getattr(rollouts, name)[steps] for rollouts in rollouts_list]
+            )
+        return torch.stack(
+            [
+                getattr(rollouts, name)[step]
+                for rollouts, step in zip(rollouts_list, steps)
+            ]
+        )
+
+    store, slots = store_slots
+    if name in SCALARS:
+        tensor = store.scalars[SCALARS.index(name)]
+        if name in ("rewards", "action_log_probs"):
+            tensor = tensor[: store.num_steps]
+    else:
+        tensor = getattr(store, name)
+
+    # Slots take the place of processes, so a process dimension is added back.
+    if isinstance(steps, slice):
+        return tensor[steps].transpose(0, 1).index_select(0, slots).unsqueeze(2)
+    if isinstance(steps, int):
+        return tensor[steps].index_select(0, slots).unsqueeze(1)
+    step_index = torch.tensor(steps, device=slots.device)
+    return tensor[step_index, slots].unsqueeze(1)
+
+
+def insert_batch(
+    rollouts_list: Sequence["RolloutStorage"],
+    obs: Sequence[Union[np.ndarray, torch.Tensor]],
+    act_returns: Sequence[Tuple[torch.Tensor, ...]],
+    rewards: Sequence[float],
+    dones: Sequence[bool],
+    bad_transitions: Sequence[bool],
+) -> None:
+    """
+    Writes a step of many rollouts straight into their storage tensors, as
+    ``RolloutStorage.insert_step()`` does for one.
+
+    Parameters
+    ----------
+    rollouts_list : ``Sequence[RolloutStorage]``.
+        Rollouts, updated in place.
+    obs : ``Sequence[Union[np.ndarray, torch.Tensor]]``.
+        The observation after the step for each rollout.
+    act_returns : ``Sequence[Tuple[torch.Tensor, ...]]``.
+        The value, action, action log probability and recurrent hidden state, in
+        the order returned by ``Policy.act()``, for each rollout.
+    rewards : ``Sequence[float]``.
+        The reward for each rollout.
+    dones : ``Sequence[bool]``.
+        Whether the episode of each rollout ended with the step.
+    bad_transitions : ``Sequence[bool]``.
+        Whether the episode of each rollout ended because of a time limit.
+    """
+    for rollouts, ob, fwds, reward, done, bad_transition in zip(
+        rollouts_list, obs, act_returns, rewards, dones, bad_transitions
+    ):
+        value, action, action_log_prob, recurrent_hidden_states = fwds[:4]
+        rollouts.insert_step(
+            ob,
+            recurrent_hidden_states,
+            action,
+            action_log_prob,
+            value,
+            reward,
+            done,
+            bad_transition,
+        )
+
+
 class RolloutStorage:
     """
-    A class for storing rollouts/trajectories for actor-critic policies.
+    A class for storing rollouts/trajectories for actor-critic policies. Rollouts
+    handed out by a ``RolloutStore`` are views of one of its slots.
+
+    Steps are indexed by their position in the rollout of the whole population, so
+    the rollouts of an agent born mid-rollout begin at ``self.start``. The steps
+    before it are left out of returns and updates until ``after_update()``.
 
     Parameters
     ----------
@@ -43,6 +384,9 @@ class RolloutStorage:
         The action space.
     recurrent_hidden_state_size : ``int``.
         The dimension of the hidden state for the GRU if the policy is recurrent.
+    obs_dtype : ``torch.dtype``, optional.
+        The dtype in which observations are stored, e.g. ``torch.uint8`` for
+        binary observations. They are cast to floats by ``get_obs()``.
     """
 
     def __init__(
@@ -52,39 +396,103 @@ class RolloutStorage:
         obs_shape: Tuple[int, ...],
         action_space: gym.Space,
         recurrent_hidden_state_size: int,
+        obs_dtype: torch.dtype = torch.float32,
     ):
-        self.obs = torch.zeros(num_steps + 1, num_processes, *obs_shape)
+        self.obs = torch.zeros(
+            num_steps + 1, num_processes, *obs_shape, dtype=obs_dtype
+        )
         self.recurrent_hidden_states = torch.zeros(
             num_steps + 1, num_processes, recurrent_hidden_state_size
         )
-        self.rewards = torch.zeros(num_steps, num_processes, 1)
-        self.value_preds = torch.zeros(num_steps + 1, num_processes, 1)
-        self.returns = torch.zeros(num_steps + 1, num_processes, 1)
-        self.action_log_probs = torch.zeros(num_steps, num_processes, 1)
         action_shape = get_action_shape(action_space)
         self.actions = torch.zeros(num_steps, num_processes, action_shape)
         if action_space.__class__.__name__ == "Discrete":
             self.actions = self.actions.long()
-        self.masks = torch.ones(num_steps + 1, num_processes, 1)
 
-        # Masks that indicate whether it's a true terminal state
-        # or time limit end state
-        self.bad_masks = torch.ones(num_steps + 1, num_processes, 1)
+        # The per-step scalars share one buffer, and are views into it, in the
+        # order of ``SCALARS``. Masks indicate whether a state is terminal, and bad
+        # masks whether it is a time limit end state.
+        self.scalars = torch.zeros(len(SCALARS), num_steps + 1, num_processes, 1)
+        self.scalars[SCALARS.index("masks") :].fill_(1.0)
+        self.rewards: torch.Tensor
+        self.value_preds: torch.Tensor
+        self.returns: torch.Tensor
+        self.action_log_probs: torch.Tensor
+        self.masks: torch.Tensor
+        self.bad_masks: torch.Tensor
 
         self.num_steps = num_steps
         self.step = 0
+        self.start = 0
+        self._bind_scalars()
+
+        # The store and slot of which the tensors are views, if any.
+        self.store: Optional[RolloutStore] = None
+        self.slot: Optional[int] = None
+
+    def _bind_scalars(self) -> None:
+        """ Points the scalar attributes at their slices of ``self.scalars``. """
+        for i, name in enumerate(SCALARS):
+            scalar = self.scalars[i]
+            if name in ("rewards", "action_log_probs"):
+                scalar = scalar[: self.num_steps]
+            setattr(self, name, scalar)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """
+        Leaves out the scalar views, which not all picklers keep as views. Slot
+        views are saved as compact copies of their slot, without the store.
+        """
+        state = dict(self.__dict__)
+        for name in SCALARS:
+            del state[name]
+        if self.store is not None:
+            for name in STORE_TENSORS:
+                state[name] = state[name].clone(memory_format=torch.contiguous_format)
+            state["store"] = None
+            state["slot"] = None
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        """ Restores the scalar views, packing them if saved as separate tensors. """
+        if "scalars" not in state:
+            steps = state["value_preds"].size(0)
+            state["scalars"] = torch.stack(
+                [
+                    torch.cat((state[name], torch.zeros_like(state[name][:1])))
+                    if state[name].size(0) < steps
+                    else state[name]
+                    for name in SCALARS
+                ]
+            )
+        state.setdefault("store", None)
+        state.setdefault("slot", None)
+        state.setdefault("start", 0)
+        self.__dict__.update(state)
+        self._bind_scalars()
+
+    def get_obs(self, index: Union[int, slice]) -> torch.Tensor:
+        """ Returns the observations at ``index`` along the step axis as floats. """
+        return self.obs[index].float()
 
     def to(self, device: torch.device) -> None:
         """ Load all the state onto ``device``. """
         self.obs = self.obs.to(device)
         self.recurrent_hidden_states = self.recurrent_hidden_states.to(device)
-        self.rewards = self.rewards.to(device)
-        self.value_preds = self.value_preds.to(device)
-        self.returns = self.returns.to(device)
-        self.action_log_probs = self.action_log_probs.to(device)
         self.actions = self.actions.to(device)
-        self.masks = self.masks.to(device)
-        self.bad_masks = self.bad_masks.to(device)
+        self.scalars = self.scalars.to(device)
+        self._bind_scalars()
+
+    def reset(self) -> None:
+        """ Return all storage tensors to their initial values, in place. """
+        self.obs.zero_()
+        self.recurrent_hidden_states.zero_()
+        self.actions.zero_()
+        masks_index = SCALARS.index("masks")
+        self.scalars[:masks_index].zero_()
+        self.scalars[masks_index:].fill_(1.0)
+        self.step = 0
+        self.start = 0
 
     def insert(
         self,
@@ -109,12 +517,94 @@ class RolloutStorage:
 
         self.step = (self.step + 1) % self.num_steps
 
+    def copy_(self, rollouts: "RolloutStorage") -> None:
+        """ Copies the contents, step and start of ``rollouts`` into these rollouts. """
+        for name in STORE_TENSORS:
+            getattr(self, name).copy_(getattr(rollouts, name))
+        self.step = rollouts.step
+        self.start = rollouts.start
+
+    def since_start(self) -> "RolloutStorage":
+        """
+        Returns these rollouts from ``self.start`` on, as rollouts of
+        ``self.num_steps - self.start`` steps which share the tensors of these.
+        """
+        if self.start == 0:
+            return self
+        rollouts = RolloutStorage.__new__(RolloutStorage)
+        rollouts.num_steps = self.num_steps - self.start
+        rollouts.step = 0
+        rollouts.start = 0
+        rollouts.store = None
+        rollouts.slot = None
+        for name in STORE_TENSORS:
+            tensor = getattr(self, name)
+            if name == "scalars":
+                tensor = tensor[:, self.start :]
+            else:
+                tensor = tensor[self.start :]
+            setattr(rollouts, name, tensor)
+        rollouts._bind_scalars()  # pylint: disable=protected-access
+        return rollouts
+
+    def insert_step(
+        self,
+        ob: Union[np.ndarray, torch.Tensor],
+        recurrent_hidden_states: torch.Tensor,
+        action: torch.Tensor,
+        action_log_prob: torch.Tensor,
+        value_pred: torch.Tensor,
+        reward: float,
+        done: bool,
+        bad_transition: bool,
+    ) -> None:
+        """
+        Writes a step of a single process straight into the storage tensors, from
+        an unbatched observation, Python scalars and the outputs of ``act()``,
+        without building any intermediate tensors.
+
+        Parameters
+        ----------
+        ob : ``Union[np.ndarray, torch.Tensor]``.
+            The observation after the step.
+            Shape: ``obs_shape``.
+        recurrent_hidden_states : ``torch.Tensor``.
+            Shape: ``(1, recurrent_hidden_state_size)``.
+        action : ``torch.Tensor``.
+            Shape: ``(1, action_shape)``.
+        action_log_prob : ``torch.Tensor``.
+            Shape: ``(1, 1)``.
+        value_pred : ``torch.Tensor``.
+            Shape: ``(1, 1)``.
+        reward : ``float``.
+            The reward for the step.
+        done : ``bool``.
+            Whether the episode ended with the step.
+        bad_transition : ``bool``.
+            Whether the episode ended with the step because of a time limit.
+        """
+        step = self.step
+        self.obs[step + 1, 0].copy_(torch.as_tensor(ob))
+        self.recurrent_hidden_states[step + 1].copy_(recurrent_hidden_states)
+        self.actions[step].copy_(action)
+        self.action_log_probs[step].copy_(action_log_prob)
+        self.value_preds[step].copy_(value_pred)
+        self.rewards[step, 0, 0] = reward
+        self.masks[step + 1, 0, 0] = 0.0 if done else 1.0
+        self.bad_masks[step + 1, 0, 0] = 0.0 if bad_transition else 1.0
+
+        self.step = (step + 1) % self.num_steps
+
     def after_update(self) -> None:
-        """ Copy the latest element of storage objects into the first position. """
+        """
+        Copy the latest element of storage objects into the first position, where
+        the next rollout, which is taken entirely by the agent, starts.
+        """
         self.obs[0].copy_(self.obs[-1])
         self.recurrent_hidden_states[0].copy_(self.recurrent_hidden_states[-1])
-        self.masks[0].copy_(self.masks[-1])
-        self.bad_masks[0].copy_(self.bad_masks[-1])
+        masks_index = SCALARS.index("masks")
+        self.scalars[masks_index:, 0].copy_(self.scalars[masks_index:, -1])
+        self.start = 0
 
     def compute_returns(
         self,
@@ -124,49 +614,27 @@ class RolloutStorage:
         gae_lambda: float,
         use_proper_time_limits: bool = True,
     ) -> None:
-        if use_proper_time_limits:
-            if use_gae:
-                self.value_preds[-1] = next_value
-                gae = 0
-                for step in reversed(range(self.rewards.size(0))):
-                    delta = (
-                        self.rewards[step]
-                        + gamma * self.value_preds[step + 1] * self.masks[step + 1]
-                        - self.value_preds[step]
-                    )
-                    gae = delta + gamma * gae_lambda * self.masks[step + 1] * gae
-                    gae = gae * self.bad_masks[step + 1]
-                    self.returns[step] = gae + self.value_preds[step]
-            else:
-                self.returns[-1] = next_value
-                for step in reversed(range(self.rewards.size(0))):
-                    self.returns[step] = (
-                        (
-                            self.returns[step + 1] * gamma * self.masks[step + 1]
-                            + self.rewards[step]
-                        )
-                        * self.bad_masks[step + 1]
-                        + (1 - self.bad_masks[step + 1]) * self.value_preds[step]
-                    )
+        """
+        Computes the return of every step of the rollout in place. Returns of the
+        steps before ``self.start`` are set to zero.
+        """
+        if use_gae:
+            self.value_preds[-1] = next_value
         else:
-            if use_gae:
-                self.value_preds[-1] = next_value
-                gae = 0
-                for step in reversed(range(self.rewards.size(0))):
-                    delta = (
-                        self.rewards[step]
-                        + gamma * self.value_preds[step + 1] * self.masks[step + 1]
-                        - self.value_preds[step]
-                    )
-                    gae = delta + gamma * gae_lambda * self.masks[step + 1] * gae
-                    self.returns[step] = gae + self.value_preds[step]
-            else:
-                self.returns[-1] = next_value
-                for step in reversed(range(self.rewards.size(0))):
-                    self.returns[step] = (
-                        self.returns[step + 1] * gamma * self.masks[step + 1]
-                        + self.rewards[step]
-                    )
+            self.returns[-1] = next_value
+        rollouts = self.since_start()
+        rollouts.returns[:-1] = discounted_returns(
+            rollouts.rewards,
+            rollouts.value_preds,
+            rollouts.masks,
+            rollouts.bad_masks,
+            next_value,
+            use_gae,
+            gamma,
+            gae_lambda,
+            use_proper_time_limits,
+        )
+        self.returns[: self.start] = 0.0
 
     def feed_forward_generator(
         self,
@@ -192,6 +660,7 @@ class RolloutStorage:
         )
         for indices in sampler:
             obs_batch = self.obs[:-1].view(-1, *self.obs.size()[2:])[indices]
+            obs_batch = obs_batch.float()
             recurrent_hidden_states_batch = self.recurrent_hidden_states[:-1].view(
                 -1, self.recurrent_hidden_states.size(-1)
             )[indices]
@@ -254,7 +723,7 @@ class RolloutStorage:
             T, N = self.num_steps, num_envs_per_batch
 
             # These are all tensors of size ``(T, N, -1)
-            obs_batch = torch.stack(obs_batch, 1)
+            obs_batch = torch.stack(obs_batch, 1).float()
             actions_batch = torch.stack(actions_batch, 1)
             value_preds_batch = torch.stack(value_preds_batch, 1)
             return_batch = torch.stack(return_batch, 1)
@@ -290,3 +759,152 @@ class RolloutStorage:
             )
 
             yield batch
+
+
+class RolloutStore:
+    """
+    The rollouts of a whole population, in tensors shaped like those of a
+    ``RolloutStorage`` but with one slot per agent in place of the processes, e.g.
+    observations of shape ``(num_steps + 1, capacity) + obs_shape``. Slots are
+    handed out on births as ``RolloutStorage`` views which work with
+    ``Algo.update()``, and recycled on deaths, so that no tensors are allocated
+    per agent. When every slot is taken, the capacity is doubled, and the views
+    are rebound to the new tensors.
+
+    Parameters
+    ----------
+    num_steps : ``int``.
+        The length of each rollout, i.e. the number of env steps between updates.
+    obs_shape : ``Tuple[int]``.
+        Shape of the observation space.
+    action_space : ``gym.Space``.
+        The action space.
+    recurrent_hidden_state_size : ``int``.
+        The dimension of the hidden state for the GRU if the policy is recurrent.
+    obs_dtype : ``torch.dtype``, optional.
+        The dtype in which observations are stored.
+    device : ``torch.device``, optional.
+        The device on which the tensors are allocated.
+    """
+
+    def __init__(
+        self,
+        num_steps: int,
+        obs_shape: Tuple[int, ...],
+        action_space: gym.Space,
+        recurrent_hidden_state_size: int,
+        obs_dtype: torch.dtype = torch.float32,
+        device: torch.device = torch.device("cpu"),
+    ) -> None:
+        self.num_steps = num_steps
+
+        # Tensors with no slots, which are grown as slots are needed.
+        template = RolloutStorage(
+            num_steps,
+            0,
+            obs_shape,
+            action_space,
+            recurrent_hidden_state_size,
+            obs_dtype,
+        )
+        template.to(device)
+        self.obs = template.obs
+        self.recurrent_hidden_states = template.recurrent_hidden_states
+        self.actions = template.actions
+        self.scalars = template.scalars
+
+        # Whether each slot is in use.
+        self.valid = np.zeros(0, dtype=bool)
+
+        # The view of every slot, and the slots not in use. Released slots are
+        # handed out again first.
+        self.views: List[RolloutStorage] = []
+        self.free_slots: List[int] = []
+
+    @property
+    def capacity(self) -> int:
+        """ Returns the number of slots. """
+        return len(self.views)
+
+    def __len__(self) -> int:
+        """ Returns the number of slots in use. """
+        return self.capacity - len(self.free_slots)
+
+    def acquire(self, start: int = 0) -> RolloutStorage:
+        """
+        Hands out a slot, growing the store if every slot is in use.
+
+        Parameters
+        ----------
+        start : ``int``, optional.
+            The index in the rollout of the first step of the agent using the slot,
+            which is where its first observation goes.
+
+        Returns
+        -------
+        rollouts : ``RolloutStorage``.
+            A view of the slot, with its contents reset.
+        """
+        if not self.free_slots:
+            self._grow(max(1, 2 * self.capacity))
+        slot = self.free_slots.pop()
+        self.valid[slot] = True
+        rollouts = self.views[slot]
+        rollouts.reset()
+        rollouts.step = start
+        rollouts.start = start
+        return rollouts
+
+    def adopt(self, rollouts: RolloutStorage) -> RolloutStorage:
+        """ Hands out a slot holding a copy of ``rollouts``, e.g. loaded ones. """
+        view = self.acquire()
+        view.copy_(rollouts)
+        return view
+
+    def release(self, rollouts: RolloutStorage) -> None:
+        """ Recycles the slot of ``rollouts``, which must be a view of this store. """
+        if rollouts.store is not self or rollouts.slot is None:
+            raise ValueError("Rollouts are not a view of this store.")
+        if not self.valid[rollouts.slot]:
+            raise ValueError(f"Slot {rollouts.slot} is not in use.")
+        self.valid[rollouts.slot] = False
+        self.free_slots.append(rollouts.slot)
+
+    def _grow(self, capacity: int) -> None:
+        """ Reallocates the tensors with ``capacity`` slots, and rebinds views. """
+        old_capacity = self.capacity
+        for name in STORE_TENSORS:
+            old = getattr(self, name)
+            slot_dim = 2 if name == "scalars" else 1
+            shape = list(old.shape)
+            shape[slot_dim] = capacity
+            new = torch.zeros(shape, dtype=old.dtype, device=old.device)
+            new.narrow(slot_dim, 0, old_capacity).copy_(old)
+            setattr(self, name, new)
+        self.valid = np.concatenate(
+            (self.valid, np.zeros(capacity - old_capacity, dtype=bool))
+        )
+
+        for slot in range(old_capacity, capacity):
+            rollouts = RolloutStorage.__new__(RolloutStorage)
+            rollouts.num_steps = self.num_steps
+            rollouts.step = 0
+            rollouts.start = 0
+            rollouts.store = self
+            rollouts.slot = slot
+            self.views.append(rollouts)
+        for rollouts in self.views:
+            self._bind(rollouts)
+        self.free_slots = list(range(capacity - 1, old_capacity - 1, -1))
+
+    def _bind(self, rollouts: RolloutStorage) -> None:
+        """ Points the tensors of the view ``rollouts`` at its slot. """
+        slot = rollouts.slot
+        assert slot is not None
+        rollouts.obs = self.obs[:, slot : slot + 1]
+        rollouts.recurrent_hidden_states = self.recurrent_hidden_states[
+            :, slot : slot + 1
+        ]
+        rollouts.actions = self.actions[:, slot : slot + 1]
+        rollouts.scalars = self.scalars[:, :, slot : slot + 1]
+        rollouts._bind_scalars()  # pylint: disable=protected-access
@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*-
 import os
 import glob
-from typing import Any, Callable
+from typing import Any, Callable, Dict, List
 
 import torch
 import torch.nn as nn
@@ -58,3 +58,33 @@ def cleanup_log_dir(log_dir: str) -> None:
         files = glob.glob(os.path.join(log_dir, "*.monitor.csv"))
         for f in files:
             os.remove(f)
+
+
+def parameter_views(module: nn.Module, flat: torch.Tensor) -> List[torch.Tensor]:
+    """
+    Views of consecutive slices of the 1D tensor ``flat``, shaped like the
+    parameters of ``module``, so that parameters can be copied in and out of it
+    without intermediate tensors.
+    """
+    params = list(module.parameters())
+    chunks = flat.split([param.numel() for param in params])
+    return [chunk.view_as(param) for param, chunk in zip(params, chunks)]
+
+
+def reset_optimizer(
+    optimizer: torch.optim.Optimizer, param_groups: List[Dict[str, Any]]
+) -> None:
+    """
+    Returns ``optimizer`` to the state of a freshly constructed optimizer without
+    reallocating its state. Running averages and step counts are zeroed in place,
+    which gives the same updates as empty state, and the hyperparameters of each
+    param group are restored from ``param_groups``.
+    """
+    for group, initial_group in zip(optimizer.param_groups, param_groups):
+        group.update(initial_group)
+    for state in optimizer.state.values():
+        for key, value in state.items():
+            if isinstance(value, torch.Tensor):
+                value.zero_()
+            else:
+                state[key] = 0
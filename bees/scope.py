@@ -5,30 +5,29 @@ import os
 import json
 import glob
 import random
-import pickle
 import argparse
-import functools
 from pprint import pprint
+from typing import Dict, List, Tuple, Sequence, Any
 
 import numpy as np
 
-from bees.agent import Agent
+from bees.agent import get_reward_shapes
+from bees.config import Config
+from bees.population import Population
+from bees.checkpoint import CHECKPOINT_SUFFIX, load_state
 
-# pylint: disable=too-many-nested-blocks
+# pylint: disable=too-many-arguments, too-many-locals
 
 
 # HARDCODE
 EAT_PROB = 0.1
 OBS_DENSITY = 0.3
 REWARD_SAMPLE_SIZE = 3200
+QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+AGENT_OBJ_TYPE_ID = 0
 
-
-def one_hot(n: int, k: int) -> np.ndarray:
-    """ Get one-hot vector of length n with k-th bit set as numpy array. """
-
-    vec = np.zeros((n,))
-    vec[k] = 1
-    return vec
+# Bound on the number of first-layer activations computed in one batched pass.
+MAX_BATCH_ELEMENTS = 2 ** 24
 
 
 def search_model_dir(model_dir: str, template: str) -> str:
@@ -46,87 +45,202 @@ def search_model_dir(model_dir: str, template: str) -> str:
     return results[0]
 
 
-def scope(args: argparse.Namespace) -> None:
+def sample_observations(
+    num_samples: int, obs_shape: Tuple[int, int, int], rng: np.random.Generator
+) -> np.ndarray:
+    """
+    Samples random observations in one shot. Each square other than the center
+    holds an object of a uniformly random type with probability ``OBS_DENSITY``,
+    and the center holds the observing agent.
+
+    Parameters
+    ----------
+    num_samples : ``int``.
+        Number of observations to sample.
+    obs_shape : ``Tuple[int, int, int]``.
+        Shape ``(num_obj_types, obs_width, obs_width)`` of an observation.
+    rng : ``np.random.Generator``.
+        Source of randomness.
+
+    Returns
+    -------
+    observations : ``np.ndarray``.
+        One-hot observations.
+        Shape: ``(num_samples,) + obs_shape``.
+    """
+    num_obj_types, obs_width, _ = obs_shape
+    sight_len = obs_width // 2
+    occupied = rng.random((num_samples, obs_width, obs_width)) < OBS_DENSITY
+    obj_types = rng.integers(num_obj_types, size=(num_samples, obs_width, obs_width))
+    occupied[:, sight_len, sight_len] = True
+    obj_types[:, sight_len, sight_len] = AGENT_OBJ_TYPE_ID
+
+    # Shape: ``(num_samples, obs_width, obs_width, num_obj_types)``.
+    one_hots = np.eye(num_obj_types)[obj_types] * occupied[..., np.newaxis]
+    observations: np.ndarray = one_hots.transpose(0, 3, 1, 2)
+    return observations
+
+
+def load_population(
+    env_state: Dict[str, Any], config: Config, agent_ids: List[int]
+) -> Tuple[Population, int]:
+    """
+    Builds a population table holding the reward networks of ``agent_ids``.
+
+    Parameters
+    ----------
+    env_state : ``Dict[str, Any]``.
+        Environment state, as saved by ``Env.save()``.
+    config : ``Config``.
+        Settings of the run which saved ``env_state``.
+    agent_ids : ``List[int]``.
+        Agents whose reward networks are added to the table.
+
+    Returns
+    -------
+    population : ``Population``.
+        Table with one row for each agent in ``agent_ids``.
+    num_actions : ``int``.
+        Size of the action space.
+    """
+    num_actions = env_state["action_space"].n
+    obs_width = 2 * config.sight_len + 1
+    obs_shape = (config.num_obj_types, obs_width, obs_width)
+    reward_shapes = get_reward_shapes(config, num_actions)
+    population = Population(obs_shape, len(agent_ids), reward_shapes)
+    for agent_id in agent_ids:
+        row = population.add(agent_id)
+        agent_state = env_state["agents"][agent_id]
+        columns = population.weight_columns + population.bias_columns
+        params = list(agent_state["reward_weights"]) + list(
+            agent_state["reward_biases"]
+        )
+        for column, param in zip(columns, params):
+            getattr(population, column)[row] = param
+    return population, num_actions
+
+
+def probe(
+    population: Population,
+    rows: np.ndarray,
+    config: Config,
+    num_actions: int,
+    num_samples: int,
+    quantiles: Sequence[float],
+    rng: np.random.Generator,
+) -> Dict[str, np.ndarray]:
+    """
+    Computes the distribution of rewards of each agent for each fixed action as
+    observation and health vary, from one set of random probes shared by all agents.
+    The reward networks of as many agents as fit in ``MAX_BATCH_ELEMENTS`` are
+    evaluated in each batched pass.
+
+    Parameters
+    ----------
+    population : ``Population``.
+        Table holding the reward networks.
+    rows : ``np.ndarray``.
+        Rows of the agents to probe.
+    config : ``Config``.
+        Settings including ``reward_inputs`` and ``hidden_dim``.
+    num_actions : ``int``.
+        Size of the action space.
+    num_samples : ``int``.
+        Number of random observations and healths.
+    quantiles : ``Sequence[float]``.
+        Quantiles of the reward distributions to compute.
+    rng : ``np.random.Generator``.
+        Source of randomness.
+
+    Returns
+    -------
+    stats : ``Dict[str, np.ndarray]``.
+        ``mean`` and ``std`` of shape ``(len(rows), num_actions)``, and
+        ``quantiles`` of shape ``(len(quantiles), len(rows), num_actions)``.
+    """
+    # If observations and health aren't inputs to the reward network, there is
+    # no need to sample, so take a single sample.
+    if set(config.reward_inputs) <= {"actions"}:
+        num_samples = 1
+    observations = sample_observations(num_samples, population.obs_shape, rng)
+    healths = rng.random(num_samples)
+
+    # As in an agent's first step, the previous health is the initial health.
+    prev_healths = np.ones(num_samples)
+
+    elements = num_samples * num_actions * max(config.hidden_dim, 1)
+    batch_size = max(1, MAX_BATCH_ELEMENTS // elements)
+    means, stds, qs = [], [], []
+    for start in range(0, len(rows), batch_size):
+        rewards = population.compute_probe_rewards(
+            rows[start : start + batch_size],
+            observations,
+            healths,
+            prev_healths,
+            config.reward_inputs,
+            num_actions,
+        )
+        means.append(rewards.mean(axis=1))
+        stds.append(rewards.std(axis=1))
+        qs.append(np.quantile(rewards, quantiles, axis=1))
+
+    return {
+        "mean": np.concatenate(means),
+        "std": np.concatenate(stds),
+        "quantiles": np.concatenate(qs, axis=1),
+    }
+
+
+def scope(args: argparse.Namespace) -> Dict[int, Dict[int, Dict[str, float]]]:
     """ Analyze agent reward networks and associated action distributions. """
 
-    # Read in env.pkl.
-    env_path = search_model_dir(args.model_dir, "*_env.pkl")
-    with open(env_path, "rb") as env_file:
-        env = pickle.load(env_file)
+    # Read in env state, falling back to pickles saved by older versions.
+    template = "*_env" + CHECKPOINT_SUFFIX
+    if not glob.glob(os.path.join(args.model_dir, template)):
+        template = "*_env.pkl"
+    env_path = search_model_dir(args.model_dir, template)
+    env_state = load_state(env_path)
 
-    # Select agent to analyze.
-    if args.agent != -1:
-        agent_id = args.agent
+    # Select agents to analyze.
+    if args.all:
+        agent_ids = sorted(env_state["agents"])
+    elif args.agents:
+        agent_ids = list(args.agents)
+        missing = set(agent_ids) - set(env_state["agents"])
+        if missing:
+            raise ValueError("Agents %s not in %s." % (sorted(missing), env_path))
     else:
-        agent_id = random.choice(list(env["agents"].keys()))
+        agent_ids = [random.choice(list(env_state["agents"].keys()))]
 
-    # Construct agent parameters from settings file and environment.
+    # Construct reward networks from settings file and environment.
     settings_path = search_model_dir(args.model_dir, "*_settings.json")
     with open(settings_path, "r") as settings_file:
         settings = json.load(settings_file)
-    action_space = env["action_space"]
-    subaction_sizes = [action_space[i].n for i in range(len(action_space))]
-    agent_args = {}
-    agent_args["sight_len"] = settings["env"]["sight_len"]
-    agent_args["num_obj_types"] = settings["env"]["num_obj_types"]
-    agent_args["consts"] = settings["constants"]
-    agent_args["n_layers"] = settings["rew"]["n_layers"]
-    agent_args["hidden_dim"] = settings["rew"]["hidden_dim"]
-    agent_args["num_actions"] = sum(subaction_sizes)
-    agent_args["reward_inputs"] = settings["rew"]["reward_inputs"]
-    agent_args["reward_weights"] = env["agents"][agent_id]["reward_weights"]
-    agent_args["reward_biases"] = env["agents"][agent_id]["reward_biases"]
-    agent = Agent(**agent_args)
-
-    # Get settings for sampling health and observation distributions.
-    sight_len = settings["env"]["sight_len"]
-    num_obj_types = settings["env"]["num_obj_types"]
-
-    # Compute the distribution of rewards for each fixed action as observation and
-    # health vary.
-    distributions = {}
-
-    num_actions = functools.reduce(lambda a, b: a * b, subaction_sizes)
-    for action in range(num_actions):
-        rewards = []
-
-        # HARDCODE
-        # Since the observation and health spaces are large, we randomly sample from
-        # them instead of iterating over them. If these values aren't inputs to the
-        # reward network, there is no need to sample, so take sample_size = 1.
-        sample_size = (
-            1 if settings["rew"]["reward_inputs"] == ["actions"] else REWARD_SAMPLE_SIZE
-        )
-        for _ in range(sample_size):
-
-            # Sample and set health.
-            health = random.random()
-            agent.health = health
-
-            # Sample and set observation.
-            obs_length = 2 * sight_len + 1
-            observation = np.zeros((num_obj_types, obs_length, obs_length))
-            for x in range(obs_length):
-                for y in range(obs_length):
-
-                    # x == sight_len == y iff (x, y) is in center of agent's
-                    # field of vision, AKA the agent's position.
-                    if random.random() < OBS_DENSITY or (x == sight_len == y):
-                        if x == sight_len == y:
-                            object_type = env.obj_type_ids["agent"]
-                        else:
-                            object_type = random.choice(list(range(num_obj_types)))
-                        observation[:, x, y] = one_hot(num_obj_types, object_type)
-            agent.observation = observation
-
-            # Compute reward.
-            rewards.append(agent.compute_reward(action))
-
-        mean = np.mean(rewards)
-        std = np.std(rewards)
-        distributions[action] = {"mean": mean, "std": std}
+    config = Config(settings)
+    population, num_actions = load_population(env_state, config, agent_ids)
+
+    # Compute the distribution of rewards for each agent and fixed action as
+    # observation and health vary.
+    rng = np.random.default_rng(args.seed)
+    rows = population.rows(agent_ids)
+    stats = probe(
+        population, rows, config, num_actions, args.samples, args.quantiles, rng
+    )
+
+    distributions: Dict[int, Dict[int, Dict[str, float]]] = {}
+    for i, agent_id in enumerate(agent_ids):
+        distributions[agent_id] = {}
+        for action in range(num_actions):
+            distribution = {
+                "mean": float(stats["mean"][i, action]),
+                "std": float(stats["std"][i, action]),
+            }
+            for j, quantile in enumerate(args.quantiles):
+                distribution["q%g" % quantile] = float(stats["quantiles"][j, i, action])
+            distributions[agent_id][action] = distribution
 
     pprint(distributions)
+    return distributions
 
 
 def main() -> None:
@@ -136,12 +250,29 @@ def main() -> None:
         "model_dir", type=str, help="Directory containing environment state and logs."
     )
     parser.add_argument(
-        "--agent",
+        "--agents",
         type=int,
-        default=-1,
-        help="Agent id whose reward "
-        "network to analyze. If none is provided, agent is chosen randomly.",
+        nargs="+",
+        help="Agent ids whose reward "
+        "networks to analyze. If none are provided, an agent is chosen randomly.",
+    )
+    parser.add_argument(
+        "--all", action="store_true", help="Analyze every agent in the population."
+    )
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=REWARD_SAMPLE_SIZE,
+        help="Number of random observations and healths.",
+    )
+    parser.add_argument(
+        "--quantiles",
+        type=float,
+        nargs="+",
+        default=QUANTILES,
+        help="Quantiles of the reward distributions to report.",
     )
+    parser.add_argument("--seed", type=int, help="Seed for sampling.")
     args = parser.parse_args()
 
     scope(args)
@@ -1,37 +1,113 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """ Run to animate an environment log. """
-from typing import List
-import argparse
+import os
+import sys
 import time
+import argparse
+from typing import Union, Optional
 
+from bees.logreader import VisualLogReader
+from bees.statelog import StateLogReader
 
-def main(args: argparse.Namespace) -> None:
-    """ Plays a log file of environment states as an animation. """
+HELP = (
+    "Commands: <enter> or 'n' next frame, 'p' previous frame, 'g <iteration>' go to "
+    "iteration, 'r' play from here, 'q' quit."
+)
 
-    # Read in log file
-    with open(args.log_path, "r") as f:
-        log_lines = f.readlines()
-
-    # Parse log file into separate timesteps
-    timesteps = []
-    timestep: List[str] = []
-    for line in log_lines:
-        if line == ",":
-            timesteps.append(list(timestep))
-            timestep = []
+
+class Player:
+    """
+    Replays frames of a visual log, or frames rendered from a binary state log,
+    reading each frame from disk only when it is shown.
+
+    Parameters
+    ----------
+    log_path : ``str``.
+        Path to a visual log, or to the directory of a binary state log.
+    fps : ``float``, optional.
+        Frames shown per second while playing.
+    """
+
+    def __init__(self, log_path: str, fps: float = 1.0) -> None:
+        self.reader: Union[VisualLogReader, StateLogReader]
+        if os.path.isdir(log_path):
+            self.reader = StateLogReader(log_path)
         else:
-            timestep.append(line)
+            self.reader = VisualLogReader(log_path)
+        if len(self.reader) == 0:
+            raise ValueError(f"No frames in log '{log_path}'.")
+        self.fps = fps
+        self.index = 0
+
+    def show(self) -> None:
+        """ Clears the terminal and prints the current frame. """
+        print(chr(27) + "[2J")
+        print(self.reader.frame(self.index))
 
-    # Output each timestep
-    for timestep in timesteps:
-        for line in timestep:
-            print(line)
-        time.sleep(1)
+    def seek(self, iteration: int) -> None:
+        """ Moves to the last frame at or before ``iteration``. """
+        self.index = self.reader.seek(iteration)
+
+    def step(self, num_frames: int) -> None:
+        """ Moves ``num_frames`` frames forwards, or backwards if negative. """
+        self.index = min(max(self.index + num_frames, 0), len(self.reader) - 1)
+
+    def play(self, stop: Optional[int] = None) -> None:
+        """ Shows frames at ``self.fps`` until the last frame before ``stop``. """
+        end = len(self.reader) if stop is None else self.reader.seek(stop - 1) + 1
+        delay = 1.0 / self.fps if self.fps > 0 else 0.0
+        while self.index < end:
+            start_time = time.time()
+            self.show()
+            if self.index == end - 1:
+                break
+            self.index += 1
+            time.sleep(max(0.0, delay - (time.time() - start_time)))
+
+    def interact(self) -> None:
+        """ Reads commands from stdin to step, seek and play through the log. """
+        print(HELP)
+        self.show()
+        for line in sys.stdin:
+            command = line.split()
+            if not command or command[0] == "n":
+                self.step(1)
+            elif command[0] == "p":
+                self.step(-1)
+            elif command[0] == "g" and len(command) == 2 and command[1].isdigit():
+                self.seek(int(command[1]))
+            elif command[0] == "r":
+                self.play()
+            elif command[0] == "q":
+                return
+            else:
+                print(HELP)
+                continue
+            self.show()
+
+
+def main(args: argparse.Namespace) -> None:
+    """ Plays a log file of environment states as an animation. """
+    player = Player(args.log_path, args.fps)
+    if args.start is not None:
+        player.seek(args.start)
+    if args.interactive:
+        player.interact()
+    else:
+        player.play(args.stop)
 
 
 if __name__ == "__main__":
     PARSER = argparse.ArgumentParser()
-    PARSER.add_argument("log_path", type=str, help="Path of log to play.")
+    PARSER.add_argument(
+        "log_path", type=str, help="Path of visual log or state log directory to play."
+    )
+    PARSER.add_argument("--fps", type=float, default=1.0, help="Frames per second.")
+    PARSER.add_argument("--start", type=int, help="Iteration to start playing from.")
+    PARSER.add_argument("--stop", type=int, help="Iteration at which to stop.")
+    PARSER.add_argument(
+        "--interactive", action="store_true", help="Step through frames from stdin."
+    )
     ARGS = PARSER.parse_args()
     main(ARGS)
@@ -2,133 +2,113 @@
 # -*- coding: utf-8 -*-
 """ Plot data from environment log. """
 import os
-import time
 import argparse
-from typing import List, Dict, Any, TextIO
+from typing import Dict, Sequence, Optional
 
+import numpy as np
 import pandas as pd
 
 from plotplotplot.draw import graph
 
+from bees.logreader import EnvLogReader
+from bees.statelog import StateLogReader
 
-EMA_ALPHA = 0.999
-
-
-def parse_agent_data(steps: List[Dict[str, Any]]) -> Dict[int, Dict[str, List[Any]]]:
-    """ Parse log data to be indexed by agent instead of by step. """
-
-    agent_data: Dict[int, Dict[str, List[Any]]] = {}
-    for step in steps:
-        agents: Dict[int, Dict[str, Any]] = step["agents"]
-
-        # For each agent alive at this timestep.
-        for agent_id, agent_info in agents.items():
-
-            # Create container if one does not exist in ``agent_data``.
-            if agent_id not in agent_data:
-                agent_info_list = {
-                    field: [value] for field, value in agent_info.items()
-                }
-                agent_data[agent_id] = agent_info_list
-
-            # Otherwise, append to the list for each field.
-            else:
-                for field in agent_data[agent_id]:
-                    value_list = agent_data[agent_id][field]
-                    if field in agent_info:
-                        value_list.append(agent_info[field])
-                        agent_data[agent_id][field] = value_list
-
-    return agent_data
-
-
-def get_EMA(seq: List[float]) -> List[float]:
-    """ Computes and returns the EMA of a list of floats. """
-
-    ema = []
-    current_avg = 0.0
-    for i, element in enumerate(seq):
-        if i == 0:
-            current_avg = element
-        else:
-            current_avg = EMA_ALPHA * current_avg + (1.0 - EMA_ALPHA) * element
-
-        ema.append(current_avg)
-
-    return ema
 
+EMA_ALPHA = 0.999
 
-def get_rewards(agent_data: Dict[int, Dict[str, List[Any]]]) -> pd.DataFrame:
-    """ Parses ``agent_data`` into a DataFrame with rewards for each agent. """
 
-    # Map ``agent_id`` to lists of last rewards.
-    reward_key = "last_reward"
-    reward_log_map: Dict[int, List[float]] = {}
-    max_length = 0
-    for agent_id, value_list_dict in agent_data.items():
-        max_length = max(max_length, len(value_list_dict[reward_key]))
-        reward_log_map[agent_id] = value_list_dict[reward_key]
+def read_agent_columns(
+    log_path: str,
+    start: Optional[int] = None,
+    stop: Optional[int] = None,
+    agent_ids: Optional[Sequence[int]] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Reads the ``agent_id``, ``last_reward`` and ``num_children`` of every agent in
+    every step in ``[start, stop)`` as flat columns in log order. ``log_path`` is
+    either a text env log, which is read through its index, or the directory of a
+    binary state log.
+    """
+    if os.path.isdir(log_path):
+        columns = StateLogReader(log_path).read(start, stop)
+        if agent_ids is not None:
+            keep = np.isin(columns["agent_id"], agent_ids)
+            columns = {column: values[keep] for column, values in columns.items()}
+        return columns
+
+    reader = EnvLogReader(log_path)
+    agent_id_list = []
+    rewards = []
+    num_children = []
+    for _, agents in reader.records(start, stop, agent_ids):
+        for agent_id, fields in agents.items():
+            agent_id_list.append(agent_id)
+            rewards.append(fields["last_reward"])
+            num_children.append(fields["num_children"])
+    return {
+        "agent_id": np.asarray(agent_id_list, dtype=np.int64),
+        "last_reward": np.asarray(rewards, dtype=np.float64),
+        "num_children": np.asarray(num_children, dtype=np.int64),
+    }
 
-    # Replace ``reward_log_map[agent_id]`` with EMA of itself.
-    for agent_id in agent_data:
-        reward_log_map[agent_id] = get_EMA(reward_log_map[agent_id])
 
-    # Add padding to each list so they all have length ``max_length``.
-    for agent_id in reward_log_map:
-        reward_log = reward_log_map[agent_id]
-        if len(reward_log) < max_length:
-            reward_log.extend([float("nan")] * (max_length - len(reward_log)))
-            reward_log_map[agent_id] = reward_log
+def get_rewards(agent_ids: np.ndarray, rewards: np.ndarray) -> pd.DataFrame:
+    """
+    Builds a DataFrame with a column of reward EMAs for each agent, indexed by the
+    number of steps since the agent's first record, and ``nan`` after its last.
+
+    Parameters
+    ----------
+    agent_ids : ``np.ndarray``.
+        The agent of each record, in log order.
+    rewards : ``np.ndarray``.
+        The last reward of each record.
+
+    Returns
+    -------
+    reward_df : ``pd.DataFrame``.
+        Reward EMAs, with one column per agent.
+    """
+    order = np.argsort(agent_ids, kind="stable")
+    columns, starts, counts = np.unique(
+        agent_ids[order], return_index=True, return_counts=True
+    )
+    steps = np.arange(len(order)) - np.repeat(starts, counts)
+    table = np.full((counts.max(initial=0), len(columns)), np.nan)
+    table[steps, np.repeat(np.arange(len(columns)), counts)] = rewards[order]
 
-    reward_df = pd.DataFrame.from_dict(reward_log_map)
-    return reward_df
+    reward_df = pd.DataFrame(table, columns=columns)
+    reward_df = reward_df.ewm(alpha=1.0 - EMA_ALPHA, adjust=False).mean()
+    return reward_df.where(~np.isnan(table))
 
 
-def get_child_count_map(agent_data: Dict[int, Dict[str, List[Any]]]) -> Dict[int, int]:
+def get_child_count_map(
+    agent_ids: np.ndarray, num_children: np.ndarray
+) -> Dict[int, int]:
     """ Gets histogram-like data for number of children per agent. """
 
-    children_per_agent = {
-        agent_id: agent_data[agent_id]["num_children"][-1]
-        for agent_id in agent_data.keys()
-    }
-    children_values = list(set(children_per_agent.values()))
-    num_children = {}
-    for children_value in children_values:
-        num_children[children_value] = len(
-            [
-                agent_id
-                for agent_id in children_per_agent
-                if children_per_agent[agent_id] == children_value
-            ]
-        )
-
-    return num_children
+    # The last record of each agent holds its final number of children.
+    reversed_ids = agent_ids[::-1]
+    _, last = np.unique(reversed_ids, return_index=True)
+    final_counts = num_children[::-1][last]
+    values, frequencies = np.unique(final_counts, return_counts=True)
+    return {int(value): int(freq) for value, freq in zip(values, frequencies)}
 
 
-# pylint: disable=too-many-locals
 def main(args: argparse.Namespace) -> None:
     """ Plot rewards from a log. """
 
-    def readlines(log_file: TextIO) -> List[Dict[str, Any]]:
-        """ Construct steps. """
-        steps: List[Dict[str, Any]] = []
-        for line in log_file:
-            stripped: Dict[str, Any] = eval(line.strip())
-            steps.append(stripped)
-        return steps
-
-    with open(args.log_path, "r") as log_file:
-        steps = readlines(log_file)
-
     # Read and parse log.
-    agent_data = parse_agent_data(steps)
+    columns = read_agent_columns(args.log_path, args.start, args.stop, args.agents)
 
     # Get individual metrics from parsed data.
-    reward_df = get_rewards(agent_data)
-    # child_count_map = get_child_count_map(agent_data)
+    reward_df = get_rewards(columns["agent_id"], columns["last_reward"])
+    # child_count_map = get_child_count_map(
+    #     columns["agent_id"], columns["num_children"]
+    # )
 
     # Plot or write out individual metrics.
-    save_dir = os.path.dirname(args.log_path)
+    save_dir = os.path.dirname(os.path.abspath(args.log_path))
     plot_path = os.path.join(save_dir, "reward_log.svg")
     graph(
         dfs=[reward_df],
@@ -147,7 +127,17 @@ def main(args: argparse.Namespace) -> None:
 
 if __name__ == "__main__":
     PARSER = argparse.ArgumentParser()
-    PARSER.add_argument("--log-path", required=True, type=str, help="Path to log.")
+    PARSER.add_argument(
+        "--log-path",
+        required=True,
+        type=str,
+        help="Path to a text env log or a binary state log directory.",
+    )
     PARSER.add_argument("--settings-path", required=True, type=str)
+    PARSER.add_argument("--start", type=int, help="First iteration to plot.")
+    PARSER.add_argument("--stop", type=int, help="Iteration at which to stop.")
+    PARSER.add_argument(
+        "--agents", type=int, nargs="+", help="Ids of the agents to plot."
+    )
     ARGS = PARSER.parse_args()
     main(ARGS)
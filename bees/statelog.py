@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Columnar, binary log of environment state written from a background thread. """
+import os
+import glob
+import queue
+import threading
+from typing import Dict, List, Tuple, Iterator, Any, Optional
+
+import numpy as np
+
+from bees.visual import render_frame
+from bees.logreader import last_positions
+
+# Per-step columns, with one entry for each recorded step.
+STEP_COLUMNS: Dict[str, Any] = {
+    "iteration": np.int64,
+    "num_foods": np.int64,
+    "avg_agent_lifetime": np.float64,
+    "policy_score": np.float64,
+    "total_loss": np.float64,
+    "food_score": np.float64,
+}
+
+# Per-agent columns, with one entry for each agent alive at each recorded step.
+AGENT_COLUMNS: Dict[str, Any] = {
+    "agent_id": np.int64,
+    "pos_x": np.int64,
+    "pos_y": np.int64,
+    "health": np.float64,
+    "initial_health": np.float64,
+    "last_reward": np.float64,
+    "age": np.int64,
+    "num_children": np.int64,
+}
+
+# Chunk files are named by their index, so that they sort in order of writing.
+CHUNK_FORMAT = "chunk_%08d.npz"
+
+# pylint: disable=too-many-instance-attributes
+
+
+class StateLogWriter:
+    """
+    Appends the state of the environment to a directory of ``.npz`` chunks. Each
+    recorded step copies a few columns of the population table into a buffer, and
+    every ``chunk_size`` recorded steps the buffer is concatenated and written by a
+    background thread, so the step loop never formats or writes anything.
+
+    A chunk holds the per-step columns in ``STEP_COLUMNS``, the per-agent columns in
+    ``AGENT_COLUMNS`` for all recorded steps back to back, and ``offsets``, where the
+    agents of the ``i``-th step of the chunk are rows ``offsets[i]:offsets[i + 1]``.
+    The food channel of the grid is stored as one row of packed bits per step in
+    ``food``, along with ``grid_shape``, so that frames can be rendered on replay.
+
+    Parameters
+    ----------
+    log_dir : ``str``.
+        Directory holding the chunks. Chunks already in it are kept, and new chunks
+        are numbered after them.
+    interval : ``int``, optional.
+        Only iterations which are multiples of ``interval`` are recorded.
+    chunk_size : ``int``, optional.
+        Number of recorded steps per chunk.
+    """
+
+    def __init__(self, log_dir: str, interval: int = 1, chunk_size: int = 256) -> None:
+        if interval < 1:
+            raise ValueError("State log interval must be positive.")
+        if chunk_size < 1:
+            raise ValueError("State log chunk size must be positive.")
+        self.log_dir = log_dir
+        self.interval = interval
+        self.chunk_size = chunk_size
+        os.makedirs(log_dir, exist_ok=True)
+        self.num_chunks = len(chunk_paths(log_dir))
+
+        self.steps: Dict[str, List[Any]] = {column: [] for column in STEP_COLUMNS}
+        self.agents: Dict[str, List[np.ndarray]] = {
+            column: [] for column in AGENT_COLUMNS
+        }
+        self.counts: List[int] = []
+        self.food: List[np.ndarray] = []
+        self.grid_shape = np.zeros(2, dtype=np.int64)
+
+        # Buffered chunks waiting to be written, and ``None`` to stop the thread.
+        self.queue: "queue.Queue[Optional[Dict[str, np.ndarray]]]" = queue.Queue(
+            maxsize=4
+        )
+        self.error: Optional[BaseException] = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def record(self, env: Any, metrics: Optional[Any] = None) -> None:
+        """
+        Buffers the state of ``env`` if its iteration is due to be recorded.
+
+        Parameters
+        ----------
+        env : ``Env``.
+            The environment, whose agents are read from its population table.
+        metrics : ``Optional[Metrics]``, optional.
+            Training metrics, recorded as ``nan`` if not given.
+        """
+        if env.iteration % self.interval != 0:
+            return
+        self._raise()
+
+        population = env.population
+        rows = population.rows(env.agents)
+        self.agents["agent_id"].append(population.row_ids[rows])
+        self.agents["pos_x"].append(population.pos_x[rows])
+        self.agents["pos_y"].append(population.pos_y[rows])
+        self.agents["health"].append(population.health[rows])
+        self.agents["last_reward"].append(population.last_reward[rows])
+        self.agents["age"].append(population.age[rows])
+        self.agents["num_children"].append(population.num_children[rows])
+        self.agents["initial_health"].append(
+            np.fromiter(
+                (agent.initial_health for agent in env.agents.values()),
+                dtype=np.float64,
+                count=len(rows),
+            )
+        )
+        self.counts.append(len(rows))
+
+        food_mask = env.grid[:, :, env.obj_type_ids["food"]] == 1
+        self.food.append(np.packbits(food_mask))
+        self.grid_shape = np.array(food_mask.shape, dtype=np.int64)
+
+        self.steps["iteration"].append(env.iteration)
+        self.steps["num_foods"].append(env.num_foods)
+        self.steps["avg_agent_lifetime"].append(env.avg_agent_lifetime)
+        for column in ("policy_score", "total_loss", "food_score"):
+            value = float("nan") if metrics is None else getattr(metrics, column)
+            self.steps[column].append(value)
+
+        if len(self.counts) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """ Queues the buffered steps to be written as a chunk. """
+        if not self.counts:
+            return
+        chunk: Dict[str, np.ndarray] = {}
+        for column, dtype in STEP_COLUMNS.items():
+            chunk[column] = np.asarray(self.steps[column], dtype=dtype)
+            self.steps[column] = []
+        for column, dtype in AGENT_COLUMNS.items():
+            chunk[column] = np.concatenate(self.agents[column]).astype(dtype)
+            self.agents[column] = []
+        chunk["offsets"] = np.concatenate(([0], np.cumsum(self.counts)))
+        chunk["food"] = np.stack(self.food)
+        chunk["grid_shape"] = self.grid_shape
+        self.counts = []
+        self.food = []
+        self.queue.put(chunk)
+
+    def close(self) -> None:
+        """ Writes the buffered steps and stops the thread. """
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+        self._raise()
+
+    def _raise(self) -> None:
+        """ Raises any error from the background thread in the caller. """
+        if self.error is not None:
+            raise RuntimeError("Writing state log failed.") from self.error
+
+    def _run(self) -> None:
+        """ Writes queued chunks until ``close()`` is called. """
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                return
+            try:
+                if self.error is None:
+                    path = os.path.join(self.log_dir, CHUNK_FORMAT % self.num_chunks)
+                    tmp_path = path + ".tmp"
+                    with open(tmp_path, "wb") as chunk_file:
+                        np.savez(chunk_file, **chunk)
+                    os.replace(tmp_path, path)
+                    self.num_chunks += 1
+            except BaseException as err:  # pylint: disable=broad-except
+                self.error = err
+
+
+class StateLogReader:
+    """
+    Reads a log written by ``StateLogWriter``. Chunks are opened lazily, and chunks
+    outside of a requested iteration range are skipped after reading only their
+    ``iteration`` column. Single frames are read through an index of the chunk and
+    position of every recorded step, built from the ``iteration`` columns.
+
+    Parameters
+    ----------
+    log_dir : ``str``.
+        Directory holding the chunks.
+    """
+
+    def __init__(self, log_dir: str) -> None:
+        self.log_dir = log_dir
+
+        # Chunk, position within the chunk, and iteration of every recorded step.
+        self.paths: List[str] = []
+        self.chunk_ids = np.zeros(0, dtype=np.int64)
+        self.chunk_steps = np.zeros(0, dtype=np.int64)
+        self.iterations = np.zeros(0, dtype=np.int64)
+        self.positions: Optional[np.ndarray] = None
+        self.cached: Tuple[int, Dict[str, np.ndarray]] = (-1, {})
+
+    def __len__(self) -> int:
+        """ Returns the number of recorded steps, indexing the chunks if needed. """
+        self._update_index()
+        return len(self.iterations)
+
+    def _update_index(self) -> None:
+        """ Indexes the steps of chunks written since the last call. """
+        paths = chunk_paths(self.log_dir)
+        if len(paths) == len(self.paths):
+            return
+        chunk_ids = [self.chunk_ids]
+        chunk_steps = [self.chunk_steps]
+        iterations = [self.iterations]
+        for chunk_id in range(len(self.paths), len(paths)):
+            with np.load(paths[chunk_id]) as npz:
+                chunk_iterations = npz["iteration"]
+            chunk_ids.append(np.full(len(chunk_iterations), chunk_id))
+            chunk_steps.append(np.arange(len(chunk_iterations)))
+            iterations.append(chunk_iterations)
+        self.paths = paths
+        self.chunk_ids = np.concatenate(chunk_ids)
+        self.chunk_steps = np.concatenate(chunk_steps)
+        self.iterations = np.concatenate(iterations)
+        self.positions = None
+
+    def seek(self, iteration: int) -> int:
+        """
+        Returns the index of the last step recorded at or before ``iteration`` in
+        constant time, or ``0`` if ``iteration`` precedes all steps.
+        """
+        self._update_index()
+        if self.positions is None:
+            self.positions = last_positions(self.iterations)
+        iteration = min(max(iteration, 0), len(self.positions) - 1)
+        return max(int(self.positions[iteration]), 0)
+
+    def frame(self, index: int) -> str:
+        """ Returns the visual log frame of the ``index``-th recorded step. """
+        self._update_index()
+        chunk_id = int(self.chunk_ids[index])
+        if self.cached[0] != chunk_id:
+            with np.load(self.paths[chunk_id]) as npz:
+                self.cached = (chunk_id, {column: npz[column] for column in npz.files})
+        return _render_step(_get_step(self.cached[1], int(self.chunk_steps[index])))
+
+    def chunks(
+        self, start: Optional[int] = None, stop: Optional[int] = None
+    ) -> Iterator[Dict[str, np.ndarray]]:
+        """
+        Yields the columns of each chunk with a recorded iteration in the half-open
+        range ``[start, stop)``, with all steps outside the range dropped.
+        """
+        for path in chunk_paths(self.log_dir):
+            with np.load(path) as npz:
+                iterations = npz["iteration"]
+                keep = np.ones(len(iterations), dtype=bool)
+                if start is not None:
+                    keep &= iterations >= start
+                if stop is not None:
+                    keep &= iterations < stop
+                if not keep.any():
+                    continue
+                chunk = {column: npz[column] for column in npz.files}
+
+            if not keep.all():
+                offsets = chunk["offsets"]
+                counts = np.diff(offsets)
+                agent_keep = np.repeat(keep, counts)
+                for column in list(STEP_COLUMNS) + ["food"]:
+                    chunk[column] = chunk[column][keep]
+                for column in AGENT_COLUMNS:
+                    chunk[column] = chunk[column][agent_keep]
+                chunk["offsets"] = np.concatenate(([0], np.cumsum(counts[keep])))
+            yield chunk
+
+    def steps(
+        self, start: Optional[int] = None, stop: Optional[int] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Yields one record per recorded step in ``[start, stop)``, mapping each
+        per-step column to a scalar, each per-agent column to an array, and ``food``
+        to a boolean mask of the squares holding food.
+        """
+        for chunk in self.chunks(start, stop):
+            for i in range(len(chunk["iteration"])):
+                yield _get_step(chunk, i)
+
+    def frames(
+        self, start: Optional[int] = None, stop: Optional[int] = None
+    ) -> Iterator[str]:
+        """
+        Yields the visual log frame of each recorded step in ``[start, stop)``. The
+        statistics of individual agents are not logged, so they are left out.
+        """
+        for step in self.steps(start, stop):
+            yield _render_step(step)
+
+    def read(
+        self, start: Optional[int] = None, stop: Optional[int] = None
+    ) -> Dict[str, np.ndarray]:
+        """
+        Returns the per-agent columns of all recorded steps in ``[start, stop)``
+        concatenated, along with an ``iteration`` column giving the step of each row.
+        """
+        columns: Dict[str, List[np.ndarray]] = {
+            column: [] for column in list(AGENT_COLUMNS) + ["iteration"]
+        }
+        for chunk in self.chunks(start, stop):
+            counts = np.diff(chunk["offsets"])
+            columns["iteration"].append(np.repeat(chunk["iteration"], counts))
+            for column in AGENT_COLUMNS:
+                columns[column].append(chunk[column])
+        dtypes = dict(AGENT_COLUMNS, iteration=np.int64)
+        return {
+            column: np.concatenate(arrays) if arrays else np.zeros(0, dtypes[column])
+            for column, arrays in columns.items()
+        }
+
+
+def chunk_paths(log_dir: str) -> List[str]:
+    """ Returns the paths of the chunks in ``log_dir`` in order of writing. """
+    return sorted(glob.glob(os.path.join(glob.escape(log_dir), "chunk_*.npz")))
+
+
+def _get_step(chunk: Dict[str, np.ndarray], i: int) -> Dict[str, Any]:
+    """ Returns the record of the ``i``-th step of ``chunk``. """
+    step: Dict[str, Any] = {column: chunk[column][i].item() for column in STEP_COLUMNS}
+    lo, hi = chunk["offsets"][i], chunk["offsets"][i + 1]
+    for column in AGENT_COLUMNS:
+        step[column] = chunk[column][lo:hi]
+    width, height = (int(dim) for dim in chunk["grid_shape"])
+    food = np.unpackbits(chunk["food"][i], count=width * height)
+    step["food"] = food.reshape(width, height).astype(bool)
+    return step
+
+
+def _render_step(step: Dict[str, Any]) -> str:
+    """ Renders the visual log frame of a step record. """
+    agent_mask = np.zeros(step["food"].shape, dtype=bool)
+    agent_mask[step["pos_x"], step["pos_y"]] = True
+    return render_frame(
+        agent_mask,
+        step["food"],
+        step["iteration"],
+        int(np.count_nonzero(step["health"] > 0)),
+        step["num_foods"],
+    )
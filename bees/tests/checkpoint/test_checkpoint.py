@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Tests for incremental checkpoints. """
+import os
+import pickle
+import tempfile
+from typing import Dict, Any
+
+import gym
+import numpy as np
+import torch
+import hypothesis.strategies as st
+from hypothesis import given, settings
+
+from bees.rl.algo import PPO
+from bees.rl.model import Policy
+from bees.rl.storage import RolloutStorage
+from bees.checkpoint import BLOB_DIR, CheckpointWriter, load_state
+
+# pylint: disable=no-value-for-parameter
+
+
+def get_state() -> Dict[str, Any]:
+    """ Returns a trainer-like state with a trained agent and an env grid. """
+    obs_shape = (2, 3, 3)
+    action_space = gym.spaces.Discrete(5)
+    policy = Policy(obs_shape, action_space, {"hidden_size": 8})
+    agent = PPO(policy, 0.2, 1, 1, 0.5, 0.01, lr=1e-3, eps=1e-5, max_grad_norm=0.5)
+    rollouts = RolloutStorage(4, 1, obs_shape, action_space, 1)
+    rollouts.obs.uniform_()
+    rollouts.returns.normal_()
+    agent.update(rollouts)
+    grid = np.random.random((9, 9, 4))
+    return {"agents": {0: agent}, "rollout_map": {0: rollouts}, "grid": grid}
+
+
+@settings(max_examples=5, deadline=None)
+@given(st.integers(min_value=1, max_value=3))
+def test_checkpoint_round_trips_state(num_saves: int) -> None:
+    """ Makes sure a loaded checkpoint equals the saved state. """
+    state = get_state()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "run_trainer.ckpt")
+        writer = CheckpointWriter(tmp)
+        for _ in range(num_saves):
+            writer.save(path, state)
+        writer.close()
+        loaded = load_state(path)
+
+        agent, loaded_agent = state["agents"][0], loaded["agents"][0]
+        params = list(agent.actor_critic.parameters())
+        loaded_params = list(loaded_agent.actor_critic.parameters())
+        for param, loaded_param in zip(params, loaded_params):
+            assert isinstance(loaded_param, torch.nn.Parameter)
+            assert torch.equal(param, loaded_param)
+
+        # The optimizer must still refer to the parameters of the loaded policy.
+        for param in loaded_agent.optimizer.param_groups[0]["params"]:
+            assert any(param is loaded_param for loaded_param in loaded_params)
+            assert param in loaded_agent.optimizer.state
+
+        rollouts, loaded_rollouts = state["rollout_map"][0], loaded["rollout_map"][0]
+        assert torch.equal(rollouts.obs, loaded_rollouts.obs)
+        assert np.array_equal(state["grid"], loaded["grid"])
+
+
+def test_checkpoint_only_writes_modified_tensors() -> None:
+    """ Makes sure unchanged tensors are not copied again, and stale blobs go away. """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "run_trainer.ckpt")
+        blob_dir = os.path.join(tmp, BLOB_DIR)
+        writer = CheckpointWriter(tmp)
+        tensors = {"a": torch.rand(1024), "b": torch.rand(1024)}
+        writer.save(path, tensors)
+        writer.wait()
+        blobs = set(os.listdir(blob_dir))
+        assert len(blobs) == 2
+
+        # Writes through ``.data`` don't bump the version of ``b``, so the saved
+        # copy shows whether ``b`` was copied again.
+        saved_b = tensors["b"].clone()
+        tensors["b"].data.fill_(0.0)
+        tensors["a"].fill_(1.0)
+        writer.save(path, tensors)
+        writer.wait()
+        new_blobs = set(os.listdir(blob_dir))
+        assert len(new_blobs) == 2
+        assert len(new_blobs & blobs) == 1
+
+        loaded = load_state(path)
+        assert torch.equal(loaded["a"], torch.ones(1024))
+        assert torch.equal(loaded["b"], saved_b)
+        writer.close()
+
+
+def test_load_state_reads_pickles() -> None:
+    """ Makes sure pickles saved by older versions can still be loaded. """
+    state = {"grid": np.zeros((4, 4))}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "run_env.pkl")
+        with open(path, "wb") as pickle_file:
+            pickle.dump(state, pickle_file)
+        assert np.array_equal(load_state(path)["grid"], state["grid"])
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Tests for the reserve of initialized policies used for births. """
+import copy
+import time
+
+import gym
+import torch
+import hypothesis.strategies as st
+from hypothesis import given, settings
+
+from bees.config import Config
+from bees.creation import PolicyFactory
+from bees.tests.test_utils import get_default_settings
+
+# pylint: disable=no-value-for-parameter
+
+
+def get_factory(reserve_size: int) -> PolicyFactory:
+    """ Returns a factory for small PPO policies on the CPU. """
+    test_settings = get_default_settings()
+    test_settings["num_steps"] = 4
+    test_settings["reuse_state_dicts"] = True
+    test_settings["policy_reserve_size"] = reserve_size
+    obs_space = gym.spaces.Box(0.0, 1.0, (2, 3, 3))
+    act_space = gym.spaces.Discrete(5)
+    factory = PolicyFactory(
+        Config(test_settings), obs_space, act_space, torch.device("cpu")
+    )
+    factory.start()
+    return factory
+
+
+@settings(max_examples=5, deadline=None)
+@given(st.integers(min_value=1, max_value=3), st.floats(min_value=1e-5, max_value=0.1))
+def test_released_agents_are_reset_to_fresh_agents(num_updates: int, lr: float) -> None:
+    """
+    Makes sure a trained agent which is released and handed out again behaves like
+    the freshly built agent it started as.
+    """
+    factory = get_factory(0)
+    agent, rollouts = factory.get()
+    fresh_agent, fresh_rollouts = copy.deepcopy((agent, rollouts))
+
+    # Train the agent, and change its learning rate.
+    for _ in range(num_updates):
+        rollouts.obs.random_(0, 2)
+        rollouts.actions.random_(0, 5)
+        rollouts.returns.normal_()
+        rollouts.insert(*[torch.ones(1) for _ in range(8)])
+        agent.update(rollouts)
+    agent.optimizer.param_groups[0]["lr"] = lr
+
+    factory.release(agent, rollouts)
+    reused_agent, reused_rollouts = factory.get()
+    assert reused_agent is agent
+    assert reused_rollouts is rollouts
+    assert reused_rollouts.step == 0
+    for name in ["obs", "actions", "returns", "masks", "bad_masks"]:
+        assert torch.equal(getattr(rollouts, name), getattr(fresh_rollouts, name))
+
+    # Both agents should make the same update from the same rollouts.
+    rollouts.obs.random_(0, 2)
+    rollouts.actions.random_(0, 5)
+    rollouts.returns.normal_()
+    fresh_rollouts = copy.deepcopy(rollouts)
+    torch.manual_seed(0)
+    agent.update(rollouts)
+    torch.manual_seed(0)
+    fresh_agent.update(fresh_rollouts)
+    params = agent.actor_critic.parameters()
+    fresh_params = fresh_agent.actor_critic.parameters()
+    for param, fresh_param in zip(params, fresh_params):
+        assert torch.allclose(param, fresh_param, atol=1e-6)
+
+    factory.close()
+
+
+def test_reserve_is_refilled_in_the_background() -> None:
+    """ Makes sure the background thread keeps the reserve full. """
+    factory = get_factory(2)
+    agent, _ = factory.get()
+    deadline = time.time() + 60.0
+    while len(factory.reserve) < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    assert len(factory.reserve) == 2
+    assert all(reserved is not agent for reserved in factory.reserve)
+    assert len(factory.bank) == 3
+
+    factory.close()
+    assert factory.thread is not None
+    assert not factory.thread.is_alive()
@@ -3,6 +3,8 @@
 """ Test that ``Env.fill()`` works correctly. """
 import itertools
 
+import numpy as np
+
 from hypothesis import given, settings
 from hypothesis import HealthCheck as hc
 
@@ -53,20 +55,15 @@ def test_env_fill_places_correct_num_foods(env: Env) -> None:
 def test_env_fill_generates_id_map_positions_correctly(env: Env) -> None:
     """ Tests that ``self.id_map`` is correct after ``self.fill`` is called. """
     env.fill()
-    for x, y in itertools.product(range(env.width), range(env.height)):
-        object_map = env.id_map[x][y]
-        for obj_type_id, obj_ids in object_map.items():
-            if len(obj_ids) > 0:
-                assert env.grid[x][y][obj_type_id] == 1
+    agent_channel = env.grid[:, :, env.obj_type_ids["agent"]]
+    assert np.all((env.id_map != -1) == (agent_channel == 1))
 
 
 @given(strategies.envs())
 def test_env_fill_generates_id_map_ids_correctly(env: Env) -> None:
     """ Tests that ``self.id_map`` is correct after ``self.fill`` is called. """
     env.fill()
-    for x, y in itertools.product(range(env.width), range(env.height)):
-        object_map = env.id_map[x][y]
-        for obj_type_id, obj_ids in object_map.items():
-            if obj_type_id == env.obj_type_ids["agent"]:
-                for obj_id in obj_ids:
-                    assert obj_id in env.agents
+    placed_ids = env.id_map[env.id_map != -1].tolist()
+    assert sorted(placed_ids) == sorted(env.agents)
+    for agent_id, agent in env.agents.items():
+        assert env.id_map[agent.pos] == agent_id
@@ -47,3 +47,26 @@ def test_get_obs_has_correct_objects(data: st.DataObject) -> None:
                 assert np.all(ob_square == env_square)
             else:
                 assert np.all(ob[:, i, j] == np.zeros((env.num_obj_types,)))
+
+
+@given(st.data())
+def test_get_obs_batch_matches_get_obs(data: st.DataObject) -> None:
+    """ Make sure that batched observations agree with ``env._get_obs()``. """
+    env = data.draw(bst.envs())
+    env.reset()
+    positions = data.draw(st.lists(bst.positions(env=env), min_size=1, max_size=8))
+    obs_batch = env.get_obs_batch(np.array(positions))
+    assert obs_batch.shape == (len(positions),) + env.observation_space.shape
+    for pos, ob in zip(positions, obs_batch):
+        assert np.all(ob == env._get_obs(pos))
+
+
+@given(st.data())
+def test_get_obs_sees_grid_updates(data: st.DataObject) -> None:
+    """ Make sure that observations reflect writes made to ``env.grid``. """
+    env = data.draw(bst.envs())
+    env.reset()
+    pos = data.draw(bst.positions(env=env))
+    env.grid[pos] = 1 - env.grid[pos]
+    ob = env._get_obs(pos)
+    assert np.all(ob[:, env.sight_len, env.sight_len] == env.grid[pos])
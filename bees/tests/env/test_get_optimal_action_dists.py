@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Tests for the ``env.get_optimal_action_dists()`` function. """
+import torch
+import torch.nn.functional as F
+import hypothesis.strategies as st
+from hypothesis import given, assume
+
+from bees.tests import strategies as bst
+
+# pylint: disable=no-value-for-parameter, protected-access
+
+
+@given(st.data())
+def test_optimal_action_dists_match_per_action_rewards(data: st.DataObject) -> None:
+    """ Makes sure distributions are the softmax of each action's reward. """
+    env = data.draw(bst.envs())
+    env.reset()
+    temperature = data.draw(st.floats(min_value=1e-2, max_value=1.0))
+    dists = env.get_optimal_action_dists(greedy_temperature=temperature)
+
+    for agent_id, agent in env.agents.items():
+        total_reward = agent.total_reward
+        rewards = torch.Tensor(
+            [agent.compute_reward(action) for action in range(env.num_actions)]
+        )
+        agent.total_reward = total_reward
+        expected = F.softmax(rewards / temperature, dim=0)
+        assert dists[agent_id].shape == (env.num_actions,)
+        assert torch.allclose(dists[agent_id], expected, atol=1e-5)
+
+
+@given(st.data())
+def test_optimal_action_dists_have_no_side_effects(data: st.DataObject) -> None:
+    """ Makes sure computing distributions doesn't modify agent rewards. """
+    env = data.draw(bst.envs())
+    env.reset()
+    rewards = {
+        agent_id: (agent.total_reward, agent.last_reward)
+        for agent_id, agent in env.agents.items()
+    }
+    env.get_optimal_action_dists(greedy_temperature=env.greedy_temperature)
+    for agent_id, agent in env.agents.items():
+        assert (agent.total_reward, agent.last_reward) == rewards[agent_id]
+
+
+@given(st.data())
+def test_cached_optimal_action_dists_track_reward_weights(data: st.DataObject) -> None:
+    """ Makes sure cached distributions are recomputed when weights change. """
+    env = data.draw(bst.envs())
+    assume(list(env.reward_inputs) == ["actions"])
+    env.reset()
+    temperature = 0.5
+    env.get_optimal_action_dists(greedy_temperature=temperature)
+    agent_id = next(iter(env.agents))
+    agent = env.agents[agent_id]
+    agent.initialize_reward_weights()
+    dists = env.get_optimal_action_dists(greedy_temperature=temperature)
+
+    rewards = torch.Tensor(
+        [agent.compute_reward(action) for action in range(env.num_actions)]
+    )
+    expected = F.softmax(rewards / temperature, dim=0)
+    assert torch.allclose(dists[agent_id], expected, atol=1e-5)
@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 from typing import Dict, Tuple
 
+import numpy as np
 import hypothesis.strategies as st
 from hypothesis import given
 from bees.tests import strategies as bst
@@ -72,3 +73,48 @@ def test_move_only_changes_to_stay(data: st.DataObject) -> None:
     for attempted_action, executed_action in pairs:
         if attempted_action[0] != executed_action[0]:
             assert executed_action[0] == env.STAY
+
+
+@given(st.data())
+def test_resolve_moves_matches_sequential_moves(data: st.DataObject) -> None:
+    """ Makes sure moves resolve as if executed one at a time in priority order. """
+    env = data.draw(bst.envs())
+    env.reset()
+    tuple_action_dict = data.draw(bst.tuple_action_dicts(env=env))
+    seed = data.draw(st.integers(min_value=0, max_value=2 ** 32 - 1))
+
+    agent_ids = list(tuple_action_dict)
+    positions = np.array([env.agents[agent_id].pos for agent_id in agent_ids])
+    moves = np.array([action[0] for action in tuple_action_dict.values()])
+    np.random.seed(seed)
+    executed_moves = env._resolve_moves(agent_ids, positions, moves)
+
+    # Execute the moves sequentially in the same random order.
+    np.random.seed(seed)
+    priorities = np.random.permutation(len(agent_ids))
+    id_map = env.id_map.copy()
+    for i in np.argsort(priorities):
+        pos = tuple(positions[i])
+        new_pos = env._update_pos(pos, moves[i])
+        x, y = new_pos
+        if 0 <= x < env.width and 0 <= y < env.height and id_map[new_pos] == -1:
+            id_map[pos] = -1
+            id_map[new_pos] = agent_ids[i]
+            assert executed_moves[i] == moves[i]
+        else:
+            assert executed_moves[i] == env.STAY
+
+
+@given(st.data())
+def test_move_keeps_grid_and_id_map_in_sync(data: st.DataObject) -> None:
+    """ Makes sure ``env.grid``, ``env.id_map`` and agent positions agree. """
+    env = data.draw(bst.envs())
+    env.reset()
+    tuple_action_dict = data.draw(bst.tuple_action_dicts(env=env))
+    env._move(tuple_action_dict)
+
+    agent_channel = env.grid[:, :, env.obj_type_ids["agent"]]
+    assert np.all((env.id_map != -1) == (agent_channel == 1))
+    assert np.sum(env.id_map != -1) == len(env.agents)
+    for agent_id, agent in env.agents.items():
+        assert env.id_map[agent.pos] == agent_id
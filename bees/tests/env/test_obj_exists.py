@@ -73,25 +73,14 @@ def test_obj_exists_handles_invalid_obj_type_ids(data: st.DataObject) -> None:
 
 
 @given(data=st.data())
-def test_obj_exists_detects_bad_id_map(data: st.DataObject) -> None:
-    """ Make sure error is raised when ``id_map`` disagrees with ``grid``. """
+def test_obj_exists_uses_id_map_for_agents(data: st.DataObject) -> None:
+    """ Make sure ``id_map`` is the source of truth for agent positions. """
     env = data.draw(bst.envs())
     obj_type_id = env.obj_type_ids["agent"]
     pos = data.draw(bst.positions(env=env))
-    x = pos[0]
-    y = pos[1]
-    grid_idx = pos + (obj_type_id,)
-    singleton_id_set = set([data.draw(st.integers(min_value=0, max_value=3))])
-    env.id_map[x][y][obj_type_id] = singleton_id_set
-    raised_value_error = False
-    try:
-        _ = env._obj_exists(obj_type_id, pos)
-    except ValueError:
-        raised_value_error = True
-    if env.grid[grid_idx] == 0:
-        assert raised_value_error
-    else:
-        assert not raised_value_error
+    agent_id = data.draw(st.integers(min_value=-1, max_value=3))
+    env.id_map[pos] = agent_id
+    assert env._obj_exists(obj_type_id, pos) == (agent_id != -1)
 
 
 @given(data=st.data())
@@ -148,7 +137,7 @@ def test_obj_exists_marks_id_map_emptiness_correctly(data: st.DataObject) -> Non
 
     for x in range(env.width):
         for y in range(env.height):
-            if env.id_map[x][y][obj_type_id]:
+            if env.id_map[x][y] != -1:
                 assert env._obj_exists(obj_type_id, (x, y))
             else:
                 assert not env._obj_exists(obj_type_id, (x, y))
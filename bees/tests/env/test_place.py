@@ -88,4 +88,4 @@ def test_env_place_with_id_in_id_map(place_args: Tuple[Env, Tuple[int, int]]) ->
     if not env._obj_exists(obj_type_id, pos):
         agent_id = env._new_agent_id()
         env._place(obj_type_id, pos, agent_id)
-        assert agent_id in env.id_map[x][y][obj_type_id]
+        assert env.id_map[x][y] == agent_id
@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import numpy as np
 import hypothesis.strategies as st
 from hypothesis import given
 
@@ -35,3 +36,24 @@ def test_env_plant_fills_grid_when_one_prob(data: st.DataObject) -> None:
     env.food_regen_prob = 1.0
     env._plant()
     assert env.num_foods == env.width * env.height
+
+
+@given(st.data())
+def test_env_plant_counts_new_foods(data: st.DataObject) -> None:
+    """ Makes sure ``env.num_foods`` matches the number of foods in the grid. """
+    env: Env = data.draw(bst.envs())
+    env.reset()
+    env._plant()
+    assert env.num_foods == np.sum(env.grid[:, :, env.obj_type_ids["food"]])
+
+
+@given(st.data())
+def test_env_geometric_squares_are_valid(data: st.DataObject) -> None:
+    """ Makes sure geometric sampling yields unique, in-bounds squares. """
+    env: Env = data.draw(bst.envs())
+    prob = data.draw(st.floats(min_value=0.0, max_value=1.0))
+    squares = env._sample_geometric_squares(prob)
+    assert np.all(np.diff(squares) > 0)
+    assert np.all((0 <= squares) & (squares < env.width * env.height))
+    if prob == 1.0:
+        assert len(squares) == env.width * env.height
@@ -39,11 +39,11 @@ def test_env_remove_with_id(remove_args: Tuple[Env, Tuple[int, int]]) -> None:
         agent_id = env._new_agent_id()
         env._place(obj_type_id, pos, agent_id)
     else:
-        agent_id = next(iter(env.id_map[x][y][obj_type_id]))
+        agent_id = int(env.id_map[x][y])
 
     # Remove from ``pos``.
     env._remove(obj_type_id, pos, agent_id)
 
     grid_idx = pos + (obj_type_id,)
     assert env.grid[grid_idx] == 0
-    assert agent_id not in env.id_map[x][y][obj_type_id]
+    assert env.id_map[x][y] == -1
@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Test that ``Env.visual()`` renders the grid correctly. """
+from hypothesis import given, settings
+
+from bees.env import Env
+from bees.visual import ANCHOR
+from bees.tests import strategies
+
+# pylint: disable=no-value-for-parameter, protected-access
+
+
+@settings(deadline=None)
+@given(strategies.envs())
+def test_env_visual_matches_grid(env: Env) -> None:
+    """ Compares the rendered grid with a square by square lookup. """
+    env.reset()
+    expected = "\n"
+    for y in range(env.height):
+        for x in range(env.width):
+            symbol = "_"
+            if env._obj_exists(env.obj_type_ids["agent"], (x, y)):
+                symbol = "B"
+            elif env._obj_exists(env.obj_type_ids["food"], (x, y)):
+                symbol = "*"
+            expected += symbol + " "
+        expected += "\n"
+    expected += "\n" + ANCHOR + "\n\n"
+
+    visual = env.visual()
+    assert visual.startswith(expected)
+    assert visual.endswith("Step: %d\n" % env.iteration)
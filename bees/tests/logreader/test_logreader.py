@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Tests for the indexed env log reader. """
+import os
+import ast
+import tempfile
+from typing import List, Dict, Any
+
+import hypothesis.strategies as st
+from hypothesis import given, settings
+
+from bees.env import Env
+from bees.logreader import EnvLogReader, VisualLogReader, INDEX_SUFFIX
+from bees.tests import strategies
+
+# pylint: disable=no-value-for-parameter
+
+
+def write_log(data: st.DataObject, env: Env, log_path: str, num_steps: int) -> None:
+    """ Steps ``env`` and appends its state to the log at ``log_path``. """
+    with open(log_path, "a") as env_log:
+        for _ in range(num_steps):
+            env.step(data.draw(strategies.action_dicts(env)))
+            env.log_state(env_log)
+            env.iteration += 1
+
+
+def read_eval(log_path: str) -> List[Dict[str, Any]]:
+    """ Reads the log the way ``plot.py`` used to. """
+    with open(log_path, "r") as env_log:
+        return [ast.literal_eval(line) for line in env_log]
+
+
+@settings(max_examples=20, deadline=None)
+@given(
+    st.data(),
+    strategies.envs(),
+    st.integers(min_value=1, max_value=6),
+    st.integers(min_value=0, max_value=6),
+)
+def test_env_log_reader_matches_literal_eval(
+    data: st.DataObject, env: Env, num_steps: int, num_appended: int
+) -> None:
+    """ Makes sure records equal the logged states, before and after appending. """
+    env.reset()
+    with tempfile.TemporaryDirectory() as tmp:
+        log_path = os.path.join(tmp, "run_env_log.txt")
+        write_log(data, env, log_path, num_steps)
+        assert len(EnvLogReader(log_path)) == num_steps
+        assert os.path.isfile(log_path + INDEX_SUFFIX)
+
+        # The cached index is extended with the appended lines.
+        write_log(data, env, log_path, num_appended)
+        reader = EnvLogReader(log_path)
+        states = read_eval(log_path)
+        records = list(reader.records())
+        assert len(records) == len(states) == num_steps + num_appended
+        for (iteration, agents), state in zip(records, states):
+            assert iteration == state["iteration"]
+            assert agents == state["agents"]
+
+        # Ranges and agent subsets only return the matching records.
+        start = data.draw(st.integers(min_value=0, max_value=len(states)))
+        all_ids = sorted({agent_id for state in states for agent_id in state["agents"]})
+        agent_ids = data.draw(st.lists(st.sampled_from(all_ids))) if all_ids else []
+        expected = []
+        for state in states[start:]:
+            agents = {i: state["agents"][i] for i in agent_ids if i in state["agents"]}
+            if agents:
+                expected.append((state["iteration"], agents))
+        assert list(reader.records(start, None, agent_ids)) == expected
+
+
+@settings(max_examples=20, deadline=None)
+@given(st.data(), strategies.envs(), st.integers(min_value=1, max_value=6))
+def test_visual_log_reader_seeks_frames(
+    data: st.DataObject, env: Env, num_steps: int
+) -> None:
+    """ Makes sure indexed frames equal the rendered ones and seek to iterations. """
+    env.reset()
+    with tempfile.TemporaryDirectory() as tmp:
+        log_path = os.path.join(tmp, "run_visual_log.txt")
+        visuals = []
+        with open(log_path, "a") as visual_log:
+            for _ in range(num_steps):
+                env.step(data.draw(strategies.action_dicts(env)))
+                env.render(visual_log)
+                visuals.append(env.visual())
+                env.iteration += 2
+
+        reader = VisualLogReader(log_path)
+        assert len(reader) == num_steps
+        index = data.draw(st.integers(min_value=0, max_value=num_steps - 1))
+        assert reader.frame(index) == visuals[index]
+        assert reader.seek(2 * index) == index
+        assert reader.seek(2 * index + 1) == index
+        assert reader.seek(10 ** 6) == num_steps - 1
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Tests for the shared-memory transport between leader and workers. """
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+import pytest
+import hypothesis.strategies as st
+from hypothesis import given, settings
+
+from bees.pipe import Pipe
+
+# pylint: disable=no-value-for-parameter
+
+
+@given(
+    st.integers(min_value=0, max_value=10 ** 6),
+    st.floats(min_value=-1e6, max_value=1e6),
+    st.booleans(),
+    st.booleans(),
+    st.booleans(),
+)
+def test_pipe_round_trips_step_data(
+    iteration: int,
+    reward: float,
+    done: bool,
+    backward_pass: bool,
+    send_optimal_action_dist: bool,
+) -> None:
+    """ Makes sure step data written by one side is read back by the other. """
+    obs_shape = (2, 3, 3)
+    num_actions = 5
+    row = 3
+    pipe = Pipe(obs_shape, num_actions)
+    ob = np.random.random(obs_shape).astype(np.float32)
+    optimal_action_dist = torch.softmax(torch.rand(num_actions), dim=0)
+    info = {"age": iteration // 2}
+    if send_optimal_action_dist:
+        info["optimal_action_dist"] = optimal_action_dist
+
+    pipe.send_message(("birth", 7))
+    pipe.send_control()
+    stop, messages = pipe.recv_control()
+    assert not stop
+    assert messages == (("birth", 7),)
+
+    pipe.slots["actions"][row] = 4
+    pipe.send_actions()
+    assert pipe.recv_actions()[row] == 4
+
+    pipe.write_env(row, ob, reward, done, info)
+    pipe.send_env(iteration, backward_pass)
+    assert pipe.recv_env() == (iteration, backward_pass)
+    received_ob, received_reward, received_done, received_info = pipe.read_env(row)
+    assert np.array_equal(received_ob.numpy(), ob)
+    assert received_reward == reward
+    assert received_done == done
+    assert received_info["age"] == iteration // 2
+    assert ("optimal_action_dist" in received_info) == send_optimal_action_dist
+    if send_optimal_action_dist:
+        assert torch.equal(received_info["optimal_action_dist"], optimal_action_dist)
+
+    pipe.slots["policy_scores"][row] = reward
+    pipe.send_policy_scores()
+    assert pipe.recv_policy_scores()[row] == reward
+
+
+@settings(max_examples=10, deadline=None)
+@given(st.integers(min_value=1, max_value=4), st.integers(min_value=1, max_value=4))
+def test_pipe_grow_preserves_layout(capacity: int, growth: int) -> None:
+    """ Makes sure a resize reaches the worker side and leaves rows addressable. """
+    obs_shape = (2, 3, 3)
+    pipe = Pipe(obs_shape, 5, capacity=capacity)
+    pipe.grow(capacity + growth)
+    pipe.send_control(stop=True)
+    stop, messages = pipe.recv_control()
+    assert stop
+    assert not messages
+    assert pipe.capacity == capacity + growth
+    assert pipe.slots["obs"].shape == (capacity + growth,) + obs_shape
+
+    row = capacity + growth - 1
+    pipe.write_env(row, np.ones(obs_shape), 1.0, False, {"age": 1})
+    pipe.send_env(0, False)
+    pipe.recv_env()
+    assert torch.equal(pipe.read_env(row)[0], torch.ones(obs_shape))
+
+
+def test_pipe_raises_when_worker_dies() -> None:
+    """
+    Makes sure the leader raises instead of waiting forever on a dead worker, and
+    still receives what the worker sent before it exited.
+    """
+    pipe = Pipe((2, 3, 3), 5)
+    worker = mp.Process(target=pipe.loss_funnel.send, args=({7: (0.0, 0.0, 0.0)},))
+    worker.start()
+    worker.join()
+    assert pipe.recv_losses(worker.is_alive) == {7: (0.0, 0.0, 0.0)}
+
+    for recv in (
+        pipe.recv_actions,
+        pipe.recv_policy_scores,
+        pipe.recv_losses,
+        pipe.recv_saves,
+    ):
+        with pytest.raises(RuntimeError):
+            recv(worker.is_alive)
+
+    pipe.send_actions()
+    pipe.recv_actions(worker.is_alive)
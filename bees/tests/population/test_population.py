@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Tests for the ``Population`` table and population-backed ``Agent`` state. """
+from typing import List
+
+import numpy as np
+import hypothesis.strategies as st
+from hypothesis import given, settings
+
+from bees.population import Population
+from bees.tests import strategies as bst
+
+# pylint: disable=no-value-for-parameter, protected-access
+
+
+@given(st.lists(st.integers(min_value=0, max_value=1000), unique=True, min_size=1))
+def test_population_recycles_rows(agent_ids: List[int]) -> None:
+    """ Makes sure rows of removed agents are reused before the table grows. """
+    population = Population((1,), capacity=1)
+    for agent_id in agent_ids:
+        population.add(agent_id)
+    capacity = population.capacity
+    rows = population.rows(agent_ids)
+    assert len(set(rows.tolist())) == len(agent_ids)
+
+    for agent_id in agent_ids:
+        population.remove(agent_id)
+    assert len(population) == 0
+    assert not population.alive.any()
+
+    for agent_id in agent_ids:
+        population.add(agent_id + 1000)
+    assert population.capacity == capacity
+    assert population.alive.sum() == len(agent_ids)
+
+
+@given(st.data())
+def test_population_matches_agents_after_step(data: st.DataObject) -> None:
+    """ Makes sure ``env.population`` holds exactly the state of ``env.agents``. """
+    env = data.draw(bst.envs())
+    env.reset()
+    action_dict = data.draw(bst.action_dicts(env=env))
+    obs, _, _, _ = env.step(action_dict)
+
+    population = env.population
+    assert len(population) == len(env.agents)
+    assert population.alive.sum() == len(env.agents)
+    for agent_id, agent in env.agents.items():
+        row = population.id_to_row[agent_id]
+        assert agent._population is population
+        assert agent.pos == (population.pos_x[row], population.pos_y[row])
+        assert agent.health == population.health[row]
+        assert agent.health > 0.0
+        assert np.all(obs[agent_id] == env._get_obs(agent.pos))
+        assert np.all(agent.observation == obs[agent_id])
+
+
+@given(st.data())
+def test_dead_agents_are_detached(data: st.DataObject) -> None:
+    """ Makes sure killed agents are sent to heaven and leave ``env.population``. """
+    env = data.draw(bst.envs())
+    env.reset()
+    agents = dict(env.agents)
+    action_dict = data.draw(bst.action_dicts(env=env))
+    _, _, dones, _ = env.step(action_dict)
+
+    for agent_id, agent in agents.items():
+        if agent_id not in env.agents:
+            assert dones[agent_id]
+            assert agent_id not in env.population
+            assert agent._population is not env.population
+            assert agent.pos == env.HEAVEN
+            assert agent.health <= 0.0
+
+
+@given(st.data())
+def test_compute_rewards_matches_per_agent_networks(data: st.DataObject) -> None:
+    """ Makes sure batched rewards agree with evaluating each network on its own. """
+    env = data.draw(bst.envs())
+    env.reset()
+    population = env.population
+    agent_ids = list(env.agents)
+    rows = population.rows(agent_ids)
+    actions = np.array(
+        [data.draw(st.integers(0, env.num_actions - 1)) for _ in agent_ids]
+    )
+    rewards = population.compute_rewards(
+        rows, actions, env.reward_inputs, env.num_actions
+    )
+
+    for agent_id, action, reward in zip(agent_ids, actions, rewards):
+        agent = env.agents[agent_id]
+        inputs = []
+        if "obs" in env.reward_inputs:
+            inputs.append(agent.observation.flatten())
+        if "actions" in env.reward_inputs:
+            inputs.append(np.eye(env.num_actions)[action])
+        if "health" in env.reward_inputs:
+            inputs.append(np.array([agent.prev_health, agent.health]))
+        hidden = np.concatenate(inputs)
+        for i, (weights, biases) in enumerate(
+            zip(agent.reward_weights, agent.reward_biases)
+        ):
+            hidden = hidden @ weights + biases
+            if i < len(agent.reward_weights) - 1:
+                hidden = np.maximum(hidden, 0)
+        assert np.isclose(reward, hidden[0])
+        assert np.isclose(agent.compute_reward(action), hidden[0])
+
+
+@settings(deadline=None)
+@given(st.data(), st.integers(min_value=1, max_value=3))
+def test_compute_probe_rewards_matches_compute_rewards(
+    data: st.DataObject, num_probes: int
+) -> None:
+    """ Makes sure probe rewards agree with rewards of rows holding each probe. """
+    env = data.draw(bst.envs())
+    env.reset()
+    population = env.population
+    rows = population.rows(env.agents)
+    obs_shape = (num_probes,) + population.obs_shape
+    observations = np.random.random(obs_shape).astype(population.observation.dtype)
+    healths = np.random.random(num_probes)
+    prev_healths = np.random.random(num_probes)
+    probe_rewards = population.compute_probe_rewards(
+        rows, observations, healths, prev_healths, env.reward_inputs, env.num_actions
+    )
+    assert probe_rewards.shape == (len(rows), num_probes, env.num_actions)
+
+    actions = np.arange(env.num_actions)
+    for probe in range(num_probes):
+        for i, row in enumerate(rows):
+            population.observation[row] = observations[probe]
+            population.health[row] = healths[probe]
+            population.prev_health[row] = prev_healths[probe]
+            rewards = population.compute_rewards(
+                np.full(env.num_actions, row),
+                actions,
+                env.reward_inputs,
+                env.num_actions,
+            )
+            assert np.allclose(probe_rewards[i, probe], rewards)
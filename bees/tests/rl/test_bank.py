@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Tests for the bounded bank of policy initializations. """
+import os
+import pickle
+import tempfile
+from typing import Set
+
+import torch
+import torch.nn as nn
+import hypothesis.strategies as st
+from hypothesis import given, settings
+
+from bees.rl.bank import InitBank
+
+# pylint: disable=no-value-for-parameter
+
+
+def get_module(value: float) -> nn.Module:
+    """ Returns a small module with all parameters set to ``value``. """
+    module = nn.Sequential(nn.Linear(3, 4), nn.Linear(4, 2))
+    with torch.no_grad():
+        for param in module.parameters():
+            param.fill_(value)
+    return module
+
+
+def get_values(bank: InitBank) -> Set[float]:
+    """ Returns the value each stored initialization was filled with. """
+    module = get_module(0.0)
+    values: Set[float] = set()
+    for index in range(len(bank)):
+        bank.restore(module, index)
+        values.add(next(module.parameters()).flatten()[0].item())
+    return values
+
+
+@settings(max_examples=20, deadline=None)
+@given(
+    st.integers(min_value=1, max_value=8),
+    st.integers(min_value=0, max_value=20),
+    st.sampled_from(["fifo", "reservoir"]),
+)
+def test_init_bank_is_bounded(capacity: int, num_added: int, eviction: str) -> None:
+    """ Makes sure the bank never holds more than ``capacity`` initializations. """
+    bank = InitBank(capacity, eviction)
+    for i in range(num_added):
+        bank.add(get_module(float(i)))
+    assert len(bank) == min(capacity, num_added)
+    values = get_values(bank)
+    assert len(values) == len(bank)
+    assert values <= {float(i) for i in range(num_added)}
+    if eviction == "fifo":
+        assert values == {float(i) for i in range(num_added - len(bank), num_added)}
+
+
+def test_init_bank_restores_parameters_in_place() -> None:
+    """ Makes sure restoring copies into the existing parameter tensors. """
+    bank = InitBank(2)
+    source = get_module(0.0)
+    for param in source.parameters():
+        param.data.normal_()
+    bank.add(source)
+
+    target = get_module(1.0)
+    params = list(target.parameters())
+    bank.restore(target)
+    for param, target_param, source_param in zip(
+        params, target.parameters(), source.parameters()
+    ):
+        assert param is target_param
+        assert torch.equal(target_param, source_param)
+
+
+def test_memory_mapped_init_bank_pickles_by_reference() -> None:
+    """ Makes sure a memory-mapped bank survives pickling without copying data. """
+    with tempfile.TemporaryDirectory() as tmp:
+        bank = InitBank(16, "fifo", os.path.join(tmp, "bank.dat"))
+        for i in range(3):
+            bank.add(get_module(float(i)))
+        data = pickle.dumps(bank)
+        assert len(data) < 16 * 26 * 4
+
+        loaded = pickle.loads(data)
+        assert len(loaded) == 3
+        assert get_values(loaded) == {0.0, 1.0, 2.0}
+        loaded.add(get_module(3.0))
+        assert get_values(loaded) == {0.0, 1.0, 2.0, 3.0}
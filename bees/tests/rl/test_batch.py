@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Tests for batched policy forward passes. """
+import gym
+import torch
+import hypothesis.strategies as st
+from hypothesis import given
+
+from bees.rl.model import Policy
+from bees.rl.batch import PolicyStack
+
+# pylint: disable=no-value-for-parameter
+
+
+@given(
+    st.integers(min_value=1, max_value=4),
+    st.integers(min_value=1, max_value=5),
+    st.integers(min_value=2, max_value=20),
+)
+def test_policy_stack_matches_policy_act(
+    num_policies: int, obs_width: int, num_actions: int
+) -> None:
+    """ Makes sure batched forward passes agree with ``Policy.act()``. """
+    obs_shape = (2, obs_width, obs_width)
+    policies = [
+        Policy(obs_shape, gym.spaces.Discrete(num_actions), {"hidden_size": 8})
+        for _ in range(num_policies)
+    ]
+    inputs = torch.rand((num_policies, 1) + obs_shape)
+    rnn_hxs = torch.zeros(num_policies, 1, 1)
+    masks = torch.ones(num_policies, 1, 1)
+
+    policy_stack = PolicyStack()
+    with torch.no_grad():
+        act_returns = policy_stack.act(
+            list(range(num_policies)), policies, inputs, rnn_hxs, masks
+        )
+
+    for i, policy in enumerate(policies):
+        with torch.no_grad():
+            value, _, _, _, probs = policy.act(inputs[i], rnn_hxs[i], masks[i])
+        batched_value, action, action_log_prob, _, batched_probs = act_returns[i]
+        assert batched_value.shape == value.shape
+        assert action.shape == (1, 1)
+        assert torch.allclose(batched_value, value, atol=1e-5)
+        assert torch.allclose(batched_probs, probs, atol=1e-5)
+        assert torch.allclose(
+            action_log_prob, torch.log(probs[0, action[0, 0]]).view(1, 1), atol=1e-5
+        )
+
+
+def test_policy_stack_restacks_after_invalidate() -> None:
+    """ Makes sure updated weights are only used after ``invalidate()``. """
+    obs_shape = (2, 3, 3)
+    policy = Policy(obs_shape, gym.spaces.Discrete(4), {"hidden_size": 8})
+    inputs = torch.rand((1, 1) + obs_shape)
+    rnn_hxs = torch.zeros(1, 1, 1)
+    masks = torch.ones(1, 1, 1)
+    policy_stack = PolicyStack()
+
+    with torch.no_grad():
+        old_value = policy_stack.act([0], [policy], inputs, rnn_hxs, masks)[0][0]
+        policy.base.critic_linear.bias.add_(1.0)
+        cached_value = policy_stack.act([0], [policy], inputs, rnn_hxs, masks)[0][0]
+        policy_stack.invalidate()
+        new_value = policy_stack.act([0], [policy], inputs, rnn_hxs, masks)[0][0]
+
+    assert torch.allclose(cached_value, old_value)
+    assert torch.allclose(new_value, old_value + 1.0)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Tests for action distributions. """
+
+from itertools import product
+from typing import List
+
+import torch
+import hypothesis.strategies as st
+from hypothesis import given
+
+from bees.rl.distributions import FixedCategoricalProduct
+
+# pylint: disable=no-value-for-parameter
+
+
+@given(
+    st.integers(min_value=1, max_value=4),
+    st.lists(st.integers(min_value=1, max_value=4), min_size=1, max_size=3),
+    st.integers(min_value=0, max_value=1000),
+)
+def test_categorical_product_matches_subactions(
+    num_processes: int, sizes: List[int], seed: int
+) -> None:
+    """ Makes sure the joint distribution is the product of its subactions'. """
+    generator = torch.Generator().manual_seed(seed)
+    logits_list = [
+        torch.randn(num_processes, size, generator=generator) for size in sizes
+    ]
+    dist = FixedCategoricalProduct(logits_list)
+    subprobs = [torch.softmax(logits, dim=-1) for logits in logits_list]
+
+    assert dist.probs.shape == (num_processes, *sizes)
+    for process in range(num_processes):
+        for action in product(*[range(size) for size in sizes]):
+            expected = torch.tensor(1.0)
+            for i, subaction in enumerate(action):
+                expected = expected * subprobs[i][process, subaction]
+            assert torch.allclose(dist.probs[(process,) + action], expected)
+
+    mode = dist.mode()
+    assert mode.shape == (num_processes, len(sizes))
+    assert torch.equal(
+        mode, torch.stack([probs.argmax(dim=-1) for probs in subprobs], dim=1)
+    )
+
+    actions = dist.sample()
+    assert actions.shape == (num_processes, len(sizes))
+    assert ((actions >= 0) & (actions < torch.tensor(sizes))).all()
+
+    expected_log_probs = sum(
+        torch.log(probs.gather(1, actions[:, i : i + 1]))
+        for i, probs in enumerate(subprobs)
+    )
+    assert torch.allclose(
+        dist.log_probs(actions.float()), expected_log_probs, atol=1e-5
+    )
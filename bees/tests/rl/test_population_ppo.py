@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Tests for batched PPO updates. """
+import copy
+from typing import List, Tuple
+
+import gym
+import torch
+import hypothesis.strategies as st
+from hypothesis import given, settings
+
+from bees.rl.model import Policy
+from bees.rl.algo import PPO
+from bees.rl.algo.population_ppo import PopulationPPO, group_agents
+from bees.rl.storage import RolloutStorage
+
+# pylint: disable=no-value-for-parameter
+
+
+def get_agents(
+    num_agents: int, obs_shape: Tuple[int, int, int], num_steps: int
+) -> Tuple[List[PPO], List[RolloutStorage]]:
+    """ Returns PPO agents with distinct learning rates and random rollouts. """
+    action_space = gym.spaces.Discrete(5)
+    agents: List[PPO] = []
+    rollouts_list: List[RolloutStorage] = []
+    for i in range(num_agents):
+        policy = Policy(obs_shape, action_space, {"hidden_size": 8})
+        agents.append(
+            PPO(
+                policy,
+                0.2,
+                2,
+                1,
+                0.5,
+                0.01,
+                lr=1e-3 * (i + 1),
+                eps=1e-5,
+                max_grad_norm=0.5,
+            )
+        )
+        rollouts = RolloutStorage(num_steps, 1, obs_shape, action_space, 1)
+        rollouts.obs.uniform_()
+        rollouts.actions.random_(0, action_space.n)
+        rollouts.action_log_probs.uniform_(-2.0, -1.0)
+        rollouts.value_preds.normal_()
+        rollouts.returns.normal_()
+        rollouts_list.append(rollouts)
+
+    return agents, rollouts_list
+
+
+@settings(max_examples=10, deadline=None)
+@given(
+    st.integers(min_value=1, max_value=3),
+    st.integers(min_value=1, max_value=3),
+    st.integers(min_value=2, max_value=8),
+    st.lists(st.integers(min_value=0, max_value=7), min_size=3, max_size=3),
+)
+def test_population_ppo_matches_ppo_update(
+    num_agents: int, obs_width: int, num_steps: int, starts: List[int]
+) -> None:
+    """
+    Makes sure a batched update agrees with ``PPO.update()`` for each agent, on the
+    steps each agent took. With a single mini batch, the order in which samples are
+    drawn doesn't matter. The seed keeps probability ratios which land on the
+    clipping boundary, where tiny numerical differences change the gradient, from
+    making the test flaky.
+    """
+    torch.manual_seed(0)
+    agents, rollouts_list = get_agents(num_agents, (2, obs_width, obs_width), num_steps)
+    for rollouts, start in zip(rollouts_list, starts):
+        rollouts.start = start % num_steps
+    batched_agents = copy.deepcopy(agents)
+    groups, unbatched = group_agents(dict(enumerate(batched_agents)))
+    assert groups == [list(range(num_agents))]
+    assert not unbatched
+
+    # Update twice so that the second update starts from existing ``Adam`` state.
+    for _ in range(2):
+        losses = [
+            agent.update(rollouts.since_start())
+            for agent, rollouts in zip(agents, rollouts_list)
+        ]
+        batched_losses = PopulationPPO(batched_agents).update(rollouts_list)
+        for agent_losses, batched_agent_losses in zip(losses, batched_losses):
+            for loss, batched_loss in zip(agent_losses, batched_agent_losses):
+                assert abs(loss - batched_loss) < 1e-4
+
+    for agent, batched_agent in zip(agents, batched_agents):
+        params = agent.actor_critic.parameters()
+        batched_params = batched_agent.actor_critic.parameters()
+        for param, batched_param in zip(params, batched_params):
+            assert torch.allclose(param, batched_param, atol=1e-5)
+
+        state = agent.optimizer.state_dict()["state"]
+        batched_state = batched_agent.optimizer.state_dict()["state"]
+        for index, param_state in state.items():
+            for key, value in param_state.items():
+                assert torch.allclose(value, batched_state[index][key], atol=1e-6)
+
+
+def test_group_agents_skips_recurrent_policies() -> None:
+    """ Makes sure recurrent policies are updated one at a time. """
+    obs_shape = (2, 3, 3)
+    action_space = gym.spaces.Discrete(5)
+    policy = Policy(obs_shape, action_space, {"hidden_size": 8, "recurrent": True})
+    recurrent_agent = PPO(policy, 0.2, 2, 1, 0.5, 0.01, lr=1e-3, eps=1e-5)
+    agents, _ = get_agents(2, obs_shape, 4)
+
+    groups, unbatched = group_agents({0: agents[0], 1: recurrent_agent, 2: agents[1]})
+    assert groups == [[0, 2]]
+    assert unbatched == [1]
@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Tests for rollout storage. """
+import copy
+import pickle
+from typing import List
+
+import gym
+import torch
+import numpy as np
+import hypothesis.strategies as st
+from hypothesis import given
+
+from bees.rl.storage import (
+    SCALARS,
+    RolloutStorage,
+    RolloutStore,
+    compute_returns_batch,
+    insert_batch,
+    stack_rollouts,
+)
+
+# pylint: disable=no-value-for-parameter
+
+
+def reference_returns(
+    rollouts: RolloutStorage,
+    next_value: torch.Tensor,
+    use_gae: bool,
+    gamma: float,
+    gae_lambda: float,
+    use_proper_time_limits: bool,
+) -> torch.Tensor:
+    """ Computes returns one step at a time. """
+    value_preds = rollouts.value_preds.clone()
+    returns = rollouts.returns.clone()
+    masks = rollouts.masks
+    bad_masks = rollouts.bad_masks if use_proper_time_limits else torch.ones_like(masks)
+    if use_gae:
+        value_preds[-1] = next_value
+        gae = torch.zeros_like(next_value)
+        for step in reversed(range(rollouts.num_steps)):
+            delta = (
+                rollouts.rewards[step]
+                + gamma * value_preds[step + 1] * masks[step + 1]
+                - value_preds[step]
+            )
+            gae = delta + gamma * gae_lambda * masks[step + 1] * gae
+            gae = gae * bad_masks[step + 1]
+            returns[step] = gae + value_preds[step]
+    else:
+        returns[-1] = next_value
+        for step in reversed(range(rollouts.num_steps)):
+            returns[step] = (
+                returns[step + 1] * gamma * masks[step + 1] + rollouts.rewards[step]
+            ) * bad_masks[step + 1] + (1 - bad_masks[step + 1]) * value_preds[step]
+    return returns
+
+
+def random_rollouts(num_steps: int, seed: int) -> RolloutStorage:
+    """ Returns rollouts with random rewards, values and masks. """
+    generator = torch.Generator().manual_seed(seed)
+    rollouts = RolloutStorage(num_steps, 1, (1,), gym.spaces.Discrete(2), 1)
+    rollouts.rewards.copy_(torch.rand(rollouts.rewards.shape, generator=generator))
+    rollouts.value_preds.copy_(
+        torch.rand(rollouts.value_preds.shape, generator=generator)
+    )
+    rollouts.masks.copy_(
+        (torch.rand(rollouts.masks.shape, generator=generator) > 0.2).float()
+    )
+    rollouts.bad_masks.copy_(
+        (torch.rand(rollouts.bad_masks.shape, generator=generator) > 0.2).float()
+    )
+    return rollouts
+
+
+@given(
+    st.integers(min_value=1, max_value=300),
+    st.integers(min_value=0, max_value=1000),
+    st.booleans(),
+    st.booleans(),
+    st.floats(min_value=0.0, max_value=1.0),
+    st.floats(min_value=0.0, max_value=1.0),
+)
+def test_compute_returns_matches_step_loop(
+    num_steps: int,
+    seed: int,
+    use_gae: bool,
+    use_proper_time_limits: bool,
+    gamma: float,
+    gae_lambda: float,
+) -> None:
+    """ Makes sure the scanned returns equal those computed one step at a time. """
+    rollouts = random_rollouts(num_steps, seed)
+    next_value = torch.rand(1, 1)
+    expected = reference_returns(
+        rollouts, next_value, use_gae, gamma, gae_lambda, use_proper_time_limits
+    )
+    rollouts.compute_returns(
+        next_value, use_gae, gamma, gae_lambda, use_proper_time_limits
+    )
+    assert torch.allclose(rollouts.returns, expected, atol=1e-5)
+    if use_gae:
+        assert torch.equal(rollouts.value_preds[-1], next_value)
+
+
+@given(
+    st.integers(min_value=1, max_value=5),
+    st.integers(min_value=1, max_value=100),
+    st.integers(min_value=0, max_value=1000),
+    st.booleans(),
+    st.booleans(),
+    st.booleans(),
+)
+def test_compute_returns_batch_matches_compute_returns(
+    num_rollouts: int,
+    num_steps: int,
+    seed: int,
+    use_gae: bool,
+    use_proper_time_limits: bool,
+    in_store: bool,
+) -> None:
+    """
+    Makes sure stacked rollouts get the returns they would get one by one, including
+    those of agents born mid-rollout, whether or not they're views of a store.
+    """
+    rollouts_list = [random_rollouts(num_steps, seed + i) for i in range(num_rollouts)]
+    singles = [random_rollouts(num_steps, seed + i) for i in range(num_rollouts)]
+    for i, (rollouts, single) in enumerate(zip(rollouts_list, singles)):
+        rollouts.start = single.start = (seed + i) % num_steps
+    if in_store:
+        store = RolloutStore(num_steps, (1,), gym.spaces.Discrete(2), 1)
+        other = store.acquire()
+        rollouts_list = [store.adopt(rollouts) for rollouts in rollouts_list][::-1]
+        singles = singles[::-1]
+    next_values = torch.rand(num_rollouts, 1, 1)
+
+    compute_returns_batch(
+        rollouts_list, next_values, use_gae, 0.99, 0.95, use_proper_time_limits
+    )
+    for rollouts, single, next_value in zip(rollouts_list, singles, next_values):
+        single.compute_returns(next_value, use_gae, 0.99, 0.95, use_proper_time_limits)
+        assert torch.allclose(rollouts.returns, single.returns, atol=1e-6)
+        assert torch.equal(rollouts.value_preds, single.value_preds)
+    if in_store:
+        assert not other.returns.any() and not other.value_preds.any()
+
+
+@given(st.integers(min_value=1, max_value=8), st.integers(min_value=0, max_value=1000))
+def test_uint8_obs_round_trip_as_floats(num_steps: int, seed: int) -> None:
+    """ Makes sure binary observations stored as bytes are read back as floats. """
+    generator = torch.Generator().manual_seed(seed)
+    obs_shape = (2, 3, 3)
+    rollouts = RolloutStorage(
+        num_steps, 1, obs_shape, gym.spaces.Discrete(2), 1, obs_dtype=torch.uint8
+    )
+    observations = torch.rand((num_steps, 1) + obs_shape, generator=generator)
+    observations = (observations > 0.5).float()
+    for ob in observations:
+        rollouts.insert(
+            ob,
+            torch.zeros(1, 1),
+            torch.zeros(1, 1),
+            torch.zeros(1, 1),
+            torch.zeros(1, 1),
+            torch.zeros(1, 1),
+            torch.ones(1, 1),
+            torch.ones(1, 1),
+        )
+    assert rollouts.obs.dtype == torch.uint8
+    assert torch.equal(rollouts.get_obs(slice(1, None)), observations)
+    batch = next(rollouts.feed_forward_generator(None, mini_batch_size=num_steps))
+    assert batch[0].dtype == torch.float32
+
+
+@given(
+    st.integers(min_value=2, max_value=50),
+    st.integers(min_value=0, max_value=1000),
+    st.booleans(),
+)
+def test_returns_leave_out_steps_before_start(
+    num_steps: int, seed: int, use_gae: bool
+) -> None:
+    """
+    Makes sure the returns of an agent born mid-rollout are those of a rollout of
+    the steps it took, and are zero before it was born.
+    """
+    start = seed % num_steps
+    rollouts = random_rollouts(num_steps, seed)
+    rollouts.start = start
+    expected = copy.deepcopy(rollouts.since_start())
+    assert expected.num_steps == num_steps - start
+    assert torch.equal(expected.rewards, rollouts.rewards[start:])
+
+    next_value = torch.rand(1, 1)
+    rollouts.compute_returns(next_value, use_gae, 0.99, 0.95)
+    expected.compute_returns(next_value, use_gae, 0.99, 0.95)
+    assert torch.equal(rollouts.returns[start:], expected.returns)
+    assert not rollouts.returns[:start].any()
+
+    rollouts.after_update()
+    assert rollouts.since_start() is rollouts
+
+
+def test_scalars_stay_views_after_pickling() -> None:
+    """ Makes sure the scalar attributes still share the packed buffer on load. """
+    rollouts = RolloutStorage(4, 1, (2,), gym.spaces.Discrete(2), 1)
+    loaded = pickle.loads(pickle.dumps(rollouts))
+    loaded.returns[0] = 1.0
+    loaded.bad_masks[0] = 0.0
+    assert loaded.scalars[SCALARS.index("returns"), 0, 0, 0] == 1.0
+    assert loaded.scalars[SCALARS.index("bad_masks"), 0, 0, 0] == 0.0
+    assert loaded.rewards.shape == rollouts.rewards.shape == (4, 1, 1)
+
+
+@given(
+    st.integers(min_value=1, max_value=4),
+    st.integers(min_value=1, max_value=6),
+    st.integers(min_value=0, max_value=1000),
+)
+def test_insert_batch_matches_insert(
+    num_rollouts: int, num_steps: int, seed: int
+) -> None:
+    """ Makes sure writing raw transitions equals inserting them as tensors. """
+    rng = np.random.default_rng(seed)
+    obs_shape = (2, 3, 3)
+    action_space = gym.spaces.Discrete(5)
+    rollouts_list = [
+        RolloutStorage(num_steps, 1, obs_shape, action_space, 2, obs_dtype=torch.uint8)
+        for _ in range(num_rollouts)
+    ]
+    expected_list = [
+        RolloutStorage(num_steps, 1, obs_shape, action_space, 2)
+        for _ in range(num_rollouts)
+    ]
+    for _ in range(num_steps):
+        obs = (rng.random((num_rollouts,) + obs_shape) > 0.5).astype(np.float32)
+        act_returns = [
+            (
+                torch.rand(1, 1),
+                torch.randint(5, (1, 1)),
+                torch.rand(1, 1),
+                torch.rand(1, 2),
+                torch.rand(1, 5),
+            )
+            for _ in range(num_rollouts)
+        ]
+        rewards = rng.random(num_rollouts).tolist()
+        dones = (rng.random(num_rollouts) > 0.5).tolist()
+        bad_transitions = (rng.random(num_rollouts) > 0.5).tolist()
+
+        insert_batch(rollouts_list, obs, act_returns, rewards, dones, bad_transitions)
+        for i, expected in enumerate(expected_list):
+            value, action, action_log_prob, hxs, _ = act_returns[i]
+            expected.insert(
+                torch.from_numpy(obs[i][None]),
+                hxs,
+                action,
+                action_log_prob,
+                value,
+                torch.FloatTensor([rewards[i]]),
+                torch.FloatTensor([[0.0 if dones[i] else 1.0]]),
+                torch.FloatTensor([[0.0 if bad_transitions[i] else 1.0]]),
+            )
+
+    for rollouts, expected in zip(rollouts_list, expected_list):
+        assert rollouts.step == expected.step
+        assert torch.equal(rollouts.get_obs(slice(None)), expected.obs)
+        assert torch.equal(rollouts.scalars, expected.scalars)
+        assert torch.equal(rollouts.actions, expected.actions)
+        assert torch.equal(
+            rollouts.recurrent_hidden_states, expected.recurrent_hidden_states
+        )
+
+
+@given(st.lists(st.booleans(), min_size=1, max_size=30))
+def test_rollout_store_recycles_slots(acquires: List[bool]) -> None:
+    """
+    Makes sure slots are recycled, and that views keep their contents when the
+    store grows.
+    """
+    store = RolloutStore(3, (2,), gym.spaces.Discrete(2), 1)
+    live: List[RolloutStorage] = []
+    max_live = 0
+    for i, acquire in enumerate(acquires):
+        if acquire or not live:
+            rollouts = store.acquire(start=i % 3)
+            assert rollouts.store is store
+            assert rollouts.step == rollouts.start == i % 3
+            assert not rollouts.obs.any() and rollouts.masks.all()
+            rollouts.rewards.fill_(float(rollouts.slot))
+            live.append(rollouts)
+        else:
+            store.release(live.pop(0))
+
+        assert len(store) == len(live) == int(store.valid.sum())
+        assert len({rollouts.slot for rollouts in live}) == len(live)
+        for rollouts in live:
+            assert store.valid[rollouts.slot]
+            assert (rollouts.rewards == rollouts.slot).all()
+            assert (
+                rollouts.scalars.untyped_storage().data_ptr()
+                == store.scalars.untyped_storage().data_ptr()
+            )
+        max_live = max(max_live, len(live))
+
+    # Slots never outnumber twice the most agents alive at once.
+    assert store.capacity < 2 * max_live
+
+
+@given(
+    st.integers(min_value=1, max_value=6),
+    st.integers(min_value=0, max_value=1000),
+    st.permutations(range(5)),
+)
+def test_stack_rollouts_gathers_store_slots(
+    num_steps: int, seed: int, order: List[int]
+) -> None:
+    """ Makes sure slots gathered from a store match their views stacked. """
+    store = RolloutStore(num_steps, (1,), gym.spaces.Discrete(2), 1)
+    views = [store.adopt(random_rollouts(num_steps, seed + i)) for i in order]
+    views[0].obs.copy_(torch.rand(views[0].obs.shape))
+    views[-1].recurrent_hidden_states.fill_(1.0)
+    store.release(views.pop(len(views) // 2))
+    steps = [(seed + i) % num_steps for i in range(len(views))]
+    for name in ("obs", "recurrent_hidden_states", "actions") + SCALARS:
+        for index in (-1, slice(-1), slice(None), steps):
+            if isinstance(index, list):
+                expected = torch.stack(
+                    [getattr(view, name)[step] for view, step in zip(views, steps)]
+                )
+            else:
+                expected = torch.stack([getattr(view, name)[index] for view in views])
+            assert torch.equal(stack_rollouts(views, name, index), expected)
+
+
+@given(st.integers(min_value=1, max_value=6), st.integers(min_value=0, max_value=1000))
+def test_rollout_store_views_match_rollout_storage(num_steps: int, seed: int) -> None:
+    """ Makes sure a slot view behaves and pickles like its own rollouts. """
+    store = RolloutStore(num_steps, (1,), gym.spaces.Discrete(2), 1)
+    other = store.acquire()
+    view = store.acquire()
+    expected = random_rollouts(num_steps, seed)
+    view.copy_(expected)
+    other.rewards.fill_(-1.0)
+
+    next_value = torch.rand(1, 1)
+    view.compute_returns(next_value, True, 0.99, 0.95)
+    expected.compute_returns(next_value, True, 0.99, 0.95)
+    assert torch.equal(view.returns, expected.returns)
+    assert (other.rewards == -1.0).all()
+
+    loaded = pickle.loads(pickle.dumps(view))
+    assert loaded.store is None and loaded.slot is None
+    assert loaded.scalars.is_contiguous()
+    assert loaded.scalars.untyped_storage().nbytes() == expected.scalars.nbytes
+    assert torch.equal(loaded.scalars, expected.scalars)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Tests for the batched reward network scope. """
+import os
+import json
+import argparse
+import tempfile
+
+import numpy as np
+import hypothesis.strategies as st
+from hypothesis import given, settings
+
+from bees.env import Env
+from bees.scope import scope, QUANTILES
+from bees.tests import strategies
+
+# pylint: disable=no-value-for-parameter
+
+
+@settings(max_examples=10, deadline=None)
+@given(strategies.envs(), st.integers(min_value=1, max_value=64))
+def test_scope_reports_every_agent_and_action(env: Env, num_samples: int) -> None:
+    """ Makes sure a saved population is scoped with consistent statistics. """
+    env.reset()
+    with tempfile.TemporaryDirectory() as tmp:
+        env.save(os.path.join(tmp, "run_env.pkl"))
+        with open(os.path.join(tmp, "run_settings.json"), "w") as settings_file:
+            json.dump(env.config.settings, settings_file)
+        args = argparse.Namespace(
+            model_dir=tmp,
+            agents=None,
+            all=True,
+            samples=num_samples,
+            quantiles=[0.0] + QUANTILES + [1.0],
+            seed=0,
+        )
+        distributions = scope(args)
+
+    assert sorted(distributions) == sorted(env.agents)
+    rows = env.population.rows(env.agents)
+    action_rewards = env.population.compute_action_rewards(
+        rows, env.reward_inputs, env.num_actions
+    )
+    for i, agent_id in enumerate(env.agents):
+        assert sorted(distributions[agent_id]) == list(range(env.num_actions))
+        for action, distribution in distributions[agent_id].items():
+            values = [distribution["q%g" % quantile] for quantile in args.quantiles]
+            assert values == sorted(values)
+            assert values[0] - 1e-9 <= distribution["mean"] <= values[-1] + 1e-9
+
+            # Rewards only depend on the action, so they are exact.
+            if set(env.reward_inputs) == {"actions"}:
+                assert distribution["std"] == 0.0
+                assert np.isclose(distribution["mean"], action_rewards[i, action])
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Tests for the binary state log. """
+import tempfile
+from typing import Dict, List, Callable, Any
+
+import numpy as np
+import hypothesis.strategies as st
+from hypothesis import given, settings
+from hypothesis.strategies import SearchStrategy
+
+from bees.env import Env
+from bees.visual import ANCHOR
+from bees.statelog import StateLogWriter, StateLogReader, chunk_paths
+from bees.tests import strategies
+
+# pylint: disable=no-value-for-parameter, protected-access
+
+
+def run(
+    draw: Callable[[SearchStrategy], Any], env: Env, writer: StateLogWriter
+) -> List[Dict[str, Any]]:
+    """ Steps ``env`` and records it, returning the states of recorded steps. """
+    env.reset()
+    states = []
+    for _ in range(draw(st.integers(min_value=1, max_value=8))):
+        env.step(draw(strategies.action_dicts(env)))
+        writer.record(env)
+        if env.iteration % writer.interval == 0:
+            states.append(env._env_json_state())
+        env.iteration += 1
+    writer.close()
+    return states
+
+
+@settings(max_examples=20, deadline=None)
+@given(
+    st.data(),
+    strategies.envs(),
+    st.integers(min_value=1, max_value=3),
+    st.integers(min_value=1, max_value=4),
+)
+def test_state_log_round_trips_env_state(
+    data: st.DataObject, env: Env, interval: int, chunk_size: int
+) -> None:
+    """ Makes sure the logged columns equal the state of each recorded step. """
+    with tempfile.TemporaryDirectory() as tmp:
+        writer = StateLogWriter(tmp, interval, chunk_size)
+        states = run(data.draw, env, writer)
+        assert len(chunk_paths(tmp)) == -(-len(states) // chunk_size)
+
+        steps = list(StateLogReader(tmp).steps())
+        assert len(steps) == len(states)
+        for step, state in zip(steps, states):
+            assert step["iteration"] == state["iteration"]
+            assert step["num_foods"] == state["num_foods"]
+            assert np.isnan(step["policy_score"])
+            assert list(step["agent_id"]) == list(state["agents"])
+            for i, agent_state in enumerate(state["agents"].values()):
+                assert (step["pos_x"][i], step["pos_y"][i]) == agent_state["pos"]
+                assert step["health"][i] == agent_state["health"]
+                assert step["last_reward"][i] == agent_state["last_reward"]
+                assert step["age"][i] == agent_state["age"]
+                assert step["num_children"][i] == agent_state["num_children"]
+
+
+@settings(max_examples=20, deadline=None)
+@given(st.data(), strategies.envs(), st.integers(min_value=1, max_value=4))
+def test_state_log_reads_iteration_range(
+    data: st.DataObject, env: Env, chunk_size: int
+) -> None:
+    """ Makes sure a ranged read returns exactly the rows of steps in the range. """
+    with tempfile.TemporaryDirectory() as tmp:
+        states = run(data.draw, env, StateLogWriter(tmp, 1, chunk_size))
+        start = data.draw(st.integers(min_value=0, max_value=len(states)))
+        stop = data.draw(st.integers(min_value=start, max_value=len(states)))
+
+        columns = StateLogReader(tmp).read(start, stop)
+        expected = [
+            (state["iteration"], agent_id)
+            for state in states[start:stop]
+            for agent_id in state["agents"]
+        ]
+        assert list(zip(columns["iteration"], columns["agent_id"])) == expected
+
+
+@settings(max_examples=20, deadline=None)
+@given(st.data(), strategies.envs())
+def test_state_log_frames_match_env_grid(data: st.DataObject, env: Env) -> None:
+    """ Makes sure frames rendered on replay show the grid of each recorded step. """
+    with tempfile.TemporaryDirectory() as tmp:
+        writer = StateLogWriter(tmp, 1, 2)
+        env.reset()
+        grids = []
+        for _ in range(data.draw(st.integers(min_value=1, max_value=4))):
+            env.step(data.draw(strategies.action_dicts(env)))
+            writer.record(env)
+            grids.append(env.visual().split(ANCHOR)[0])
+            env.iteration += 1
+        writer.close()
+
+        reader = StateLogReader(tmp)
+        frames = list(reader.frames())
+        assert [frame.split(ANCHOR)[0] for frame in frames] == grids
+
+        # Single frames are read through the index.
+        assert len(reader) == len(frames)
+        index = data.draw(st.integers(min_value=0, max_value=len(frames) - 1))
+        assert reader.frame(reader.seek(index)) == frames[index]
@@ -29,6 +29,7 @@ def envs(draw: Callable[[SearchStrategy], Any]) -> Env:
     sample["food_density"] = draw(st.floats(min_value=0.0, max_value=1.0))
     sample["food_size_mean"] = draw(st.floats(min_value=0.0, max_value=1.0))
     sample["food_size_stddev"] = draw(st.floats(min_value=0.0, max_value=1.0))
+    sample["food_regen_sampling"] = draw(st.sampled_from(["dense", "geometric"]))
     sample["food_plant_retries"] = draw(st.integers(min_value=0, max_value=5))
     sample["aging_rate"] = draw(st.floats(min_value=1e-6, max_value=1.0))
     sample["mating_cooldown_len"] = draw(st.integers(min_value=0, max_value=100))
@@ -36,6 +37,13 @@ def envs(draw: Callable[[SearchStrategy], Any]) -> Env:
     sample["print_repr"] = draw(st.booleans())
     sample["time_steps"] = draw(st.integers(min_value=0, max_value=1000))
     sample["reuse_state_dicts"] = draw(st.booleans())
+    sample["policy_reserve_size"] = draw(st.integers(min_value=0, max_value=16))
+    sample["init_bank_capacity"] = draw(st.integers(min_value=1, max_value=128))
+    sample["init_bank_eviction"] = draw(st.sampled_from(["fifo", "reservoir"]))
+    sample["state_log_interval"] = draw(st.integers(min_value=0, max_value=100))
+    sample["state_log_chunk_size"] = draw(st.integers(min_value=1, max_value=512))
+    sample["text_log_interval"] = draw(st.integers(min_value=0, max_value=100))
+    sample["render_interval"] = draw(st.integers(min_value=0, max_value=100))
     sample["policy_score_frequency"] = draw(st.integers(min_value=1, max_value=1000))
     sample["ema_alpha"] = draw(st.floats(min_value=0.0, max_value=1.0))
     sample["n_layers"] = draw(st.integers(min_value=1, max_value=3))
@@ -58,6 +66,7 @@ def envs(draw: Callable[[SearchStrategy], Any]) -> Env:
     sample["max_grad_norm"] = draw(st.floats(min_value=0.0, max_value=1.0))
     sample["seed"] = draw(st.integers(min_value=0, max_value=10))
     sample["cuda_deterministic"] = draw(st.booleans())
+    sample["num_threads"] = draw(st.integers(min_value=1, max_value=4))
     sample["num_processes"] = draw(st.integers(min_value=1, max_value=10))
     sample["num_steps"] = draw(st.integers(min_value=1, max_value=1000))
     sample["ppo_epoch"] = draw(st.integers(min_value=1, max_value=8))
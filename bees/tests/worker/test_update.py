@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Tests for the per-agent weight updates of worker processes. """
+import math
+
+import gym
+import torch
+import hypothesis.strategies as st
+from hypothesis import given, settings
+
+from bees.config import Config
+from bees.creation import PolicyFactory
+from bees.worker import update
+from bees.tests.test_utils import get_default_settings
+
+# pylint: disable=no-value-for-parameter
+
+
+@settings(max_examples=10, deadline=None)
+@given(
+    st.integers(min_value=2, max_value=16),
+    st.integers(min_value=2, max_value=8),
+    st.integers(min_value=1, max_value=4),
+)
+def test_update_handles_agents_born_late_in_a_rollout(
+    num_steps: int, num_mini_batch: int, steps_taken: int
+) -> None:
+    """
+    Makes sure an agent born with fewer steps left in the rollout than there are
+    PPO mini batches, e.g. on the last step, is updated from the steps it took.
+    """
+    test_settings = get_default_settings()
+    test_settings["num_steps"] = num_steps
+    test_settings["num_mini_batch"] = num_mini_batch
+    test_settings["algo"] = "ppo"
+    test_settings["recurrent_policy"] = False
+    config = Config(test_settings)
+    factory = PolicyFactory(
+        config,
+        gym.spaces.Box(0.0, 1.0, (2, 3, 3)),
+        gym.spaces.Discrete(5),
+        torch.device("cpu"),
+    )
+    start = max(num_steps - min(steps_taken, num_mini_batch - 1), 0)
+    agent, rollouts = factory.get(start)
+
+    for _ in range(num_steps - start):
+        rollouts.insert(
+            torch.ones(1, 2, 3, 3),
+            torch.zeros(1, 1),
+            torch.randint(0, 5, (1, 1)),
+            torch.rand(1, 1).log(),
+            torch.rand(1, 1),
+            torch.rand(1, 1),
+            torch.ones(1, 1),
+            torch.ones(1, 1),
+        )
+
+    losses = update(agent, rollouts, config)
+    assert all(math.isfinite(loss) for loss in losses)
+    assert rollouts.start == 0
+    assert not rollouts.returns[:start].any()
@@ -4,27 +4,33 @@
 import os
 import time
 import json
-import copy
 import random
-import pickle
 import argparse
-import collections
-from typing import Dict, Tuple, Set, List, Any, TextIO
+from typing import Dict, List, Tuple, Set, Any, TextIO, Optional
 
 import torch
 import torch.multiprocessing as mp
 import numpy as np
 
 from bees.rl import utils
-from bees.rl.storage import RolloutStorage
+from bees.rl.storage import (
+    RolloutStorage,
+    compute_returns_batch,
+    insert_batch,
+    stack_rollouts,
+)
 from bees.rl.algo.algo import Algo
+from bees.rl.algo.population_ppo import PopulationPPO, group_agents
+from bees.rl.batch import PolicyStack
 
 from bees.env import Env
 from bees.timer import Timer
-from bees.pipe import Pipe
+from bees.pool import WorkerPool
 from bees.config import Config
-from bees.worker import act, get_policy_score, get_masks
-from bees.creation import get_agent
+from bees.worker import act_batch, get_policy_score, update
+from bees.creation import PolicyFactory, get_agent
+from bees.checkpoint import CheckpointWriter
+from bees.statelog import StateLogWriter
 from bees.analysis import (
     update_policy_score,
     update_losses,
@@ -109,7 +115,7 @@ def train(args: argparse.Namespace) -> float:
     torch.cuda.manual_seed_all(config.seed)
 
     # GPU setup.
-    torch.set_num_threads(2)
+    torch.set_num_threads(config.num_threads)
     device = torch.device("cuda:0" if config.cuda else "cpu")
     if config.cuda and torch.cuda.is_available() and config.cuda_deterministic:
         torch.backends.cudnn.benchmark = False
@@ -125,19 +131,35 @@ def train(args: argparse.Namespace) -> float:
     rollout_map: Dict[int, RolloutStorage] = {}
     minted_agents: Set[int] = set()
 
-    # Save dead objects to make creation faster.
-    dead_agents: Set[Algo] = set()
-    dead_pipes: Dict[int, Pipe] = {}
-    state_dicts: List[collections.OrderedDict] = []
-    optim_state_dicts: List[collections.OrderedDict] = []
-
     # Multiprocessing maps.
-    workers: Dict[int, mp.Process] = {}
     devices: Dict[int, torch.device] = {}
-    pipes: Dict[int, Pipe] = {}
 
-    # Set spawn start method for compatibility with torch.
-    mp.set_start_method("spawn")
+    # Keeps initialized policies ready for births, and reuses dead ones.
+    device = torch.device("cuda:0" if config.cuda else "cpu")
+    factory = PolicyFactory(config, env.observation_space, env.action_space, device)
+
+    # Writes checkpoints in the background.
+    writer = CheckpointWriter(save_dir)
+
+    # Records columnar env state in the background, if enabled.
+    state_log: Optional[StateLogWriter] = None
+    if config.state_log_interval > 0:
+        state_log = StateLogWriter(
+            setup.state_log_dir, config.state_log_interval, config.state_log_chunk_size
+        )
+
+    # Stacked policy weights for batched forward passes when ``config.mp`` is off.
+    policy_stack = PolicyStack()
+
+    # Set spawn start method for compatibility with torch, unless an earlier call
+    # to ``train()`` in this process already has.
+    if mp.get_start_method(allow_none=True) != "spawn":
+        mp.set_start_method("spawn", force=True)
+
+    # Worker processes which host the policies when ``config.mp`` is on.
+    pool: Optional[WorkerPool] = None
+    if config.mp:
+        pool = WorkerPool(config, env.observation_space.shape, env.action_space.n)
 
     # TODO: Implement this.
     if args.load_from:
@@ -147,14 +169,15 @@ def train(args: argparse.Namespace) -> float:
 
         # Load in multiagent maps.
         agents = trainer_state["agents"]
-        rollout_map = trainer_state["rollout_map"]
+        rollout_map = {
+            agent_id: factory.adopt(agents[agent_id], rollouts)
+            for agent_id, rollouts in trainer_state["rollout_map"].items()
+        }
         minted_agents = trainer_state["minted_agents"]
         metrics = trainer_state["metrics"]
 
-        # Load in dead objects.
-        dead_agents = trainer_state["dead_agents"]
-        state_dicts = trainer_state["state_dicts"]
-        optim_state_dicts = trainer_state["optim_state_dicts"]
+        # Load in initial parameters for reuse in new policies.
+        factory.bank = trainer_state["init_bank"]
 
         # Don't reset environment if we are resuming a previous run.
         obs = {agent_id: agent.observation for agent_id, agent in env.agents.items()}
@@ -162,44 +185,34 @@ def train(args: argparse.Namespace) -> float:
     else:
         obs = env.reset()
 
+    # Start filling the reserve of policies only once the init bank is loaded.
+    factory.start()
+
     # Initialize first policies.
     env_done = False
     step_ema = 1.0
     last_time = time.time()
     for agent_id, ob in obs.items():
-        agent, rollouts, worker, device, pipe = get_agent(
+        agent, rollouts, device = get_agent(
             agent_id,
             env.iteration,
             env.agents[agent_id].age,
             ob,
             config,
-            env.observation_space,
-            env.action_space,
+            factory,
             agents,
             rollout_map,
-            dead_agents,
-            dead_pipes,
-            state_dicts,
-            optim_state_dicts,
+            pool,
+            start=env.iteration % config.num_steps,
         )
 
-        # Optionally save a copy of each state dict for reuse in dead policies.
-        if config.reuse_state_dicts and agent_id not in agents:
-            state_dict = agent.actor_critic.state_dict()
-            optim_state_dict = agent.optimizer.state_dict()
-            state_dicts.append(copy.deepcopy(state_dict))
-            optim_state_dicts.append(copy.deepcopy(optim_state_dict))
-
         # Copy first observations to rollouts, and send to device.
         if not config.mp:
-            initial_observation = torch.FloatTensor([ob])
-            rollouts.obs[0].copy_(initial_observation)
+            rollouts.obs[rollouts.step, 0].copy_(torch.as_tensor(ob))
             rollouts.to(device)
 
         agents[agent_id] = agent
-        workers[agent_id] = worker
         devices[agent_id] = device
-        pipes[agent_id] = pipe
         rollout_map[agent_id] = rollouts
 
     # Whether or not we make a weight update on this iteration.
@@ -216,51 +229,48 @@ def train(args: argparse.Namespace) -> float:
         timestep_scores: Dict[int, float] = {}
 
         # Get actions.
-        if config.mp:
-            for agent_id in pipes:
-                action_dict[agent_id] = pipes[agent_id].action_spout.recv()
+        if pool is not None:
+            # Hands births to the workers, and lets them make a forward pass.
+            pool.flush()
+            action_dict = pool.recv_actions()
         else:
             decay = config.use_linear_lr_decay and backward_pass
-            for agent_id in agents:
-                act_map[agent_id] = act(
-                    env.iteration,
-                    decay,
-                    agents[agent_id],
-                    rollout_map[agent_id],
-                    config,
-                    env.agents[agent_id].age,
-                    None,
-                )
-                action_dict[agent_id] = int(act_map[agent_id][1][0])
+            ages = {agent_id: env.agents[agent_id].age for agent_id in agents}
+            act_map = act_batch(
+                decay, agents, rollout_map, config, ages, policy_stack
+            )
+            for agent_id, act_returns in act_map.items():
+                action_dict[agent_id] = int(act_returns[1][0])
 
         # Execute environment step.
         obs, rewards, dones, infos = env.step(action_dict)
-        backward_pass = env.iteration % config.num_steps == 0 and env.iteration > 0
+        backward_pass = (env.iteration + 1) % config.num_steps == 0
 
         # TODO: Check for keyerror: for agent_id in obs:
-        if config.mp:
-            for agent_id in pipes:
-                pipes[agent_id].env_funnel.send(
-                    (
-                        env.iteration,
-                        obs[agent_id],
-                        rewards[agent_id],
-                        dones[agent_id],
-                        infos[agent_id],
-                        backward_pass,
-                    )
-                )
-
-        # Write env state and metrics to log.
-        env.log_state(env_log, visual_log)
-        metrics_log.write(str(metrics.get_summary()) + "\n")
+        if pool is not None:
+            pool.send_env(env.iteration, obs, rewards, dones, infos, backward_pass)
+
+        # Write env state and metrics to the binary log, and to the text logs only
+        # every ``config.text_log_interval`` steps since formatting them is slow.
+        if state_log is not None:
+            state_log.record(env, metrics)
+        text_log_interval = config.text_log_interval
+        if text_log_interval > 0 and env.iteration % text_log_interval == 0:
+            env.log_state(env_log)
+            metrics_log.write(str(metrics.get_summary()) + "\n")
+
+        # Frames are only built when printed or due for the visual log.
+        render_interval = config.render_interval
+        if render_interval > 0 and env.iteration % render_interval == 0:
+            env.render(visual_log)
+        else:
+            env.render()
 
         # Update the policy score.
         if (env.iteration + 1) % config.policy_score_frequency == 0:
             # TODO: Check for keyerror: for agent_id in infos:
-            if config.mp:
-                for agent_id in pipes:
-                    timestep_scores[agent_id] = pipes[agent_id].action_dist_spout.recv()
+            if pool is not None:
+                timestep_scores = pool.recv_policy_scores()
             else:
                 for agent_id in act_map:
                     action_dist = act_map[agent_id][4]
@@ -281,6 +291,12 @@ def train(args: argparse.Namespace) -> float:
                 args.trial.report(metrics.policy_score, env.iteration)
                 if args.trial.should_prune() or metrics.policy_score == float("inf"):
                     print("\nEnding training because ``policy_score_loss`` diverged.")
+                    if pool is not None:
+                        pool.close()
+                    factory.close()
+                    writer.close()
+                    if state_log is not None:
+                        state_log.close()
                     return metrics.policy_score
 
         step_ema = (config.ema_alpha * step_ema) + (
@@ -298,6 +314,10 @@ def train(args: argparse.Namespace) -> float:
         print("Step EMA: %.6f" % step_ema, end="")
         print("||||||", end=end)
 
+        # Transitions of living agents, which are inserted into their rollouts
+        # together once births and deaths are handled.
+        insert_ids: List[int] = []
+
         # Agent creation and termination, rollout stacking.
         for agent_id in obs:
             ob = obs[agent_id]
@@ -305,59 +325,54 @@ def train(args: argparse.Namespace) -> float:
             done = dones[agent_id]
             info = infos[agent_id]
 
-            # Initialize new policies.
+            # Initialize new policies, which take their first step on the next
+            # iteration.
             if agent_id not in agents:
-                agent, rollouts, worker, device, pipe = get_agent(
+                agent, rollouts, device = get_agent(
                     agent_id,
                     env.iteration,
                     env.agents[agent_id].age,
                     ob,
                     config,
-                    env.observation_space,
-                    env.action_space,
+                    factory,
                     agents,
                     rollout_map,
-                    dead_agents,
-                    dead_pipes,
-                    state_dicts,
-                    optim_state_dicts,
+                    pool,
+                    start=(env.iteration + 1) % config.num_steps,
                 )
 
                 # Copy first observations to rollouts, and send to device.
                 if not config.mp:
-                    initial_observation = torch.FloatTensor([ob])
-                    rollouts.obs[0].copy_(initial_observation)
+                    rollouts.obs[rollouts.step, 0].copy_(torch.as_tensor(ob))
                     rollouts.to(device)
 
                 agents[agent_id] = agent
-                workers[agent_id] = worker
                 devices[agent_id] = device
-                pipes[agent_id] = pipe
                 rollout_map[agent_id] = rollouts
                 minted_agents.add(agent_id)
 
-                # Optionally save a copy of each state dict for reuse in dead policies.
-                if config.reuse_state_dicts:
-                    state_dict = agent.actor_critic.state_dict()
-                    optim_state_dict = agent.optimizer.state_dict()
-                    state_dicts.append(copy.deepcopy(state_dict))
-                    optim_state_dicts.append(copy.deepcopy(optim_state_dict))
-
             else:
 
                 # If done then remove from environment.
                 if done:
+                    # Hand the dead policy and rollouts back for reuse.
                     agent = agents.pop(agent_id)
-                    # TODO: Should we save a reference to dead ``rollouts``?
-                    # TODO: Does garbage collection get these? Use ``del``?
-                    rollout_map.pop(agent_id)
-                    pipes.pop(agent_id)
-                    dead_agents.add(agent)
+                    rollouts = rollout_map.pop(agent_id)
+                    if pool is not None:
+                        pool.remove_agent(agent_id)
+                    factory.release(agent, rollouts)
 
                 elif not config.mp:
-                    rollouts = rollout_map[agent_id]
-                    fwds = act_map[agent_id]
-                    stack_rollouts(rollouts, ob, reward, done, info, fwds)
+                    insert_ids.append(agent_id)
+
+        insert_batch(
+            [rollout_map[agent_id] for agent_id in insert_ids],
+            [obs[agent_id] for agent_id in insert_ids],
+            [act_map[agent_id] for agent_id in insert_ids],
+            [rewards[agent_id] for agent_id in insert_ids],
+            [dones[agent_id] for agent_id in insert_ids],
+            ["bad_transition" in infos[agent_id] for agent_id in insert_ids],
+        )
 
         # Print out environment state.
         if all(dones.values()):
@@ -365,24 +380,31 @@ def train(args: argparse.Namespace) -> float:
                 print("All agents have died.")
             env_done = True
 
-        # Only update losses and save on backward passes.
-        if env.iteration % config.num_steps == 0 and env.iteration > 0:
+        # Only update losses and save on backward passes, once the rollouts are full.
+        if backward_pass:
 
             value_losses: Dict[int, float] = {}
             action_losses: Dict[int, float] = {}
             dist_entropies: Dict[int, float] = {}
 
             # Should we iterate over a different object?
-            for agent_id, agent in agents.items():
-                if agent_id not in minted_agents:
-                    if config.mp:
-                        losses = pipes[agent_id].loss_spout.recv()
-                    else:
-                        rollouts = rollout_map[agent_id]
-                        losses = update(agent, rollouts, config)
-                    value_losses[agent_id] = losses[0]
-                    action_losses[agent_id] = losses[1]
-                    dist_entropies[agent_id] = losses[2]
+            loss_map: Dict[int, Tuple[float, float, float]] = {}
+            if pool is not None:
+                loss_map = pool.recv_losses()
+            else:
+                updated_agents = {
+                    agent_id: agent
+                    for agent_id, agent in agents.items()
+                    if agent_id not in minted_agents
+                }
+                loss_map = update_batch(updated_agents, rollout_map, config)
+            for agent_id, losses in loss_map.items():
+                value_losses[agent_id] = losses[0]
+                action_losses[agent_id] = losses[1]
+                dist_entropies[agent_id] = losses[2]
+
+            # Weights have changed, so the stacked policy weights are stale.
+            policy_stack.invalidate()
 
             metrics = update_losses(
                 env=env,
@@ -398,11 +420,10 @@ def train(args: argparse.Namespace) -> float:
         if save_state or env.iteration == config.time_steps - 1:
 
             # Update ``agents`` and ``rollouts`` from worker processes.
-            if config.mp:
-                for agent_id, agent in agents.items():
-                    agent, rollouts = pipes[agent_id].save_spout.recv()
+            if pool is not None:
+                for agent_id, (agent, rollouts) in pool.recv_saves().items():
                     agents[agent_id] = agent
-                    rollout_map[agent_id] = rollouts
+                    rollout_map[agent_id].copy_(rollouts)
 
             # Save trainer state objects
             trainer_state = {
@@ -410,17 +431,14 @@ def train(args: argparse.Namespace) -> float:
                 "rollout_map": rollout_map,
                 "minted_agents": minted_agents,
                 "metrics": metrics,
-                "dead_agents": dead_agents,
-                "state_dicts": state_dicts,
-                "optim_state_dicts": optim_state_dicts,
+                "init_bank": factory.bank,
             }
-            trainer_state_path = os.path.join(save_dir, "%s_trainer.pkl" % codename)
-            with open(trainer_state_path, "wb") as trainer_file:
-                pickle.dump(trainer_state, trainer_file)
+            trainer_state_path = os.path.join(save_dir, "%s_trainer.ckpt" % codename)
+            writer.save(trainer_state_path, trainer_state)
 
             # Save out environment state.
-            state_path = os.path.join(save_dir, "%s_env.pkl" % codename)
-            env.save(state_path)
+            state_path = os.path.join(save_dir, "%s_env.ckpt" % codename)
+            env.save(state_path, writer)
 
             # Save out settings, removing log files (not paths) from object.
             settings_path = os.path.join(save_dir, "%s_settings.json" % codename)
@@ -435,59 +453,63 @@ def train(args: argparse.Namespace) -> float:
     # Prints a single line to reset carriage.
     print("")
 
+    if pool is not None:
+        pool.close()
+    factory.close()
+    writer.close()
+    if state_log is not None:
+        state_log.close()
+
     return metrics.policy_score
 
 
-# TODO: Consider calling these functions in ``worker.py`` as well.
-def stack_rollouts(
-    rollouts: RolloutStorage,
-    ob: torch.Tensor,
-    reward: float,
-    done: bool,
-    info: Dict[str, Any],
-    fwds: Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor,],
-) -> None:
-    # Shape correction and casting.
-    # TODO: Change names so everything is statically-typed.
-    observation = torch.FloatTensor([ob])
-    reward = torch.FloatTensor([reward])
-    masks, bad_masks = get_masks(done, info)
-
-    # These are all CUDA tensors (on device).
-    value: torch.Tensor = fwds[0]
-    action: torch.Tensor = fwds[1]
-    action_log_prob: torch.Tensor = fwds[2]
-    recurrent_hidden_states: torch.Tensor = fwds[3]
-
-    # Add to rollouts.
-    rollouts.insert(
-        observation,
-        recurrent_hidden_states,
-        action,
-        action_log_prob,
-        value,
-        reward,
-        masks,
-        bad_masks,
-    )
-
-
-def update(
-    agent: Algo, rollouts: RolloutStorage, config: Config
-) -> Tuple[float, float, float]:
-    with torch.no_grad():
-        next_value = agent.actor_critic.get_value(
-            rollouts.obs[-1], rollouts.recurrent_hidden_states[-1], rollouts.masks[-1],
-        ).detach()
-    rollouts.compute_returns(
-        next_value,
-        config.use_gae,
-        config.gamma,
-        config.gae_lambda,
-        config.use_proper_time_limits,
-    )
-
-    # Compute weight updates.
-    value_loss, action_loss, dist_entropy = agent.update(rollouts)
-
-    return value_loss, action_loss, dist_entropy
+def update_batch(
+    agents: Dict[int, Algo], rollout_map: Dict[int, RolloutStorage], config: Config
+) -> Dict[int, Tuple[float, float, float]]:
+    """
+    Computes weight updates for all of ``agents``, and readies their rollouts for
+    the next rollout. Agents which share a policy architecture are updated together
+    by a ``PopulationPPO``, and all others are updated one at a time with
+    ``update()``. Steps taken before an agent was born are left out.
+
+    Parameters
+    ----------
+    agents : ``Dict[int, Algo]``.
+        The agents to update, keyed by agent id.
+    rollout_map : ``Dict[int, RolloutStorage]``.
+        Rollouts of every agent, keyed by agent id.
+    config : ``Config``.
+        Config object parsed from settings file.
+
+    Returns
+    -------
+    loss_map : ``Dict[int, Tuple[float, float, float]]``.
+        The value loss, action loss and distribution entropy of each agent.
+    """
+    groups, unbatched = group_agents(agents)
+    loss_map: Dict[int, Tuple[float, float, float]] = {}
+    for agent_ids in groups:
+        population = PopulationPPO([agents[agent_id] for agent_id in agent_ids])
+        rollouts_list = [rollout_map[agent_id] for agent_id in agent_ids]
+        with torch.no_grad():
+            next_values = population.get_values(
+                stack_rollouts(rollouts_list, "obs", -1).float(),
+                stack_rollouts(rollouts_list, "recurrent_hidden_states", -1),
+                stack_rollouts(rollouts_list, "masks", -1),
+            )
+        compute_returns_batch(
+            rollouts_list,
+            next_values,
+            config.use_gae,
+            config.gamma,
+            config.gae_lambda,
+            config.use_proper_time_limits,
+        )
+        loss_map.update(zip(agent_ids, population.update(rollouts_list)))
+        for rollouts in rollouts_list:
+            rollouts.after_update()
+
+    for agent_id in unbatched:
+        loss_map[agent_id] = update(agents[agent_id], rollout_map[agent_id], config)
+
+    return loss_map
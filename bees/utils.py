@@ -33,6 +33,21 @@ def one_hot(k: int, dim: int) -> np.ndarray:
     return vec
 
 
+def available_cpus() -> List[int]:
+    """
+    Returns the CPUs the current process may run on, which are fewer than all
+    CPUs when the process has been pinned, e.g. by ``optimize.py``.
+
+    Returns
+    -------
+    cpus : ``List[int]``.
+        Sorted CPU indices.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
 def get_token(save_root: str) -> str:
     """
     Creates and returns a new token for saving and loading runs.
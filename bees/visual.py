@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Vectorized ASCII rendering of the environment grid. """
+from typing import Iterable
+
+import numpy as np
+
+# Separates the grid from the statistics in each frame.
+ANCHOR = "===LOGPLAY_ANCHOR==="
+
+
+def render_grid(agent_mask: np.ndarray, food_mask: np.ndarray) -> str:
+    """
+    Renders a grid with one row of characters per ``y`` coordinate, where squares
+    with an agent are ``B``, squares with only food are ``*``, and empty squares are
+    ``_``. The whole grid is built as one character array and decoded once.
+
+    Parameters
+    ----------
+    agent_mask : ``np.ndarray``.
+        Whether each square holds an agent.
+        Shape: ``(width, height)``.
+    food_mask : ``np.ndarray``.
+        Whether each square holds food.
+        Shape: ``(width, height)``.
+
+    Returns
+    -------
+    grid : ``str``.
+        The rendered grid, with every character followed by a space and every row
+        followed by a newline.
+    """
+    width, height = agent_mask.shape
+    cells = np.where(agent_mask, ord("B"), np.where(food_mask, ord("*"), ord("_")))
+    chars = np.full((height, 2 * width + 1), ord(" "), dtype=np.uint8)
+    chars[:, 0 : 2 * width : 2] = cells.T
+    chars[:, -1] = ord("\n")
+    return chars.tobytes().decode("ascii")
+
+
+def render_frame(
+    agent_mask: np.ndarray,
+    food_mask: np.ndarray,
+    iteration: int,
+    num_living_agents: int,
+    num_foods: int,
+    agent_lines: Iterable[str] = (),
+    print_stats: bool = True,
+) -> str:
+    """
+    Renders a frame of the visual log: the grid, followed by the statistics of some
+    agents and of the whole environment.
+
+    Parameters
+    ----------
+    agent_mask : ``np.ndarray``.
+        Whether each square holds an agent.
+        Shape: ``(width, height)``.
+    food_mask : ``np.ndarray``.
+        Whether each square holds food.
+        Shape: ``(width, height)``.
+    iteration : ``int``.
+        The step of the frame.
+    num_living_agents : ``int``.
+        Number of agents with positive health.
+    num_foods : ``int``.
+        Number of foods in the grid.
+    agent_lines : ``Iterable[str]``, optional.
+        Lines of statistics for individual agents, each ending with a newline.
+    print_stats : ``bool``, optional.
+        Whether to include the agent and environment statistics.
+
+    Returns
+    -------
+    frame : ``str``.
+        ASCII image of the grid along with the statistics.
+    """
+    output = "\n" + render_grid(agent_mask, food_mask) + "\n" + ANCHOR + "\n\n"
+    if print_stats:
+        output += "".join(agent_lines)
+        output += "Num living agents: %d.\n" % num_living_agents
+        output += "Num foods: %d.\n" % num_foods
+        output += "\n"
+    output += "Step: %d\n" % iteration
+    return output
@@ -1,25 +1,23 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-""" Distributed training function for a single agent worker. """
+""" Distributed training function for worker processes hosting many agents. """
 import copy
-from typing import Dict, Tuple, Any, Optional
-from multiprocessing.connection import Connection
+from typing import Dict, List, Tuple, Any
 
 import torch
 import torch.nn.functional as F
-
-import numpy as np
+import torch.multiprocessing as mp
 
 from bees.rl import utils
-from bees.rl.storage import RolloutStorage
+from bees.rl.storage import RolloutStorage, insert_batch, stack_rollouts
 from bees.rl.algo.algo import Algo
+from bees.rl.batch import PolicyStack
 
+from bees.pipe import Pipe
 from bees.config import Config
 
 # pylint: disable=duplicate-code
 
-STOP_FLAG = 999
-
 # TODO: Consider using Ray for multiprocessing, which is supposedly around 10x faster.
 
 
@@ -34,159 +32,181 @@ def get_policy_score(action_dist: torch.Tensor, info: Dict[str, Any]) -> float:
     return timestep_score
 
 
-def get_masks(done: bool, info: Dict[str, Any]) -> Tuple[torch.Tensor, torch.Tensor]:
-    """ Compute masks to insert into ``rollouts``. """
-    # If done then clean the history of observations.
-    if done:
-        masks = torch.FloatTensor([[0.0]])
-    else:
-        masks = torch.FloatTensor([[1.0]])
-    if "bad_transition" in info.keys():
-        bad_masks = torch.FloatTensor([[0.0]])
-    else:
-        bad_masks = torch.FloatTensor([[1.0]])
-
-    return masks, bad_masks
-
-
-# TODO: Consider adding ``age`` as an attribute of ``agent: Algo``.
-def act(
-    iteration: int,
+def act_batch(
     decay: bool,
-    agent: Algo,
-    rollouts: RolloutStorage,
+    agents: Dict[int, Algo],
+    rollout_map: Dict[int, RolloutStorage],
     config: Config,
-    age: int,
-    action_funnel: Optional[Connection],
-) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
-    """ Make a forward pass and send the env action to the leader process. """
-    # Should execute only when trainer would make an update/backward pass.
+    ages: Dict[int, int],
+    policy_stack: PolicyStack,
+) -> Dict[
+    int, Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]
+]:
+    """
+    Make a single batched forward pass for all agents in the leader process, from
+    the current step of each of their rollouts.
+    """
     if decay:
-        min_agent_lifetime = 1.0 / config.aging_rate
-
-        # Decrease learning rate linearly.
-        learning_rate = utils.update_linear_schedule(
-            agent.optimizer,
-            age,
-            min_agent_lifetime,
-            agent.optimizer.lr if config.algo == "acktr" else config.lr,
-            config.min_lr,
-        )
-        agent.lr = learning_rate
-
-    # Rollout tensors have dimension ``0`` size of ``config.num_steps``.
-    rollout_index = iteration % config.num_steps
+        for agent_id, agent in agents.items():
+            decay_learning_rate(agent, config, ages[agent_id])
+
+    if not agents:
+        return {}
+    agent_ids = list(agents)
+    rollouts_list: List[RolloutStorage] = [rollout_map[i] for i in agent_ids]
+    steps = [rollouts.step for rollouts in rollouts_list]
     with torch.no_grad():
-        act_returns = agent.actor_critic.act(
-            rollouts.obs[rollout_index],
-            rollouts.recurrent_hidden_states[rollout_index],
-            rollouts.masks[rollout_index],
+        act_returns = policy_stack.act(
+            agent_ids,
+            [agents[agent_id].actor_critic for agent_id in agent_ids],
+            stack_rollouts(rollouts_list, "obs", steps).float(),
+            stack_rollouts(rollouts_list, "recurrent_hidden_states", steps),
+            stack_rollouts(rollouts_list, "masks", steps),
         )
 
-        # Get integer action to pass to ``env.step()``.
-        env_action: int = int(act_returns[1][0])
+    return dict(zip(agent_ids, act_returns))
 
-    # Send ``env_action: int`` back to leader to execute step.
-    if config.mp and action_funnel:
-        action_funnel.send(env_action)
 
-    return act_returns
-
-
-def worker_loop(
-    device: torch.device,
-    agent: Algo,
-    rollouts: RolloutStorage,
-    config: Config,
-    initial_age: int,
-    initial_iteration: int,
-    initial_ob: np.ndarray,
-    env_spout: Connection,
-    action_funnel: Connection,
-    action_dist_funnel: Connection,
-    loss_funnel: Connection,
-    save_funnel: Connection,
-) -> None:
-    """ Training loop for a single agent worker. """
-    age: int = initial_age
-    iteration: int = initial_iteration
+def update(
+    agent: Algo, rollouts: RolloutStorage, config: Config
+) -> Tuple[float, float, float]:
+    """
+    Computes returns and a weight update for ``agent`` from the steps it has taken
+    since the start of ``rollouts``, and readies them for the next rollout.
+    """
+    with torch.no_grad():
+        next_value = agent.actor_critic.get_value(
+            rollouts.get_obs(-1),
+            rollouts.recurrent_hidden_states[-1],
+            rollouts.masks[-1],
+        ).detach()
+    rollouts.compute_returns(
+        next_value,
+        config.use_gae,
+        config.gamma,
+        config.gae_lambda,
+        config.use_proper_time_limits,
+    )
 
-    # Copy first observations to rollouts, and send to device.
-    initial_observation: torch.Tensor = torch.FloatTensor([initial_ob])
-    rollouts.obs[0].copy_(initial_observation)
-    rollouts.to(device)
+    # Compute weight updates from the steps the agent has taken.
+    value_loss, action_loss, dist_entropy = agent.update(rollouts.since_start())
+    rollouts.after_update()
 
-    decay: bool = config.use_linear_lr_decay
+    return value_loss, action_loss, dist_entropy
 
-    # Initial forward pass.
-    fwds = act(iteration, decay, agent, rollouts, config, age, action_funnel)
 
-    while True:
+def decay_learning_rate(agent: Algo, config: Config, age: int) -> None:
+    """ Decrease learning rate linearly over the minimum agent lifetime. """
+    min_agent_lifetime = 1.0 / config.aging_rate
+    learning_rate = utils.update_linear_schedule(
+        agent.optimizer,
+        age,
+        min_agent_lifetime,
+        agent.optimizer.lr if config.algo == "acktr" else config.lr,
+        config.min_lr,
+    )
+    agent.lr = learning_rate
 
-        # These are all CUDA tensors (on device).
-        value: torch.Tensor = fwds[0]
-        action: torch.Tensor = fwds[1]
-        action_log_prob: torch.Tensor = fwds[2]
-        recurrent_hidden_states: torch.Tensor = fwds[3]
-        action_dist: torch.Tensor = fwds[4]
 
-        # Grab iteration index and env output from leader (no tensors included).
-        iteration, ob, reward, done, info, backward_pass = env_spout.recv()
+def worker_loop(
+    device: torch.device, config: Config, pipe: Pipe, num_threads: int = 1
+) -> None:
+    """
+    Training loop for a worker process which hosts the policies of many agents.
+    Agents are added by birth messages from the leader and removed when the leader
+    reports them done. Each step, the worker makes one batched forward pass for all
+    of its agents, and then inserts the environment output into their rollouts.
+    The worker uses ``num_threads`` torch threads, and exits with an error if the
+    leader dies while it is waiting.
+    """
+    torch.set_num_threads(num_threads)
+    leader = mp.parent_process()
+    leader_is_alive = leader.is_alive if leader is not None else None
+
+    agents: Dict[int, Algo] = {}
+    rollout_map: Dict[int, RolloutStorage] = {}
+    rows: Dict[int, int] = {}
+    ages: Dict[int, int] = {}
+    policy_stack = PolicyStack()
+    iteration = 0
+    decay = False
 
-        # Get updated age from env.
-        age = info["age"]
+    while True:
 
+        # Wait for births, which are sent after the leader has handled a step.
+        stop, messages = pipe.recv_control(leader_is_alive)
+        if stop:
+            break
+        for _, agent_id, row, agent, rollouts, age, iteration, initial_ob in messages:
+
+            # Copy first observations to rollouts, and send to device.
+            rollouts.obs[rollouts.step, 0].copy_(torch.as_tensor(initial_ob))
+            rollouts.to(device)
+            if config.use_linear_lr_decay:
+                decay_learning_rate(agent, config, age)
+
+            agents[agent_id] = agent
+            rollout_map[agent_id] = rollouts
+            rows[agent_id] = row
+            ages[agent_id] = age
+
+        # Make a forward pass and send the actions to the leader.
+        act_map = act_batch(decay, agents, rollout_map, config, ages, policy_stack)
+        actions = pipe.slots["actions"]
+        for agent_id, act_returns in act_map.items():
+            actions[rows[agent_id]] = int(act_returns[1][0])
+        pipe.send_actions()
+
+        # Grab iteration index and env output from leader's shared-memory tables.
+        iteration, backward_pass = pipe.recv_env(leader_is_alive)
         decay = config.use_linear_lr_decay and backward_pass
+        env_outputs = {agent_id: pipe.read_env(row) for agent_id, row in rows.items()}
 
         # Update the policy score.
         if (iteration + 1) % config.policy_score_frequency == 0:
-            timestep_score = get_policy_score(action_dist, info)
-            action_dist_funnel.send(timestep_score)
-
-        # If done then remove from environment.
-        if done:
-            break
-
-        # Shape correction and casting.
-        # TODO: Change names so everything is statically-typed.
-        observation = torch.FloatTensor([ob])
-        reward = torch.FloatTensor([reward])
-        masks, bad_masks = get_masks(done, info)
-
-        # Add to rollouts.
-        rollouts.insert(
-            observation,
-            recurrent_hidden_states,
-            action,
-            action_log_prob,
-            value,
-            reward,
-            masks,
-            bad_masks,
+            scores = pipe.slots["policy_scores"]
+            for agent_id, (_, _, _, info) in env_outputs.items():
+                action_dist = act_map[agent_id][4]
+                scores[rows[agent_id]] = get_policy_score(action_dist, info)
+            pipe.send_policy_scores()
+
+        live_ids: List[int] = []
+        for agent_id, (_, _, done, info) in env_outputs.items():
+
+            # Get updated age from env.
+            ages[agent_id] = info["age"]
+
+            # If done then remove from environment.
+            if done:
+                del agents[agent_id]
+                del rollout_map[agent_id]
+                del rows[agent_id]
+                del ages[agent_id]
+                continue
+            live_ids.append(agent_id)
+
+        # Add to rollouts. This copies observations out of the shared table.
+        insert_batch(
+            [rollout_map[agent_id] for agent_id in live_ids],
+            [env_outputs[agent_id][0] for agent_id in live_ids],
+            [act_map[agent_id] for agent_id in live_ids],
+            [env_outputs[agent_id][1] for agent_id in live_ids],
+            [env_outputs[agent_id][2] for agent_id in live_ids],
+            ["bad_transition" in env_outputs[agent_id][3] for agent_id in live_ids],
         )
 
         # Only when trainer would make an update/backward pass.
+        losses: Dict[int, Tuple[float, float, float]] = {}
         if backward_pass:
-            with torch.no_grad():
-                next_value = agent.actor_critic.get_value(
-                    rollouts.obs[-1],
-                    rollouts.recurrent_hidden_states[-1],
-                    rollouts.masks[-1],
-                ).detach()
-            rollouts.compute_returns(
-                next_value,
-                config.use_gae,
-                config.gamma,
-                config.gae_lambda,
-                config.use_proper_time_limits,
-            )
-
-            # Compute weight updates.
-            value_loss, action_loss, dist_entropy = agent.update(rollouts)
-            rollouts.after_update()
-
-            # Send losses back to leader for ``update_losses()``.
-            loss_funnel.send((value_loss, action_loss, dist_entropy))
+            for agent_id in live_ids:
+                losses[agent_id] = update(
+                    agents[agent_id], rollout_map[agent_id], config
+                )
+
+        # Send losses back to leader for ``update_losses()``.
+        if backward_pass:
+            policy_stack.invalidate()
+            pipe.loss_funnel.send(losses)
 
         # Send state back to the leader.
         save_state: bool = iteration % config.save_interval == 0
@@ -194,9 +214,8 @@ def worker_loop(
 
             # This is becuase torch.multiprocessing will not allow you to send a tensor
             # created in another process to a different process.
-            agent_copy = copy.deepcopy(agent)
-            rollouts_copy = copy.deepcopy(rollouts)
-            save_funnel.send((agent_copy, rollouts_copy))
-
-        # Make a forward pass.
-        fwds = act(iteration, decay, agent, rollouts, config, age, action_funnel)
+            saves = {
+                agent_id: (copy.deepcopy(agent), copy.deepcopy(rollout_map[agent_id]))
+                for agent_id, agent in agents.items()
+            }
+            pipe.save_funnel.send(saves)
@@ -2,42 +2,219 @@
 # -*- coding: utf-8 -*-
 """ Script for optimizing GPST model hyperparameters via Optuna. """
 import os
+import sys
 import json
+import time
 import shutil
 import logging
 import argparse
-import tempfile
 import datetime
+import functools
+import subprocess
+from typing import Dict, Any, Union
 
 import optuna
 
 from bees.trainer import train
+from bees.utils import available_cpus
 
 # pylint: disable=bad-continuation
 
 LOG_DIR = "logs"
 
+# Seconds between checks for finished trial processes.
+POLL_INTERVAL = 1.0
+
+
+def get_storage(storage: str) -> Union[str, optuna.storages.BaseStorage]:
+    """
+    Returns the storage of a study. Database URLs such as ``sqlite:///study.db``
+    are passed to Optuna as is, and anything else is the path of a journal file,
+    which many processes on one machine can share without a database server.
+    """
+    if "://" in storage:
+        return storage
+    try:
+        # pylint: disable=import-outside-toplevel
+        from optuna.storages.journal import JournalFileBackend as JournalFile
+    except ImportError:
+        # Older versions of Optuna.
+        from optuna.storages import JournalFileStorage as JournalFile
+    return optuna.storages.JournalStorage(JournalFile(storage))
+
+
 def main() -> None:
-    """ Run an Optuna study. """
+    """ Run an Optuna study, with each trial in its own process. """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--trials", type=int, default=100, help="Number of trials to run."
+    )
+    parser.add_argument(
+        "--cpus-per-trial",
+        type=int,
+        default=2,
+        help="CPUs each trial is pinned to, which is also its number of threads.",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=0,
+        help="Number of concurrent trials. Defaults to as many as there are CPUs for.",
+    )
+    parser.add_argument(
+        "--storage",
+        default=os.path.join(LOG_DIR, "optuna.journal"),
+        help="Database URL, or path of a journal file, holding the study.",
+    )
+    parser.add_argument("--study-name", default="bees", help="Name of the study.")
+    parser.add_argument(
+        "--save-root",
+        default="./models/optuna/",
+        help="Directory in which each trial gets its own save root.",
+    )
+    parser.add_argument(
+        "--keep-models", action="store_true", help="Keep the saves of each trial."
+    )
+    parser.add_argument(
+        "--trial-cpus", default="", help="Internal: run one trial on these CPUs."
+    )
+    args = parser.parse_args()
+
+    if args.trial_cpus:
+        run_trial(args)
+    else:
+        run_sweep(args)
+
+
+def run_sweep(args: argparse.Namespace) -> None:
+    """
+    Runs ``args.trials`` trials of a study, keeping up to ``args.jobs`` trial
+    processes running, each pinned to its own ``args.cpus_per_trial`` CPUs.
+    """
     datestring = str(datetime.datetime.now())
     datestring = datestring.replace(" ", "_")
     logging.getLogger().setLevel(logging.INFO)  # Setup the root logger.
     if not os.path.isdir(LOG_DIR):
         os.makedirs(LOG_DIR)
     log_path = os.path.join(LOG_DIR, "optuna_%s.log" % datestring)
-    logging.getLogger().addHandler(
-        logging.FileHandler(log_path)
-
-    )
+    logging.getLogger().addHandler(logging.FileHandler(log_path))
     optuna.logging.enable_propagation()  # Propagate logs to the root logger.
     # optuna.logging.disable_default_handler()  # Stop showing logs in stderr.
 
-    study = optuna.create_study(pruner=optuna.pruners.MedianPruner())
-    logging.getLogger().info("Start optimization.")
-    study.optimize(objective, n_trials=3e9)
+    optuna.create_study(
+        study_name=args.study_name,
+        storage=get_storage(args.storage),
+        pruner=optuna.pruners.MedianPruner(),
+        load_if_exists=True,
+    )
+
+    # Split the available CPUs into one disjoint slot per concurrent trial.
+    cpus = available_cpus()
+    cpus_per_trial = max(1, min(args.cpus_per_trial, len(cpus)))
+    num_slots = len(cpus) // cpus_per_trial
+    if args.jobs > 0:
+        num_slots = min(num_slots, args.jobs)
+    slots = [
+        cpus[i * cpus_per_trial : (i + 1) * cpus_per_trial] for i in range(num_slots)
+    ]
+    logging.getLogger().info(
+        "Start optimization with %d concurrent trials on CPUs %s.", num_slots, slots
+    )
+
+    # Trial processes run this script from its directory, whatever the caller's.
+    storage = args.storage
+    if "://" not in storage:
+        storage = os.path.abspath(storage)
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    if not os.path.isdir(args.save_root):
+        os.makedirs(args.save_root)
+
+    running: Dict[int, subprocess.Popen] = {}
+    num_launched = 0
+    while num_launched < args.trials or running:
+
+        # Start a trial in every free slot.
+        for slot, slot_cpus in enumerate(slots):
+            if slot in running or num_launched >= args.trials:
+                continue
+            command = [
+                sys.executable,
+                os.path.abspath(__file__),
+                "--trial-cpus",
+                ",".join(str(cpu) for cpu in slot_cpus),
+                "--storage",
+                storage,
+                "--study-name",
+                args.study_name,
+                "--save-root",
+                os.path.abspath(args.save_root),
+            ]
+            if args.keep_models:
+                command.append("--keep-models")
+
+            # Limit native thread pools before the trial process starts them.
+            env = dict(os.environ, OMP_NUM_THREADS=str(len(slot_cpus)))
+            env["MKL_NUM_THREADS"] = str(len(slot_cpus))
+            out_path = os.path.join(args.save_root, "process_%d.out" % num_launched)
+            with open(out_path, "w") as out_file:
+                running[slot] = subprocess.Popen(
+                    command,
+                    cwd=script_dir,
+                    env=env,
+                    stdout=out_file,
+                    stderr=subprocess.STDOUT,
+                )
+            num_launched += 1
 
+        # Wait for any trial process to finish.
+        time.sleep(POLL_INTERVAL)
+        for slot, process in list(running.items()):
+            returncode = process.poll()
+            if returncode is None:
+                continue
+            if returncode != 0:
+                logging.getLogger().warning(
+                    "Trial process on CPUs %s exited with code %d.",
+                    slots[slot],
+                    returncode,
+                )
+            del running[slot]
 
-def objective(trial: optuna.Trial) -> float:
+    study = optuna.load_study(
+        study_name=args.study_name, storage=get_storage(args.storage)
+    )
+    completed = study.get_trials(states=(optuna.trial.TrialState.COMPLETE,))
+    if completed:
+        logging.getLogger().info(
+            "Best trial %d: %f %s",
+            study.best_trial.number,
+            study.best_value,
+            study.best_params,
+        )
+
+
+def run_trial(args: argparse.Namespace) -> None:
+    """ Runs a single trial of the study, pinned to ``args.trial_cpus``. """
+    cpus = [int(cpu) for cpu in args.trial_cpus.split(",")]
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    study = optuna.load_study(
+        study_name=args.study_name, storage=get_storage(args.storage)
+    )
+    study.optimize(
+        functools.partial(
+            objective,
+            save_root=args.save_root,
+            num_threads=len(cpus),
+            keep_models=args.keep_models,
+        ),
+        n_trials=1,
+    )
+
+
+def objective(
+    trial: optuna.Trial, save_root: str, num_threads: int, keep_models: bool
+) -> float:
     """
     Optuna objective function. Should never be called explicitly.
 
@@ -45,18 +222,30 @@ def objective(trial: optuna.Trial) -> float:
     ----------
     trial : ``optuna.Trial``, required.
         The trial with which we define our hyperparameter suggestions.
+    save_root : ``str``.
+        Directory holding the save root of every trial.
+    num_threads : ``int``.
+        Number of threads used by torch in the trial.
+    keep_models : ``bool``.
+        Whether to keep the save root of the trial after it ends.
 
     Returns
     -------
     loss : ``float``.
         The output from the model call after the timeout value specified in ``snow.sh``.
+
+    Raises
+    ------
+    optuna.TrialPruned
+        If the pruner stopped the trial early based on its intermediate
+        ``policy_score`` values.
     """
 
     # Get settings and create environment.
     # HARDCODE
     settings_path = "bees/settings/settings.json"
     with open(settings_path, "r") as json_file:
-        settings = json.load(json_file)
+        settings: Dict[str, Any] = json.load(json_file)
 
     # Suggestions for policy hyperparameters.
     settings["algo"] = trial.suggest_categorical("algo", ["ppo"])
@@ -80,37 +269,37 @@ def objective(trial: optuna.Trial) -> float:
 
     # Hardcoded settings for optimization runs.
     settings["print_repr"] = False
-    # settings["trial"] = trial # Add back in for early pruning.
     settings["time_steps"] = 20480
     settings["aging_rate"] = 0.0001
     settings["mating_cooldown_len"] = 51200
+    settings["num_threads"] = num_threads
 
-    # Print out settings to temp file.
-    temp_dir = tempfile.mkdtemp()
-    temp_settings_path = os.path.join(temp_dir, "settings.json")
-    with open(temp_settings_path, "w") as temp_settings_file:
-        json.dump(settings, temp_settings_file)
+    # Each trial saves into its own directory, so trials never share files.
+    trial_root = os.path.join(save_root, "trial_%d" % trial.number)
+    os.makedirs(trial_root, exist_ok=True)
+    trial_settings_path = os.path.join(trial_root, "settings.json")
+    with open(trial_settings_path, "w") as trial_settings_file:
+        json.dump(settings, trial_settings_file)
 
-    # Get ``args`` object to pass to train().
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--load-from", default="", help="Saved directory to load from.")
-    parser.add_argument("--settings", default="", help="Settings file to use.")
-    parser.add_argument(
-        "--save-root",
-        default="./models/",
-        help="directory to save agent logs (default: ./models/)",
+    # Get ``args`` object to pass to train(). ``train()`` reports intermediate
+    # policy scores to ``trial`` and stops early if it should be pruned.
+    args = argparse.Namespace(
+        load_from="",
+        settings=trial_settings_path,
+        save_root=os.path.join(trial_root, "models"),
+        trial=trial,
     )
-    args = parser.parse_args()
-    args.settings = settings_path
-    args.trial = trial
 
     # Print settings and run training.
     print(settings)
-    loss = train(args)
+    try:
+        loss = train(args)
+    finally:
+        if not keep_models:
+            shutil.rmtree(trial_root)
 
-    # Cleanup
-    shutil.rmtree(temp_dir)
-    shutil.rmtree(args.save_root)
+    if trial.should_prune():
+        raise optuna.TrialPruned()
 
     return loss
 